@@ -0,0 +1,225 @@
+# benchmark.py
+
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import filter_records
+import flattened_to_record
+import generate_raw_export
+import raw_to_flattened
+import record_io
+
+# usage: python3 benchmark.py [--sizes 1000,10000,100000]
+#                             [--stages flatten,parse,...]
+#                             [--output_filename RESULTS_FILENAME]
+#                             [--work_dir DIR] [--seed SEED]
+
+# times each stage of the pipeline separately, over synthetic raw exports
+# (see generate_raw_export.py) of several sizes, and writes the results to a
+# json file:
+#
+#   flatten             raw_to_flattened.flatten_instream_to_outstream
+#   parse               flattened lines to records (record_model.Record),
+#                       behind RecordParser's cached column layout, as
+#                       flattened_to_record.py runs it.
+#   serialize_json      parsed records to json lines.
+#   serialize_textproto parsed records to textproto lines.
+#   filter              filter_records.filter_lines over json lines, with an
+#                       --exec block that reads record_proto.
+#
+# every stage runs in a fresh subprocess, so that its peak RSS is its own.
+# inputs a stage needs (e.g. the parsed records it serializes) are prepared
+# before its timer starts, but do count towards its peak RSS.
+
+default_sizes = (1000, 10000, 100000)
+default_output_filename = "benchmark_results.json"
+
+stages = ("flatten", "parse", "serialize_json", "serialize_textproto",
+        "filter")
+
+filter_exec = "to_emit = record_proto.filing_info.amount_usd > 10000"
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def read_flattened_lines(flattened_filename):
+    with open(flattened_filename, 'r') as infile:
+        return infile.readlines()
+
+
+def parse_all(lines):
+    record_parser = flattened_to_record.RecordParser()
+    return [record_parser.parse_line(line) for line in lines]
+
+
+def run_stage(stage, files):
+    # runs a single stage, in this process. returns (number of records,
+    # number of input bytes, seconds taken).
+    if stage == "flatten":
+        with open(files["raw"], 'r') as infile:
+            raw = infile.read()
+        outstream = io.StringIO()
+        start = time.perf_counter()
+        raw_to_flattened.flatten_instream_to_outstream(
+                io.StringIO(raw), outstream)
+        elapsed = time.perf_counter() - start
+        return (outstream.getvalue().count("\n"), len(raw.encode("utf-8")),
+                elapsed)
+
+    if stage == "parse":
+        lines = read_flattened_lines(files["flattened"])
+        start = time.perf_counter()
+        parse_all(lines)
+        elapsed = time.perf_counter() - start
+        return (len(lines), os.path.getsize(files["flattened"]), elapsed)
+
+    if stage in ("serialize_json", "serialize_textproto"):
+        output_mode = stage.split("_", 1)[1]
+        records = parse_all(read_flattened_lines(files["flattened"]))
+        start = time.perf_counter()
+        formatted = [record_io.format_record(record, output_mode)
+                for record in records]
+        elapsed = time.perf_counter() - start
+        # throughput is measured against the serialized output.
+        return (len(records),
+                sum([len(record.encode("utf-8")) + 1
+                    for record in formatted]),
+                elapsed)
+
+    if stage == "filter":
+        with open(files["json"], 'r') as infile:
+            json_lines = infile.read()
+        args = argparse.Namespace(exec=filter_exec, where=None)
+        start = time.perf_counter()
+        filter_records.filter_lines(io.StringIO(json_lines), io.StringIO(),
+                "json", "json", args)
+        elapsed = time.perf_counter() - start
+        return (json_lines.count("\n"), len(json_lines.encode("utf-8")),
+                elapsed)
+
+    raise ValueError("unknown stage: " + stage)
+
+
+def prepare_inputs(work_dir, num_records, seed):
+    # writes the raw export for a size, and the flattened and json files
+    # derived from it. returns their filenames.
+    prefix = os.path.join(work_dir, "export-" + str(num_records))
+    files = {
+        "raw": prefix + ".txt",
+        "flattened": prefix + ".flattened.txt",
+        "json": prefix + ".jsonlines",
+    }
+    generate_raw_export.write_raw_export(files["raw"], num_records, seed)
+    raw_to_flattened.flatten_by_filename(files["raw"], files["flattened"])
+    # the parser reports malformed records on stdout.
+    with open(os.devnull, 'w') as devnull:
+        stdout = sys.stdout
+        sys.stdout = devnull
+        try:
+            flattened_to_record.convert_flattened_file(
+                    files["flattened"], files["json"], "json")
+        finally:
+            sys.stdout = stdout
+    return files
+
+
+def measure_stage(stage, files):
+    # runs a stage in a subprocess, and returns its measurements.
+    output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--run_stage", stage,
+                "--files", json.dumps(files)],
+            check=True, stdout=subprocess.PIPE).stdout
+    return json.loads(output.decode("utf-8").splitlines()[-1])
+
+
+def run_benchmarks(sizes, selected_stages, work_dir, seed):
+    results = []
+    for num_records in sizes:
+        eprint("preparing " + str(num_records) + " records...")
+        files = prepare_inputs(work_dir, num_records, seed)
+        for stage in selected_stages:
+            result = {"stage": stage, "size": num_records}
+            result.update(measure_stage(stage, files))
+            results.append(result)
+            eprint("  {stage:20} {records:>9} records  {seconds:8.3f}s  "
+                    "{records_per_s:>10.0f} records/s  {mb_per_s:7.2f} MB/s  "
+                    "{peak_rss_kb:>8} KB peak RSS".format(**result))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark")
+    parser.add_argument("--sizes", type=str,
+            default=",".join([str(size) for size in default_sizes]),
+            help="comma-separated numbers of records to generate inputs "
+            + "with. default: " + ",".join(
+                [str(size) for size in default_sizes]))
+    parser.add_argument("--stages", type=str, default=",".join(stages),
+            help="comma-separated stages to time. default: all of "
+            + ",".join(stages))
+    parser.add_argument("--output_filename", type=str,
+            default=default_output_filename,
+            help="filename of the json result file. default: "
+            + default_output_filename)
+    parser.add_argument("--work_dir", type=str,
+            help="directory for the generated inputs. default: a temporary "
+            + "directory, removed afterwards.")
+    parser.add_argument("--seed", type=int,
+            default=generate_raw_export.default_seed,
+            help="random seed for the generated inputs.")
+    # internal: used to run a single stage in a subprocess.
+    parser.add_argument("--run_stage", type=str, help=argparse.SUPPRESS)
+    parser.add_argument("--files", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_stage:
+        num_records, num_bytes, seconds = run_stage(
+                args.run_stage, json.loads(args.files))
+        print(json.dumps({
+            "records": num_records,
+            "bytes": num_bytes,
+            "seconds": seconds,
+            "records_per_s": num_records / seconds if seconds else 0.0,
+            "mb_per_s": (num_bytes / (1024 * 1024) / seconds if seconds
+                else 0.0),
+            # kilobytes, on linux.
+            "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }))
+        sys.exit(0)
+
+    selected_stages = args.stages.split(",")
+    for stage in selected_stages:
+        if stage not in stages:
+            parser.error("unknown stage: " + stage)
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    if args.work_dir:
+        os.makedirs(args.work_dir, exist_ok=True)
+        results = run_benchmarks(sizes, selected_stages, args.work_dir,
+                args.seed)
+    else:
+        with tempfile.TemporaryDirectory() as work_dir:
+            results = run_benchmarks(sizes, selected_stages, work_dir,
+                    args.seed)
+
+    from google.protobuf.internal import api_implementation
+    with open(args.output_filename, 'w') as outfile:
+        json.dump({
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "protobuf_implementation": api_implementation.Type(),
+            "seed": args.seed,
+            "results": results,
+        }, outfile, indent=2)
+        outfile.write("\n")
+    eprint("wrote " + args.output_filename)
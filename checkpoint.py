@@ -0,0 +1,155 @@
+# checkpoint.py
+
+import hashlib
+import json
+import os
+import sys
+
+# checkpoints for resumable and incremental runs of raw_to_flattened.py and
+# flattened_to_record.py.
+#
+# while converting, a tool periodically records how far it got in a manifest
+# next to its output, <output_filename>.checkpoint: a json object with
+#
+#   params         the tool and the options its output depends on. a
+#                  checkpoint is only used by a run with the same params.
+#   input_offset   byte offset in the input up to which records are converted.
+#                  always the start of a record.
+#   output_offset  byte offset in the output where the records following
+#                  input_offset go. the output is truncated to it on resume.
+#   record_count   number of records in the output up to output_offset.
+#   input_hash,    hashes of the bytes leading up to each offset. a checkpoint
+#   output_hash    is only used if both still match, i.e. the input was at
+#                  most appended to, and the output wasn't touched.
+#   state          tool-specific state in effect at input_offset, e.g. the
+#                  column layout.
+#   complete       whether the run that wrote the checkpoint finished.
+#
+# a run that finishes leaves a final checkpoint at the start of the *last*
+# record, rather than at the end of the input: the last record might be
+# continued by whatever gets appended to the input next, so an --incremental
+# run always converts it again, along with everything after it.
+
+# bytes of input converted between checkpoints.
+default_checkpoint_interval = 64 * 1024 * 1024
+
+# the hashes cover this many bytes at the start of the file, and this many
+# bytes leading up to the offset.
+hash_window = 64 * 1024
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def manifest_filename(output_filename):
+    return output_filename + ".checkpoint"
+
+
+def prefix_hash(filename, offset):
+    # hash of the first 'offset' bytes of a file, sampled at both ends.
+    digest = hashlib.sha256(str(offset).encode("ascii"))
+    with open(filename, 'rb') as infile:
+        digest.update(infile.read(min(offset, hash_window)))
+        tail_start = max(offset - hash_window, 0)
+        infile.seek(tail_start)
+        digest.update(infile.read(offset - tail_start))
+    return digest.hexdigest()
+
+
+def stream_offset(stream):
+    # current byte offset of an output stream opened in text or binary mode,
+    # once everything written so far has been flushed.
+    stream.flush()
+    return os.lseek(stream.fileno(), 0, os.SEEK_CUR)
+
+
+class Checkpointer:
+    # reads and writes the checkpoint manifest for a single run.
+
+    def __init__(self, input_filename, output_filename, params,
+            interval=default_checkpoint_interval):
+        self.input_filename = input_filename
+        self.output_filename = output_filename
+        self.params = params
+        self.interval = interval
+        self.next_input_offset = interval
+
+    def resume_point(self, incremental=False):
+        # returns the checkpoint to resume from, as a dictionary, or None if
+        # the run should start from scratch. the checkpoint of a completed
+        # run is only used with 'incremental'.
+        filename = manifest_filename(self.output_filename)
+        if not os.path.exists(filename):
+            return None
+        with open(filename, 'r') as infile:
+            manifest = json.load(infile)
+
+        reason = None
+        if manifest.get("params") != self.params:
+            reason = "it was written with different options"
+        elif manifest["complete"] and not incremental:
+            reason = "the run it belongs to completed. (use --incremental to "
+            reason += "convert only what was appended since.)"
+        elif not os.path.exists(self.output_filename) or (
+                os.path.getsize(self.output_filename)
+                    < manifest["output_offset"]) or (
+                prefix_hash(self.output_filename, manifest["output_offset"])
+                    != manifest["output_hash"]):
+            reason = "the output file has changed since"
+        elif (os.path.getsize(self.input_filename)
+                    < manifest["input_offset"]) or (
+                prefix_hash(self.input_filename, manifest["input_offset"])
+                    != manifest["input_hash"]):
+            reason = "the input file has changed since"
+        if reason is not None:
+            eprint("not resuming from " + filename + ": " + reason)
+            return None
+
+        eprint("resuming from " + filename + " at input offset "
+                + str(manifest["input_offset"]) + " ("
+                + str(manifest["record_count"]) + " records done)")
+        self.next_input_offset = manifest["input_offset"] + self.interval
+        return manifest
+
+    def open_output(self, resume, binary):
+        # opens the output file for writing: from scratch, or truncated to
+        # the checkpoint's output offset and positioned at its end.
+        if resume is None:
+            return open(self.output_filename, 'wb' if binary else 'w')
+        os.truncate(self.output_filename, resume["output_offset"])
+        outfile = open(self.output_filename, 'r+b' if binary else 'r+')
+        outfile.seek(0, os.SEEK_END)
+        return outfile
+
+    def due(self, input_offset):
+        return input_offset >= self.next_input_offset
+
+    def save(self, input_offset, outstream, record_count, state=None,
+            complete=False, output_offset=None):
+        # output_offset defaults to the current offset of 'outstream'.
+        if output_offset is None:
+            output_offset = stream_offset(outstream)
+        else:
+            outstream.flush()
+        # the output has to be durable before the checkpoint pointing into
+        # it is.
+        os.fsync(outstream.fileno())
+        manifest = {
+            "params": self.params,
+            "input_offset": input_offset,
+            "output_offset": output_offset,
+            "record_count": record_count,
+            "input_hash": prefix_hash(self.input_filename, input_offset),
+            "output_hash": prefix_hash(self.output_filename, output_offset),
+            "state": state,
+            "complete": complete,
+        }
+        filename = manifest_filename(self.output_filename)
+        # written to the side and renamed into place, so a crash never
+        # leaves a partial manifest behind.
+        with open(filename + ".tmp", 'w') as outfile:
+            json.dump(manifest, outfile, indent=2)
+            outfile.write("\n")
+        os.replace(filename + ".tmp", filename)
+        self.next_input_offset = input_offset + self.interval
@@ -0,0 +1,428 @@
+# columnar_filter.py
+
+import re
+import numpy as np
+import columnar_store
+import filing_dates
+
+# vectorized record filtering for filter_records.py --where.
+#
+# instead of running a python block per record, a batch of records is loaded
+# into numpy arrays, one per column, and a filter expression is evaluated over
+# whole columns at once, producing a boolean mask of the records to emit.
+#
+# columns:
+#   record_num     integer
+#   amount_usd     integer (filing_info.amount_usd)
+#   creditor       string (creditor.name)
+#   category       string (category of each filing component)
+#   filing_office  string (filing office of each filing component)
+#   filing_date    date (filing_info.filing_date)
+#
+# date columns hold days since 1970-01-01, and are compared to date literals,
+# 'YYYY-MM-DD' (or 'M/D/YYYY'), which are converted to days once, when the
+# expression is parsed; a date range is an integer compare over the batch:
+#   filing_date >= '2001-01-01' & filing_date < '2002-01-01'
+# records without a valid filing date satisfy no comparison on it, nor its
+# negation: ~(filing_date < '2001-01-01') doesn't select them either.
+#
+# string columns are dictionary-encoded: each distinct value in the batch is
+# assigned an integer code, so comparing a string column to a literal is an
+# integer compare over the batch.
+#
+# category and filing_office hold a value per filing component. a comparison
+# on one holds for a record if it holds for any of its components, as
+# "category == 'JUDGMENT RELEASE'" should; '!=' is its negation, so
+# "category != 'JUDGMENT RELEASE'" selects records with no such component.
+# each comparison looks at the components on its own: "category == 'A' &
+# filing_office == 'B'" doesn't require A and B to be of the same component.
+# a record without components has a single empty value.
+#
+# expression syntax, loosest-binding first:
+#   a | b, a or b        either side holds
+#   a & b, a and b       both sides hold
+#   ~a, not a            negation
+#   column OP literal    OP is one of == != < <= > >=. ordering comparisons
+#                        are only supported for integer columns.
+#   column in (literal, literal, ...)
+#   ( ... )
+#
+# unlike python (and numpy), comparisons bind tighter than '&' and '|', so
+# "amount_usd > 10000 & creditor == 'NEFAROUS GROUP LLC'" means what it says.
+#
+# anything the expression language can't express can be done with --exec.
+
+integer_columns = ("record_num", "amount_usd")
+string_columns = ("creditor", "category", "filing_office")
+component_columns = ("category", "filing_office")
+date_columns = ("filing_date",)
+known_columns = integer_columns + string_columns + date_columns
+
+# value of a date column for records without a valid date.
+missing_date = columnar_store.missing_date
+
+comparison_ops = ("==", "!=", "<", "<=", ">", ">=")
+
+# comparison op to use when the literal is on the left-hand side.
+flipped_ops = {"==": "==", "!=": "!=", "<": ">", "<=": ">=", ">": "<",
+        ">=": "<="}
+
+token_pattern = re.compile(r"""
+    \s*(?:
+        (?P<number>-?[0-9]+)
+      | (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+      | (?P<name>[A-Za-z_][A-Za-z_0-9]*)
+      | (?P<op>==|!=|<=|>=|<|>|&|\||~|\(|\)|,)
+    )""", re.VERBOSE)
+
+
+class WhereSyntaxError(ValueError):
+    pass
+
+
+def tokenize(expression):
+    tokens = []
+    pos = 0
+    expression = expression.rstrip()
+    while pos < len(expression):
+        match = token_pattern.match(expression, pos)
+        if not match:
+            raise WhereSyntaxError(
+                    "unexpected character at position " + str(pos) + ": "
+                    + expression[pos:])
+        pos = match.end()
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == "number":
+            tokens.append(("literal", int(text)))
+        elif kind == "string":
+            # strip quotes and resolve backslash escapes.
+            tokens.append(("literal",
+                    re.sub(r"\\(.)", r"\1", text[1:-1])))
+        elif kind == "name" and text in ("and", "or", "not", "in"):
+            tokens.append(("op", {"and": "&", "or": "|", "not": "~",
+                    "in": "in"}[text]))
+        else:
+            tokens.append((kind, text))
+    return tokens
+
+
+class WhereExpression:
+    # a parsed --where expression. parsing happens once; evaluate() is called
+    # once per batch.
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = tokenize(expression)
+        self.pos = 0
+        self.columns = set()  # columns referenced by the expression.
+        self.tree = self.parse_or()
+        if self.pos != len(self.tokens):
+            raise WhereSyntaxError(
+                    "unexpected trailing input in where expression: "
+                    + expression)
+        del self.tokens
+
+    # recursive-descent parser. the tree is made of tuples:
+    #   ("or", left, right), ("and", left, right), ("not", operand),
+    #   ("compare", column, op, literal), ("in", column, [literals]).
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def take(self, kind=None, text=None):
+        token = self.peek()
+        if token[0] is None:
+            raise WhereSyntaxError("unexpected end of where expression: "
+                    + self.expression)
+        if (kind and token[0] != kind) or (text and token[1] != text):
+            raise WhereSyntaxError(
+                    "expected " + (text or kind) + " in where expression: "
+                    + self.expression)
+        self.pos += 1
+        return token
+
+    def parse_or(self):
+        tree = self.parse_and()
+        while self.peek() == ("op", "|"):
+            self.take()
+            tree = ("or", tree, self.parse_and())
+        return tree
+
+    def parse_and(self):
+        tree = self.parse_not()
+        while self.peek() == ("op", "&"):
+            self.take()
+            tree = ("and", tree, self.parse_not())
+        return tree
+
+    def parse_not(self):
+        if self.peek() == ("op", "~"):
+            self.take()
+            return ("not", self.parse_not())
+        if self.peek() == ("op", "("):
+            self.take()
+            tree = self.parse_or()
+            self.take("op", ")")
+            return tree
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        left = self.take()
+        op = self.take("op")[1]
+        if op == "in":
+            column = self.column_name(left)
+            self.take("op", "(")
+            literals = [self.take("literal")[1]]
+            while self.peek() == ("op", ","):
+                self.take()
+                literals.append(self.take("literal")[1])
+            self.take("op", ")")
+            if column in date_columns:
+                literals = [self.date_literal(column, literal)
+                        for literal in literals]
+            return ("in", column, literals)
+
+        if op not in comparison_ops:
+            raise WhereSyntaxError("expected comparison in where expression: "
+                    + self.expression)
+        if self.peek()[0] is None:
+            raise WhereSyntaxError("expected a value after '" + op
+                    + "' in where expression: " + self.expression)
+        right = self.take()
+        if left[0] == "literal":
+            # normalize to column-on-the-left.
+            left, right = right, left
+            op = flipped_ops[op]
+        column = self.column_name(left)
+        if right[0] != "literal":
+            raise WhereSyntaxError("can only compare columns to literals: "
+                    + self.expression)
+        literal = right[1]
+
+        if column in string_columns:
+            if not isinstance(literal, str):
+                raise WhereSyntaxError(
+                        column + " can only be compared to a string")
+            if op not in ("==", "!="):
+                raise WhereSyntaxError(
+                        "ordering comparisons aren't supported for string "
+                        + "column " + column + "; use --exec")
+        elif column in date_columns:
+            literal = self.date_literal(column, literal)
+        elif not isinstance(literal, int):
+            raise WhereSyntaxError(
+                    column + " can only be compared to an integer")
+        return ("compare", column, op, literal)
+
+    def column_name(self, token):
+        kind, name = token
+        if kind != "name" or name not in known_columns:
+            raise WhereSyntaxError("unknown column in where expression: "
+                    + str(name) + ". known columns: "
+                    + ", ".join(known_columns))
+        self.columns.add(name)
+        return name
+
+    def date_literal(self, column, literal):
+        # returns a date literal as days since 1970-01-01.
+        if isinstance(literal, str):
+            try:
+                return filing_dates.date_to_days(literal)
+            except ValueError:
+                pass
+        raise WhereSyntaxError(column + " can only be compared to a date, "
+                + "e.g. '2001-12-31': " + str(literal))
+
+    def evaluate(self, batch):
+        # returns a boolean mask over the records in a ColumnBatch.
+        return self.evaluate_tree(self.tree, batch)[0]
+
+    def evaluate_tree(self, tree, batch):
+        # returns two boolean masks: the records 'tree' holds for, and the
+        # ones it fails for. a comparison on a missing date does neither, so
+        # negating it doesn't select the record.
+        kind = tree[0]
+        if kind == "or":
+            left = self.evaluate_tree(tree[1], batch)
+            right = self.evaluate_tree(tree[2], batch)
+            return left[0] | right[0], left[1] & right[1]
+        if kind == "and":
+            left = self.evaluate_tree(tree[1], batch)
+            right = self.evaluate_tree(tree[2], batch)
+            return left[0] & right[0], left[1] | right[1]
+        if kind == "not":
+            holds, fails = self.evaluate_tree(tree[1], batch)
+            return fails, holds
+
+        column_name = tree[1]
+        column = batch.columns[column_name]
+        if kind == "in":
+            if column_name in string_columns:
+                mask = column.isin(tree[2])
+            else:
+                # (missing dates never equal a date literal.)
+                mask = np.isin(column, tree[2])
+        elif column_name in string_columns:
+            mask = column.equals(tree[3])
+            if tree[2] == "!=":
+                mask = ~mask
+        else:
+            mask = compare(column, tree[2], tree[3])
+        if column_name in date_columns:
+            present = column != missing_date
+            return mask & present, ~mask & present
+        return mask, ~mask
+
+
+def compare(column, op, literal):
+    # compares an integer column to a literal.
+    if op == "==":
+        return column == literal
+    if op == "!=":
+        return column != literal
+    if op == "<":
+        return column < literal
+    if op == "<=":
+        return column <= literal
+    if op == ">":
+        return column > literal
+    return column >= literal
+
+
+class DictionaryColumn:
+    # a dictionary-encoded string column: integer codes, plus the distinct
+    # values they stand for.
+
+    def __init__(self, values):
+        index = {}
+        codes = [index.setdefault(value, len(index)) for value in values]
+        self.codes = np.array(codes, dtype=np.int32)
+        self.index = index
+
+    def equals(self, literal):
+        code = self.index.get(literal)
+        if code is None:
+            return np.zeros(len(self.codes), dtype=bool)
+        return self.codes == code
+
+    def isin(self, literals):
+        codes = [self.index[literal] for literal in literals
+                if literal in self.index]
+        return np.isin(self.codes, codes)
+
+
+class ComponentColumn:
+    # a dictionary-encoded string column with a value per filing component:
+    # the values of every record's components, in order, and the offset of
+    # each record's first value. every record has at least one value, so a
+    # comparison's mask over the values reduces to one over the records, by
+    # whether it holds for any of them.
+
+    def __init__(self, record_values):
+        starts = []
+        values = []
+        for values_of_record in record_values:
+            starts.append(len(values))
+            values.extend(values_of_record)
+        self.values = DictionaryColumn(values)
+        self.starts = np.array(starts, dtype=np.intp)
+
+    def any(self, mask):
+        if not len(self.starts):
+            return np.zeros(0, dtype=bool)
+        return np.logical_or.reduceat(mask, self.starts)
+
+    def equals(self, literal):
+        return self.any(self.values.equals(literal))
+
+    def isin(self, literals):
+        return self.any(self.values.isin(literals))
+
+
+def dict_component_values(record, name):
+    components = record.get("filing_info", {}).get("components")
+    if not components:
+        return [""]
+    return [component.get(name, "") for component in components]
+
+
+def proto_component_values(record_proto, name):
+    components = record_proto.filing_info.components
+    if not components:
+        return [""]
+    return [getattr(component, name) for component in components]
+
+
+def raw_filing_date_to_column(raw_filing_date):
+    # for records written before filing dates were parsed.
+    if not raw_filing_date:
+        return missing_date
+    return columnar_store.filing_date_to_days(raw_filing_date)
+
+
+def dict_filing_date(record):
+    filing_info = record.get("filing_info", {})
+    if "filing_date" in filing_info:
+        return filing_info["filing_date"]
+    return raw_filing_date_to_column(filing_info.get("raw_filing_date"))
+
+
+def proto_filing_date(record_proto):
+    filing_info = record_proto.filing_info
+    if filing_info.HasField("filing_date"):
+        return filing_info.filing_date
+    return raw_filing_date_to_column(filing_info.raw_filing_date)
+
+
+# extract each column from a record dictionary (as loaded from json).
+dict_extractors = {
+    "record_num": lambda record: record.get("record_num", 0),
+    "amount_usd": lambda record:
+        record.get("filing_info", {}).get("amount_usd", 0),
+    "creditor": lambda record: record.get("creditor", {}).get("name", ""),
+    "category": lambda record: dict_component_values(record, "category"),
+    "filing_office": lambda record:
+        dict_component_values(record, "filing_office"),
+    "filing_date": dict_filing_date,
+}
+
+# extract each column from a Record proto.
+proto_extractors = {
+    "record_num": lambda record_proto: record_proto.record_num,
+    "amount_usd": lambda record_proto: record_proto.filing_info.amount_usd,
+    "creditor": lambda record_proto: record_proto.creditor.name,
+    "category": lambda record_proto:
+        proto_component_values(record_proto, "category"),
+    "filing_office": lambda record_proto:
+        proto_component_values(record_proto, "filing_office"),
+    "filing_date": proto_filing_date,
+}
+
+
+class ColumnBatch:
+    # a batch of records, loaded column by column. only the columns named in
+    # 'column_names' are built.
+
+    def __init__(self, records, column_names, extractors):
+        self.num_records = len(records)
+        self.columns = {}
+        for name in column_names:
+            extract = extractors[name]
+            values = [extract(record) for record in records]
+            if name in component_columns:
+                self.columns[name] = ComponentColumn(values)
+            elif name in string_columns:
+                self.columns[name] = DictionaryColumn(values)
+            else:
+                self.columns[name] = np.array(values, dtype=np.int64)
+
+    @classmethod
+    def from_dicts(cls, records, column_names):
+        return cls(records, column_names, dict_extractors)
+
+    @classmethod
+    def from_recordprotos(cls, record_protos, column_names):
+        return cls(record_protos, column_names, proto_extractors)
@@ -0,0 +1,400 @@
+# columnar_store.py
+
+import argparse
+import filing_dates
+import json
+import os
+import sys
+import numpy as np
+import record_io
+import record_pb2
+
+# usage: python3 columnar_store.py export INPUT_FILENAME STORE_DIR
+#                                  [--input_mode {textproto,json,binary,...}]
+#        python3 columnar_store.py info STORE_DIR
+
+# on-disk columnar layout for parsed records, so that analyses don't have to
+# re-scan (and re-parse) multi-gb json lines files.
+#
+# a store is a directory of .npy files, one per column, plus meta.json. every
+# array is opened with np.load(mmap_mode='r'), i.e. as a np.memmap, so
+# opening a store is instant and a scan only pages in the columns it touches.
+#
+# there are three tables, each with one row per:
+#   record     Record
+#   debtor     Debtor, in record order
+#   component  FilingComponent, in record order
+# and one list column, address_line (Address.raw_lines), in debtor order.
+#
+# scalar columns are fixed-width arrays: 'record.amount_usd.npy'. string
+# columns are a uint8 blob of utf-8 text, plus int64 offsets into it, with one
+# more offset than there are rows: 'record.creditor_name.blob.npy' and
+# 'record.creditor_name.offsets.npy'. row i is blob[offsets[i]:offsets[i+1]].
+#
+# child rows are linked to their parent the same way: the debtors of record i
+# are debtor rows record.debtor_offsets[i] to record.debtor_offsets[i+1].
+#
+# filing dates are stored parsed, as days since 1970-01-01, with missing or
+# unparseable dates stored as missing_date.
+#
+# version 2 added debtor.cluster_id; version 1 stores have to be exported
+# again.
+
+store_version = 2
+
+missing_date = np.iinfo(np.int32).min
+
+# number of values buffered per column before they're written out.
+spill_batch_size = 65536
+
+# number of rows copied at a time when converting spilled columns to .npy.
+copy_batch_size = 1 << 22
+
+record_int_columns = {
+    "record_num": np.int32,
+    "sequence_no": np.int32,
+    "amount_usd": np.int64,
+    "filing_date": np.int32,
+}
+record_string_columns = ("amount", "raw_filing_date", "certificate_number",
+        "creditor_name")
+debtor_int_columns = {
+    "cluster_id": np.int32,
+}
+debtor_string_columns = ("name", "lex_id", "parsed_surname",
+        "parsed_forenames")
+component_int_columns = {
+    "filing_date": np.int32,
+}
+component_string_columns = ("category", "filing_number", "raw_filing_date",
+        "filing_office")
+
+
+def filing_date_to_days(raw_filing_date):
+    # parses an M/D/YYYY date into days since 1970-01-01, or missing_date.
+    days = filing_dates.raw_filing_date_to_days(raw_filing_date)
+    return missing_date if days is None else days
+
+
+class _ArraySpill:
+    # appends values to a fixed-width column, buffering them in memory and
+    # spilling them to a raw temporary file. finish() converts the raw file
+    # to .npy, so memory use doesn't grow with the size of the store.
+
+    def __init__(self, path, dtype):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.spill_path = path + ".tmp"
+        self.spill_file = open(self.spill_path, 'wb')
+        self.buffer = []
+        self.count = 0
+
+    def append(self, value):
+        self.buffer.append(value)
+        if len(self.buffer) >= spill_batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            np.asarray(self.buffer, dtype=self.dtype).tofile(self.spill_file)
+            self.count += len(self.buffer)
+            self.buffer = []
+
+    def finish(self):
+        self.flush()
+        self.spill_file.close()
+        out = np.lib.format.open_memmap(
+                self.path, mode='w+', dtype=self.dtype, shape=(self.count,))
+        if self.count:
+            spilled = np.memmap(self.spill_path, dtype=self.dtype, mode='r',
+                    shape=(self.count,))
+            for start in range(0, self.count, copy_batch_size):
+                out[start:start + copy_batch_size] = (
+                        spilled[start:start + copy_batch_size])
+            del spilled
+        out.flush()
+        del out
+        os.remove(self.spill_path)
+
+
+class _StringSpill:
+    # appends values to a string column: a blob of utf-8 text plus offsets.
+
+    def __init__(self, path_prefix):
+        self.offsets = _ArraySpill(path_prefix + ".offsets.npy", np.int64)
+        self.blob = _ArraySpill(path_prefix + ".blob.npy", np.uint8)
+        # the blob is written straight to its spill file.
+        self.blob_size = 0
+        self.offsets.append(0)
+
+    def append(self, value):
+        encoded = value.encode("utf-8")
+        self.blob.spill_file.write(encoded)
+        self.blob_size += len(encoded)
+        self.offsets.append(self.blob_size)
+
+    def finish(self):
+        self.blob.count = self.blob_size
+        self.offsets.finish()
+        self.blob.finish()
+
+
+class ColumnarStoreWriter:
+    # writes records to a new store, one at a time.
+
+    def __init__(self, store_dir):
+        os.makedirs(store_dir, exist_ok=True)
+        self.store_dir = store_dir
+        self.num_records = 0
+        self.num_debtors = 0
+        self.num_components = 0
+        self.num_address_lines = 0
+
+        def path(name):
+            return os.path.join(store_dir, name)
+
+        self.record_ints = {name: _ArraySpill(path("record." + name + ".npy"),
+                dtype) for name, dtype in record_int_columns.items()}
+        self.record_strings = {name: _StringSpill(path("record." + name))
+                for name in record_string_columns}
+        self.debtor_offsets = _ArraySpill(
+                path("record.debtor_offsets.npy"), np.int64)
+        self.component_offsets = _ArraySpill(
+                path("record.component_offsets.npy"), np.int64)
+
+        self.debtor_ints = {name: _ArraySpill(path("debtor." + name + ".npy"),
+                dtype) for name, dtype in debtor_int_columns.items()}
+        self.debtor_strings = {name: _StringSpill(path("debtor." + name))
+                for name in debtor_string_columns}
+        self.address_line_offsets = _ArraySpill(
+                path("debtor.address_line_offsets.npy"), np.int64)
+        self.address_lines = _StringSpill(path("address_line.text"))
+
+        self.component_ints = {name: _ArraySpill(
+                path("component." + name + ".npy"), dtype)
+                for name, dtype in component_int_columns.items()}
+        self.component_strings = {name: _StringSpill(
+                path("component." + name))
+                for name in component_string_columns}
+
+        self.debtor_offsets.append(0)
+        self.component_offsets.append(0)
+        self.address_line_offsets.append(0)
+
+    def write(self, record):
+        # 'record' is a Record proto or a record_model.Record. unset fields
+        # are stored as empty strings or zero either way.
+        filing_info = record.filing_info
+        self.record_ints["record_num"].append(record.record_num or 0)
+        self.record_ints["sequence_no"].append(record.sequence_no or 0)
+        self.record_ints["amount_usd"].append(filing_info.amount_usd or 0)
+        self.record_ints["filing_date"].append(
+                filing_date_to_days(filing_info.raw_filing_date or ""))
+        self.record_strings["amount"].append(filing_info.amount or "")
+        self.record_strings["raw_filing_date"].append(
+                filing_info.raw_filing_date or "")
+        self.record_strings["certificate_number"].append(
+                filing_info.certificate_number or "")
+        self.record_strings["creditor_name"].append(
+                record.creditor.name or "")
+
+        for debtor in record.debtors:
+            for name in debtor_int_columns:
+                self.debtor_ints[name].append(getattr(debtor, name) or 0)
+            for name in debtor_string_columns:
+                self.debtor_strings[name].append(getattr(debtor, name) or "")
+            for address_line in debtor.address.raw_lines:
+                self.address_lines.append(address_line)
+            self.num_address_lines += len(debtor.address.raw_lines)
+            self.address_line_offsets.append(self.num_address_lines)
+        self.num_debtors += len(record.debtors)
+        self.debtor_offsets.append(self.num_debtors)
+
+        for component in filing_info.components:
+            self.component_ints["filing_date"].append(
+                    filing_date_to_days(component.raw_filing_date or ""))
+            for name in component_string_columns:
+                self.component_strings[name].append(
+                        getattr(component, name) or "")
+        self.num_components += len(filing_info.components)
+        self.component_offsets.append(self.num_components)
+
+        self.num_records += 1
+
+    def close(self):
+        spills = (list(self.record_ints.values())
+                + list(self.record_strings.values())
+                + [self.debtor_offsets, self.component_offsets,
+                    self.address_line_offsets, self.address_lines]
+                + list(self.debtor_ints.values())
+                + list(self.debtor_strings.values())
+                + list(self.component_ints.values())
+                + list(self.component_strings.values()))
+        for spill in spills:
+            spill.finish()
+
+        # meta.json is written last, so a store without one is incomplete.
+        meta = {
+            "version": store_version,
+            "num_records": self.num_records,
+            "num_debtors": self.num_debtors,
+            "num_components": self.num_components,
+            "num_address_lines": self.num_address_lines,
+        }
+        with open(os.path.join(self.store_dir, "meta.json"), 'w') as outfile:
+            json.dump(meta, outfile, indent=2)
+
+
+class StringColumn:
+    # read-only view of a string column in a store.
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, ind):
+        start, end = self.offsets[ind], self.offsets[ind + 1]
+        return self.blob[start:end].tobytes().decode("utf-8")
+
+    def slice(self, start, end):
+        return [self[ind] for ind in range(start, end)]
+
+
+class ColumnarStore:
+    # memory-mapped reader for a store written by ColumnarStoreWriter.
+    # columns are opened lazily, on first use, e.g.:
+    #
+    #   store = ColumnarStore("store_dir")
+    #   amounts = store.column("record.amount_usd")
+    #   creditors = store.strings("record.creditor_name")
+    #   big = (amounts > 10000).nonzero()[0]
+    #   names = [creditors[ind] for ind in big]
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, "meta.json")) as infile:
+            self.meta = json.load(infile)
+        if self.meta["version"] != store_version:
+            raise ValueError("unsupported columnar store version: "
+                    + str(self.meta["version"]))
+        self.num_records = self.meta["num_records"]
+        self._columns = {}
+
+    def __len__(self):
+        return self.num_records
+
+    def column(self, name):
+        # fixed-width column (or offsets array), e.g. "record.amount_usd".
+        if name not in self._columns:
+            self._columns[name] = np.load(
+                    os.path.join(self.store_dir, name + ".npy"),
+                    mmap_mode='r')
+        return self._columns[name]
+
+    def strings(self, name):
+        # string column, e.g. "debtor.lex_id".
+        return StringColumn(self.column(name + ".offsets"),
+                self.column(name + ".blob"))
+
+    def debtor_rows(self, record_ind):
+        offsets = self.column("record.debtor_offsets")
+        return range(offsets[record_ind], offsets[record_ind + 1])
+
+    def component_rows(self, record_ind):
+        offsets = self.column("record.component_offsets")
+        return range(offsets[record_ind], offsets[record_ind + 1])
+
+    def record(self, record_ind):
+        # reassembles a Record proto from the store. fields stored as empty
+        # strings or zero are left unset.
+        record_proto = record_pb2.Record()
+        for name in ("record_num", "sequence_no"):
+            value = int(self.column("record." + name)[record_ind])
+            if value:
+                setattr(record_proto, name, value)
+
+        for debtor_ind in self.debtor_rows(record_ind):
+            debtor_proto = record_proto.debtors.add()
+            for name in debtor_string_columns:
+                value = self.strings("debtor." + name)[debtor_ind]
+                if value:
+                    setattr(debtor_proto, name, value)
+            for name in debtor_int_columns:
+                value = int(self.column("debtor." + name)[debtor_ind])
+                if value:
+                    setattr(debtor_proto, name, value)
+            line_offsets = self.column("debtor.address_line_offsets")
+            debtor_proto.address.raw_lines.extend(
+                    self.strings("address_line.text").slice(
+                        line_offsets[debtor_ind],
+                        line_offsets[debtor_ind + 1]))
+
+        filing_info = record_proto.filing_info
+        for name in ("amount", "raw_filing_date", "certificate_number"):
+            value = self.strings("record." + name)[record_ind]
+            if value:
+                setattr(filing_info, name, value)
+        if filing_info.amount:
+            filing_info.amount_usd = int(
+                    self.column("record.amount_usd")[record_ind])
+        filing_date = int(self.column("record.filing_date")[record_ind])
+        if filing_date != missing_date:
+            filing_info.filing_date = filing_date
+        for component_ind in self.component_rows(record_ind):
+            component_proto = filing_info.components.add()
+            for name in component_string_columns:
+                value = self.strings("component." + name)[component_ind]
+                if value:
+                    setattr(component_proto, name, value)
+            filing_date = int(
+                    self.column("component.filing_date")[component_ind])
+            if filing_date != missing_date:
+                component_proto.filing_date = filing_date
+
+        creditor_name = self.strings("record.creditor_name")[record_ind]
+        if creditor_name:
+            record_proto.creditor.name = creditor_name
+        return record_proto
+
+
+def export_records(instream, store_dir, input_mode):
+    store_writer = ColumnarStoreWriter(store_dir)
+    for record in record_io.iter_records(instream, input_mode, as_model=True):
+        store_writer.write(record)
+    store_writer.close()
+    return store_writer
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="columnar_store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export",
+            help="write the records in a record file to a new store.")
+    export_parser.add_argument("input_filename", type=str,
+            help="filename of input records.")
+    export_parser.add_argument("store_dir", type=str,
+            help="directory to write the store to.")
+    export_parser.add_argument("--input_mode", type=str,
+            choices=record_io.record_modes, default="json",
+            help="format of input records. default: json")
+
+    info_parser = subparsers.add_parser("info",
+            help="print the row counts of a store.")
+    info_parser.add_argument("store_dir", type=str,
+            help="directory of the store.")
+
+    args = parser.parse_args()
+
+    if args.command == "export":
+        infile = open(args.input_filename,
+                'rb' if record_io.is_binary_mode(args.input_mode) else 'r')
+        export_records(infile, args.store_dir, args.input_mode)
+        infile.close()
+    elif args.command == "info":
+        store = ColumnarStore(args.store_dir)
+        json.dump(store.meta, sys.stdout, indent=2)
+        print()
@@ -0,0 +1,71 @@
+# dead_letters.py
+
+import json
+import os
+
+# dead-letter side output of flattened_to_record.py: the input lines of the
+# records that couldn't be parsed, kept so that after a parser fix they can be
+# parsed again on their own (flattened_to_record.py --retry_from), without
+# re-running the whole input. one json object per line, with
+#
+#   sequence     position of the record in the output, counting from 0. the
+#                output holds an empty record there.
+#   line_number  line of the record in the flattened input, counting from 1.
+#                (flattened files hold one record per line.)
+#   code         the kind of parse error, e.g. "amount"; see
+#                flattened_to_record.RecordParseError.
+#   message      the error message.
+#   line         the flattened input line.
+#   layout       the column layout in effect for the record (or null), so
+#                that it's parsed again exactly as it was the first time.
+
+
+def make_entry(sequence, line, error, layout):
+    # 'error' is the RecordParseError the record failed with, and 'layout'
+    # the ColumnLayout in effect for it (or None). entries are plain
+    # dictionaries, so that they can be handed back from worker processes.
+    return {
+        "sequence": sequence,
+        "code": error.code,
+        "message": str(error),
+        "line": line.rstrip("\n"),
+        "layout": layout.as_dict() if layout is not None else None,
+    }
+
+
+def read_dead_letters(filename):
+    with open(filename, 'r') as infile:
+        return [json.loads(line) for line in infile if line.strip()]
+
+
+class DeadLetterWriter:
+    def __init__(self, filename, resume_count=None):
+        # when resuming a run whose output already holds 'resume_count'
+        # records, the entries for those records are kept, and the rest
+        # dropped: they'll be written again as the run goes on.
+        kept = []
+        if resume_count is not None and os.path.exists(filename):
+            kept = [entry for entry in read_dead_letters(filename)
+                    if entry["sequence"] < resume_count]
+        self.filename = filename
+        self.outfile = open(filename, 'w')
+        self.count = 0
+        for entry in kept:
+            self.write(entry)
+
+    def write(self, entry, base=0):
+        # 'base' is added to the entry's sequence, e.g. for entries numbered
+        # from the start of a batch of records.
+        sequence = entry["sequence"] + base
+        entry = dict({"sequence": sequence, "line_number": sequence + 1},
+                **{key: value for key, value in entry.items()
+                    if key not in ("sequence", "line_number")})
+        self.outfile.write(json.dumps(entry) + "\n")
+        self.count += 1
+
+    def flush(self):
+        self.outfile.flush()
+        os.fsync(self.outfile.fileno())
+
+    def close(self):
+        self.outfile.close()
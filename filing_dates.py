@@ -0,0 +1,46 @@
+# filing_dates.py
+
+import datetime
+
+# filing dates appear in records as M/D/YYYY strings (raw_filing_date), and
+# are stored parsed next to them (filing_date) as days since 1970-01-01, so
+# that date comparisons are integer compares.
+
+epoch_ordinal = datetime.date(1970, 1, 1).toordinal()
+
+_raw_filing_date_days = {}
+
+
+def raw_filing_date_to_days(raw_filing_date):
+    # parses an M/D/YYYY date into days since 1970-01-01, or None if it isn't
+    # a valid date. memoized, since a dataset only has a few thousand
+    # distinct dates.
+    try:
+        return _raw_filing_date_days[raw_filing_date]
+    except KeyError:
+        pass
+    try:
+        month, day, year = raw_filing_date.strip().split("/")
+        days = (datetime.date(int(year), int(month), int(day)).toordinal()
+                - epoch_ordinal)
+    except ValueError:
+        days = None
+    _raw_filing_date_days[raw_filing_date] = days
+    return days
+
+
+def date_to_days(text):
+    # parses a date given in a query, either YYYY-MM-DD or M/D/YYYY (as in
+    # records), into days since 1970-01-01. raises ValueError if it isn't a
+    # valid date.
+    text = text.strip()
+    if "/" in text:
+        days = raw_filing_date_to_days(text)
+        if days is None:
+            raise ValueError("invalid date: " + text)
+        return days
+    return datetime.date.fromisoformat(text).toordinal() - epoch_ordinal
+
+
+def days_to_date(days):
+    return datetime.date.fromordinal(days + epoch_ordinal)
@@ -1,28 +1,51 @@
 # filter_records.py
 
 import argparse
+import itertools
 import json
+import record_io
+import record_json
 import record_pb2
+import run_metrics
 import sys
-import google.protobuf.json_format as json_format
+import time
 import google.protobuf.text_format as text_format
 
 # usage:
-# filter_records.py --exec EXEC
-#                   [--input_mode {textproto,json}]
-#                   [--output_mode {textproto,json}]
+# filter_records.py [--exec EXEC]
+#                   [--where WHERE]
+#                   [--input_mode {textproto,json,dictjson,binary,...}]
+#                   [--output_mode {textproto,json,dictjson,binary,...}]
 #                   [--input_filename INPUT_FILENAME]
 #                   [--output_filename OUTPUT_FILENAME]
+#                   [--metrics_filename METRICS_FILENAME]
+#                   [--metrics_format {json,prometheus}]
+#                   [--progress_interval SECONDS]
 
 # EXEC is a block of python which has access to the locals 'record_proto',
 # 'record' (a dictionary that serializes to the input json), and 'to_emit'.
 # EXEC is executed once per input record. if 'to_emit' evaluates to True after
 # the block is run, then the record is included in the output.
 #
+# EXEC is compiled once, and only the locals it actually names are built for
+# each record; e.g. a block that only reads 'record' never needs a proto to be
+# parsed from json input, except for records that pass.
+#
+# changes EXEC makes to 'record_proto' or 'record' don't show up in the
+# output, in any output mode: records are written as they were read.
+#
 # Do *NOT* write to stdout in EXEC.
 #
 # By default, reads json records from stdio, one record per line, and writes to
-# stdout.
+# stdout. The binary modes read and write a length-delimited stream of
+# serialized records (binary), or a framed RecordCollection file (collection);
+# see record_io.py.
+#
+# WHERE is a filter expression over a few common columns, such as
+# "amount_usd > 10000 & creditor == 'NEFAROUS GROUP LLC'". it's evaluated over
+# batches of records at once with numpy, which is much faster than EXEC for
+# the filters it can express; see columnar_filter.py for the syntax. if both
+# are supplied, EXEC only runs for records which pass WHERE.
 #
 # If input_filename is supplied, reads input from that file instead.
 # If output_filename is supplied, writes to that file instead.
@@ -36,12 +59,16 @@ def eprint(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
 
 
+# number of records evaluated at once by a --where expression.
+default_where_batch_size = 65536
+
+
 def line_to_recordproto(line, input_mode):
+    if input_mode == "json":
+        return record_json.json_to_record(line)
     record_proto = record_pb2.Record()
     if input_mode == "textproto":
         text_format.Parse(line, record_proto) 
-    elif input_mode == "json":
-        json_format.Parse(line, record_proto)
     else:
         eprint("Unrecognized input format")
         return None
@@ -49,48 +76,243 @@ def line_to_recordproto(line, input_mode):
     return record_proto
 
 
-def filter_lines(instream, outstream, input_mode, output_mode, args):
+# names which give a block access to its locals without naming them. a block
+# that uses any of these gets every local.
+opaque_local_names = frozenset(["locals", "vars", "eval", "exec", "dir"])
+
+
+def referenced_names(code):
+    # collects every name referenced by a code object, including the code
+    # objects nested in it (lambdas, comprehensions, etc).
+    names = set(code.co_names) | set(code.co_varnames)
+    names |= set(code.co_freevars) | set(code.co_cellvars)
+    for const in code.co_consts:
+        if hasattr(const, "co_names"):
+            names |= referenced_names(const)
+    return names
+
+
+def recordproto_to_dict(record_proto):
+    # the same dictionary as json.loads() of the record's json serialization.
+    return record_json.record_to_dict(record_proto)
+
+
+class RecordFilter:
+    # the EXEC block, compiled once to a code object. also notes which of the
+    # locals 'record' and 'record_proto' the block reads, so that only those
+    # need to be built for each input record.
+
+    def __init__(self, string_to_execute):
+        self.code = compile(string_to_execute, "<exec>", "exec")
+        names = referenced_names(self.code)
+        opaque = bool(names & opaque_local_names)
+        self.needs_record = opaque or "record" in names
+        self.needs_record_proto = opaque or "record_proto" in names
+
+    def passes(self, record_proto=None, record=None):
+        # runs the block against a single record, and returns the value it
+        # left in 'to_emit'. arguments the block doesn't read may be None.
+        exec_locals = {}
+        exec_locals['to_emit'] = False
+        if self.needs_record_proto:
+            exec_locals['record_proto'] = record_proto
+        if self.needs_record:
+            exec_locals['record'] = record
+
+        exec(self.code, {}, exec_locals)
+
+        # if we're here, then the executed block has set 'to_emit' to reflect
+        # whether this record should be included in the output.
+        return exec_locals['to_emit']
+
+    def passes_recordproto(self, record_proto):
+        record = None
+        if self.needs_record:
+            record = recordproto_to_dict(record_proto)
+        return self.passes(record_proto, record)
+
+    def passes_record_model(self, record):
+        # like passes_recordproto, for a record_model.Record. a proto is only
+        # built if the block reads one.
+        record_proto = record.to_proto() if self.needs_record_proto else None
+        record_dict = record.to_dict() if self.needs_record else None
+        return self.passes(record_proto, record_dict)
+
+
+def iter_input_raw(instream, input_mode):
+    # yields each input record, undecoded: a line of text for text modes, or
+    # the serialized bytes of the record for binary modes. dictjson records
+    # are decoded against their string dictionary, and yielded as plain json
+    # lines.
+    if record_io.is_binary_mode(input_mode):
+        for serialized in record_io.iter_serialized(instream, input_mode):
+            yield serialized
+        return
+    if input_mode == "dictjson":
+        string_dictionary = record_io.StringDictionary()
+        while True:
+            line = instream.readline().strip()
+            if not line:
+                break  # end of input.
+            record = string_dictionary.read_line(line)
+            if record is not None:
+                yield json.dumps(record)
+        return
+
     while True:
         # trim whitespace to avoid indent errors in exec() call
         line = instream.readline().strip()
         if not line:
             break  # end of input.
-        record_proto = line_to_recordproto(line, input_mode)
+        yield line
 
-        string_to_execute = args.exec
-        if not string_to_execute:
-           eprint("!!! no execution block found !!!")
-           return
 
-        # serialize output before calling exec
-        json_str = json_format.MessageToJson(record_proto, indent=None,
-                preserving_proto_field_name=True)
-        textproto_str = text_format.MessageToString(record_proto,
-                as_one_line=True)
+def iter_metered(raws, metrics):
+    # counts input records as they're read, along with the time spent
+    # reading them.
+    for raw in run_metrics.timed_iter(raws, metrics, "read"):
+        metrics.count("records_in")
+        metrics.maybe_report_progress()
+        yield raw
 
-        exec_locals = {}
-        exec_locals['to_emit'] = False
-        exec_locals['record_proto'] = record_proto
-        exec_locals['record'] = json.loads(json_str)
 
-        exec(string_to_execute, {}, exec_locals)
+def decode_raw(raw, input_mode):
+    if record_io.is_binary_mode(input_mode):
+        return record_pb2.Record.FromString(raw)
+    return line_to_recordproto(raw, input_mode)
 
-        # if we're here, then the executed block has set 'to_emit' to reflect
-        # whether this line should be included in the output.
 
-        if exec_locals['to_emit']:
-            line = ""
+def iter_where_candidates(raws, input_mode, where_expression, batch_size,
+        metrics=None):
+    # evaluates a --where expression over batches of input records, column by
+    # column, and yields (raw, record_proto, record) for the records that
+    # pass. whatever was decoded to build the columns is passed along, so it
+    # doesn't have to be decoded again; the rest is None.
+    import columnar_filter
 
-            if output_mode == "textproto":
-                line = textproto_str
-            elif output_mode == "json":
-                line = json_str
+    phase = metrics.phase if metrics is not None else run_metrics.untimed
+
+    batch = []
+    for raw in itertools.chain(raws, [None]):
+        if raw is not None:
+            batch.append(raw)
+            if len(batch) < batch_size:
+                continue
+        if not batch:
+            break
+
+        with phase("where"):
+            if input_mode == "json":
+                records = [json.loads(line) for line in batch]
+                record_protos = [None] * len(batch)
+                columns = columnar_filter.ColumnBatch.from_dicts(
+                        records, where_expression.columns)
             else:
-                eprint("!!! unexpected output_mode: " + output_mode)
-                return
+                record_protos = [decode_raw(raw, input_mode)
+                        for raw in batch]
+                records = [None] * len(batch)
+                columns = columnar_filter.ColumnBatch.from_recordprotos(
+                        record_protos, where_expression.columns)
+
+            passed = where_expression.evaluate(columns).nonzero()[0]
+        if metrics is not None:
+            metrics.count("filtered_out", len(batch) - len(passed),
+                    kind="where")
+        for ind in passed:
+            yield batch[ind], record_protos[ind], records[ind]
+        batch = []
 
-            outstream.write(line)
-            outstream.write("\n")
+
+def filter_lines(instream, outstream, input_mode, output_mode, args,
+        metrics=None):
+    # instream and outstream should be opened in binary mode for binary input
+    # and output modes, respectively. 'metrics', if supplied, is a
+    # run_metrics.Metrics to record the run in.
+    if output_mode not in record_io.record_modes:
+        eprint("!!! unexpected output_mode: " + output_mode)
+        return
+
+    string_to_execute = args.exec
+    where = getattr(args, "where", None)
+    if not string_to_execute and not where:
+       eprint("!!! no execution block found !!!")
+       return
+
+    record_filter = None
+    if string_to_execute:
+        record_filter = RecordFilter(string_to_execute)
+
+    where_expression = None
+    if where:
+        # raises columnar_filter.WhereSyntaxError for an invalid expression.
+        import columnar_filter  # numpy is only needed for --where.
+        where_expression = columnar_filter.WhereExpression(where)
+    record_writer = record_io.RecordWriter(outstream, output_mode)
+    if metrics is None:
+        metrics = run_metrics.Metrics("filter_records", progress_interval=0)
+
+    raws = iter_metered(iter_input_raw(instream, input_mode), metrics)
+    if input_mode == "dictjson":
+        # from here on, the input is plain json lines.
+        input_mode = "json"
+
+    # json input can be handed to a block that only reads 'record' straight
+    # from json.loads(), without building a proto. (this assumes the input is
+    # json as written by these tools, i.e. with proto field names.)
+    needs_record = record_filter is not None and record_filter.needs_record
+    needs_record_proto = (record_filter is not None and (
+            record_filter.needs_record_proto
+            or (needs_record and input_mode != "json")))
+    passthrough = (record_io.is_binary_mode(input_mode)
+            and record_io.is_binary_mode(output_mode))
+
+    if where_expression is not None:
+        # the columnar --where filter runs first, over whole batches; the
+        # --exec block (if any) only sees the records that pass it.
+        candidates = iter_where_candidates(raws, input_mode, where_expression,
+                getattr(args, "where_batch_size", default_where_batch_size),
+                metrics)
+    else:
+        candidates = ((raw, None, None) for raw in raws)
+
+    clock = time.perf_counter
+    for raw, record_proto, record in candidates:
+        if record_filter is not None:
+            start = clock()
+            if needs_record_proto and record_proto is None:
+                record_proto = decode_raw(raw, input_mode)
+            if needs_record and record is None:
+                record = (json.loads(raw) if record_proto is None else
+                        recordproto_to_dict(record_proto))
+            exec_start = clock()
+            metrics.add_time("decode", exec_start - start)
+
+            to_emit = record_filter.passes(record_proto, record)
+            exec_seconds = clock() - exec_start
+            metrics.add_time("exec", exec_seconds)
+            metrics.observe("exec_seconds", exec_seconds)
+            if not to_emit:
+                metrics.count("filtered_out", kind="exec")
+                continue
+            if record_filter.needs_record_proto:
+                # the block may have changed the proto it was handed, so
+                # output is decoded again from the input, as it was read.
+                record_proto = None
+
+        # only records which pass the filter are decoded (if they weren't
+        # already) and serialized for output.
+        start = clock()
+        if passthrough:
+            record_writer.write_formatted(
+                    record_io.frame_serialized(raw, output_mode), 1)
+        else:
+            if record_proto is None:
+                record_proto = decode_raw(raw, input_mode)
+            record_writer.write(record_proto)
+        metrics.add_time("serialization", clock() - start)
+        metrics.count("records_out")
+
+    record_writer.close()
 
 
 if __name__ == "__main__":
@@ -100,20 +322,16 @@ if __name__ == "__main__":
         + "representing a given record.")
 
     parser.add_argument("--input_mode", type=str,
-            choices=[
-                "textproto",
-                "json"
-            ],
+            choices=record_io.record_modes,
             help="format of input records. expects one record per line, in "
-            + "the specified format (json, textproto). "
-            + "default: json",
+            + "the specified format (json, dictjson, textproto), or a "
+            + "length-delimited "
+            + "binary stream (binary) or framed RecordCollection file "
+            + "(collection). default: json",
             default="json")
 
     parser.add_argument("--output_mode", type=str,
-            choices=[
-                "textproto",
-                "json"
-            ],
+            choices=record_io.record_modes,
             help="if supplied, format to emit output records in. defaults to "
             + "the value of input_mode.")
 
@@ -123,8 +341,19 @@ if __name__ == "__main__":
             + "proto object) and to_emit (a boolean). If to_emit is set to "
             + "True when the block is finished executing, then the record "
             + "will be included in output. Otherwise, it's filtered out. "
-            + " *DO NOT* write to stdout.",
-            required=True)
+            + " *DO NOT* write to stdout.")
+
+    parser.add_argument("--where", type=str,
+            help="columnar filter expression, evaluated over batches of "
+            + "records with numpy, e.g. \"amount_usd > 10000 & creditor == "
+            + "'NEFAROUS GROUP LLC'\". columns: record_num, amount_usd, "
+            + "creditor, category, filing_office, filing_date (compared to "
+            + "dates, e.g. \"filing_date >= '2001-01-01'\"). requires numpy.")
+
+    parser.add_argument("--where_batch_size", type=int,
+            default=default_where_batch_size,
+            help="number of records evaluated at once by --where. default: "
+            + str(default_where_batch_size))
 
     parser.add_argument("--input_filename", type=str,
             help="filename of input records to evaluate. if not supplied, "
@@ -133,7 +362,18 @@ if __name__ == "__main__":
     parser.add_argument("--output_filename", type=str,
             help="filename to emit records which pass the filter. if not "
             + " supplied, writes to stdout.")
+    run_metrics.add_arguments(parser)
     args = parser.parse_args()
+    if not args.exec and not args.where:
+        parser.error("at least one of --exec and --where is required")
+    if args.where:
+        # checked up front, so a bad expression fails the run before any
+        # output is opened, like a bad --exec block does.
+        import columnar_filter
+        try:
+            columnar_filter.WhereExpression(args.where)
+        except columnar_filter.WhereSyntaxError as e:
+            parser.error("--where: " + str(e))
    
     # it's anyone's guess why they decided to overload the 'if' keyword for
     # ternaries, but here it is.
@@ -141,14 +381,25 @@ if __name__ == "__main__":
     output_mode = args.output_mode if args.output_mode else input_mode
 
     # simply absurd. who designed this language?
-    instream = sys.stdin if not args.input_filename else open(
-            args.input_filename, 'r')
-    outstream = sys.stdout if not args.output_filename else open(
-            args.output_filename, 'w')
+    if record_io.is_binary_mode(input_mode):
+        instream = sys.stdin.buffer if not args.input_filename else open(
+                args.input_filename, 'rb')
+    else:
+        instream = sys.stdin if not args.input_filename else open(
+                args.input_filename, 'r')
+    if record_io.is_binary_mode(output_mode):
+        outstream = sys.stdout.buffer if not args.output_filename else open(
+                args.output_filename, 'wb')
+    else:
+        outstream = sys.stdout if not args.output_filename else open(
+                args.output_filename, 'w')
 
-    filter_lines(instream, outstream, input_mode, output_mode, args)
+    metrics = run_metrics.Metrics("filter_records", args.progress_interval)
+    filter_lines(instream, outstream, input_mode, output_mode, args, metrics)
 
     outstream.close()
     instream.close()
 
+    metrics.finish(args.metrics_filename, args.metrics_format)
+
     eprint("done")
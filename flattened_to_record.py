@@ -1,209 +1,705 @@
 # flattened_to_record.py
 
 import argparse
+import bisect
+import checkpoint
+import collections
+import dead_letters
+import filing_dates
+import multiprocessing
+import parse_cache
 import re
+import record_io
+import record_model
 import record_pb2
+import run_metrics
+import sys
+import time
 from record_pb2 import ColumnType as ColumnType
-import google.protobuf.json_format as json_format
-import google.protobuf.text_format as text_format
 
 sentinel_linemarker = "\\n"
 
 # TODO Instead of print(), use eprint() as defined in filter_records.
 
-def line_to_recordproto(recordline):
-    # inflate flattened sixel-nixel record to a Record proto.
+# number of flattened records handed to a worker at a time in --workers mode.
+default_batch_size = 1000
+
+# fields are particular to the query requested, but in the case of sample file
+# the order of columns was as follows. used when no header line is available,
+# e.g. in flattened files, where the header is dropped.
+default_col_labels = [
+    ColumnType.RECORD_NUMBER,
+    ColumnType.DEBTOR,
+    ColumnType.ADDRESS,
+    ColumnType.FILING,
+    ColumnType.CREDITOR
+]
+
+# maps column names in a query result header line to the corresponding
+# ColumnType. columns with any other name are skipped when slicing records.
+header_col_labels = {
+    "No.": ColumnType.RECORD_NUMBER,
+    "Debtor": ColumnType.DEBTOR,
+    "Debtors": ColumnType.DEBTOR,
+    "Address": ColumnType.ADDRESS,
+    "Addresses": ColumnType.ADDRESS,
+    "Filing": ColumnType.FILING,
+    "Filings": ColumnType.FILING,
+    "Creditor": ColumnType.CREDITOR,
+    "Creditors": ColumnType.CREDITOR,
+}
+
+# a query result header line, e.g. "No.   Debtor   Address   ...". in files
+# consisting of several concatenated queries, a new header precedes the
+# records of each query.
+header_line_pattern = re.compile(r"^No\.\s")
+
+# columns are separated by blocks of two or more spaces, so a column is a run
+# of non-space characters, separated by single spaces at most.
+column_pattern = re.compile(r"\S+(?:\s\S+)*")
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def find_column_starts(line):
+    # returns the character offsets at which columns start in 'line'.
+    return [match.start() for match in column_pattern.finditer(line)]
+
+
+def is_header_line(line):
+    return header_line_pattern.match(line) is not None
+
+
+class ColumnLayout:
+    # fixed-width column layout of the records in a query result: which
+    # ColumnType each column holds, and the character offsets it spans.
+    # computed once (from the header line, or from the first line of the
+    # first record) and shared by every record that follows.
+
+    def __init__(self, col_labels, col_starts, from_header=False):
+        self.col_labels = list(col_labels)
+        self.col_starts = list(col_starts)
+        # header layouts are authoritative. layouts inferred from a record
+        # are checked against the first line of each record they're used
+        # for; see fits().
+        self.from_header = from_header
+
+        # precomputed slice table: (ColumnType, start, afterend) for every
+        # column we know how to parse. the final column ends where the line
+        # ends, otherwise columns end at the start of the next column.
+        self.col_slices = []
+        for col_ind, col_label in enumerate(self.col_labels):
+            if col_label == ColumnType.COLUMN_TYPE_UNSPECIFIED:
+                continue
+            col_afterend = (
+                    None if col_ind == len(self.col_starts) - 1 else
+                    self.col_starts[col_ind + 1])
+            self.col_slices.append(
+                    (col_label, self.col_starts[col_ind], col_afterend))
+
+    def as_dict(self):
+        # json-serializable form, e.g. for checkpoints.
+        return {"col_labels": self.col_labels, "col_starts": self.col_starts,
+                "from_header": self.from_header}
+
+    @classmethod
+    def from_dict(cls, layout_dict):
+        return cls(layout_dict["col_labels"], layout_dict["col_starts"],
+                layout_dict["from_header"])
+
+    @classmethod
+    def from_header_line(cls, header_line):
+        col_starts = find_column_starts(header_line)
+        col_labels = [
+            header_col_labels.get(
+                header_line[match.start():match.end()],
+                ColumnType.COLUMN_TYPE_UNSPECIFIED)
+            for match in column_pattern.finditer(header_line)]
+        return cls(col_labels, col_starts, from_header=True)
+
+    @classmethod
+    def from_first_line(cls, firstline, verbose=True):
+        # in the first row of a record, every column is represented, so the
+        # column boundaries can be read off of it. returns None if the line
+        # doesn't have the expected number of columns.
+        col_starts = find_column_starts(firstline)
+        if len(col_starts) != len(default_col_labels):
+            if not verbose:
+                return None
+            print(str(column_count_error(firstline)))
+            return None
+        return cls(default_col_labels, col_starts)
+
+    def fits(self, firstline):
+        # cheap check that the first line of a record has a column boundary
+        # at every start offset of this layout.
+        if self.from_header:
+            return True
+        for col_start in self.col_starts[1:]:
+            if not (firstline[col_start - 1:col_start].isspace()
+                    and firstline[col_start:col_start + 1].strip()):
+                return False
+        return True
+
+    def split_columns(self, lines, columns=None):
+        # slices each line of the record into columns. returns a map of
+        # ColumnType -> list of lines (cropped from record), with leading and
+        # trailing whitespace trimmed. if a column's bounds are out of range
+        # for a line, str[a:b] substring syntax will seamlessly fall back to
+        # an empty or truncated string. if 'columns' is supplied, only those
+        # columns are sliced; the others are left empty.
+        col_lines_map = {col_label: [] for col_label in default_col_labels}
+        for col_label, col_start, col_afterend in self.col_slices:
+            if columns is not None and col_label not in columns:
+                continue
+            col_lines_map[col_label] = [
+                line[col_start:col_afterend].strip() for line in lines]
+        return col_lines_map
+
+
+def split_header(lines):
+    # a header line can only appear inside a record when the record is the
+    # last of one query, and is followed by the next query in the same file.
+    # returns the lines of the record proper, and the header line (or None).
+    for ind in range(1, len(lines)):
+        if lines[ind].startswith("No.") and is_header_line(lines[ind]):
+            return lines[:ind], lines[ind]
+    return lines, None
+
+
+# the kinds of lines in the filing column, and the FilingInfo fields they set.
+# (filing dates in a component set its fields, under "components".)
+filing_line_fields = {
+    "components": ("components",),
+    "dates": ("raw_filing_date", "filing_date"),
+    "amount": ("amount", "amount_usd"),
+    "certificate": ("certificate_number",),
+}
+
+# the digits a record number, lex id or amount starts with (possibly none).
+leading_digits_pattern = re.compile(r"[0-9]*")
+
+lex_id_label = "LexID(sm):"
+
+# the labels of the lines in the filing column (other than category lines),
+# in order of precedence: a line containing more than one label is read as
+# the first of them, and its value is the rest of the line after it.
+filing_date_label = "Filing Date:"
+filing_labels = (filing_date_label, "Amount:", "Filing Number:",
+        "Filing Office:", "Certificate Number:")
+
+# each label, by the text before its colon.
+filing_labels_by_head = {label[:-1]: label for label in filing_labels}
+
+# the kind of line (see filing_line_fields) of each label. a filing date is
+# of kind "components" once the header is done, and "dates" before that.
+filing_label_kinds = {
+    "Amount:": "amount",
+    "Filing Number:": "components",
+    "Filing Office:": "components",
+    "Certificate Number:": "certificate",
+}
+
+
+def classify_filing_line(filing_line):
+    # returns the label of a (non-category) line of the filing column, as
+    # one of filing_labels, and the value following it, or (None, None) if it
+    # has no label. labels almost always start the line, so the text up to
+    # the first colon is looked up first. every label ends in a colon, so if
+    # there's no other colon, there's no other label to take precedence;
+    # otherwise the labels are searched for in order.
+    head, _, value = filing_line.partition(":")
+    label = filing_labels_by_head.get(head)
+    if label is not None and ":" not in value:
+        return label, value
+    for label in filing_labels:
+        ind = filing_line.find(label)
+        if ind >= 0:
+            return label, filing_line[ind + len(label):]
+    return None, None
+
+
+class Projection:
+    # a --fields projection: the Record fields to parse and emit, given as
+    # comma-separated paths of field names, e.g.
+    # "record_num,filing_info.amount_usd,creditor.name". a path naming a
+    # message field (e.g. "creditor") takes all of it.
+    #
+    # only the columns the projected fields come from are sliced and parsed,
+    # and records are emitted with only the projected fields set. (so errors
+    # in the other columns go unnoticed: the record isn't failed for them.)
+
+    # the columns each top-level Record field is parsed from. addresses are
+    # matched to debtors by line, so they need the debtor column as well.
+    field_columns = {
+        "record_num": (ColumnType.RECORD_NUMBER,),
+        "debtors": (ColumnType.DEBTOR, ColumnType.ADDRESS),
+        "filing_info": (ColumnType.FILING,),
+        "creditor": (ColumnType.CREDITOR,),
+    }
+
+    def __init__(self, fields):
+        # raises ValueError for a path that isn't in the schema.
+        # 'tree' maps each projected field name to None (the whole field) or
+        # to the tree of its projected subfields.
+        self.tree = {}
+        for path in fields.split(","):
+            path = path.strip()
+            if path:
+                self.add_path(path)
+        if not self.tree:
+            raise ValueError("no fields to project")
+        self.fields = ",".join(self.paths(self.tree))
+
+        self.columns = set()
+        for name, subtree in self.tree.items():
+            columns = self.field_columns.get(name, ())
+            if name == "debtors" and subtree is not None and (
+                    "address" not in subtree):
+                columns = (ColumnType.DEBTOR,)
+            self.columns.update(columns)
+
+        # the kinds of filing column lines to parse; see parse_filing.
+        self.filing_lines = None
+        filing_fields = self.tree.get("filing_info", {})
+        if filing_fields is not None:
+            self.filing_lines = set()
+            for kind, names in filing_line_fields.items():
+                if any([name in filing_fields for name in names]):
+                    self.filing_lines.add(kind)
+
+    def add_path(self, path):
+        message_type = record_pb2.Record.DESCRIPTOR
+        node = self.tree
+        names = path.split(".")
+        for ind, name in enumerate(names):
+            field = None
+            if message_type is not None:
+                field = message_type.fields_by_name.get(name)
+            if field is None:
+                raise ValueError("unknown field: " + path)
+            if node.get(name, {}) is None:
+                return  # already projected whole.
+            if ind == len(names) - 1:
+                node[name] = None
+            else:
+                node = node.setdefault(name, {})
+                message_type = field.message_type
+
+    @classmethod
+    def paths(cls, tree, prefix=""):
+        paths = []
+        for name in sorted(tree):
+            if tree[name] is None:
+                paths.append(prefix + name)
+            else:
+                paths.extend(cls.paths(tree[name], prefix + name + "."))
+        return paths
+
+    def apply(self, record):
+        # clears every field of a record_model.Record that isn't projected,
+        # in place, and returns it.
+        return self.project(record, self.tree)
+
+    @classmethod
+    def project(cls, message, tree):
+        for name in message.__slots__:
+            value = getattr(message, name)
+            if name not in tree:
+                if type(value) is list:
+                    if value:
+                        setattr(message, name, [])
+                elif hasattr(value, "__slots__"):
+                    setattr(message, name, type(value)())
+                elif value is not None:
+                    setattr(message, name, None)
+            elif tree[name] is not None:
+                if type(value) is list:
+                    for item in value:
+                        cls.project(item, tree[name])
+                else:
+                    cls.project(value, tree[name])
+        return message
 
-    # rudimentary validation
-    if not recordline:
-        print(
-            "line_to_recordproto: returning empty proto for empty input.")
-        return record_pb2.Record()
 
-    # first, pop out the record into multiple lines for easy editing.
-    lines = recordline.split(sentinel_linemarker)
+class RecordParseError(Exception):
+    # a record that couldn't be parsed. 'code' names the kind of problem
+    # (e.g. for counting failures by kind), and the message describes it.
 
-    # in the first row of the record, every column is represented.
-    # columns are separated by blocks of two or more spaces. iterate through
-    # the first line to determine where those column boundaries occur.
-    firstline = lines[0]
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
 
-    if firstline[0].isspace():
-        print(
-            "malformed input -- first line of record should begin with "
-            + "record number.")
-        return record_pb2.Record()
 
-    # fields are particular to the query requested, but in
-    # the case of sample file the order of columns was as follows:
-    col_labels = [
-        ColumnType.RECORD_NUMBER,
-        ColumnType.DEBTOR,
-        ColumnType.ADDRESS,
-        ColumnType.FILING,
-        ColumnType.CREDITOR
-    ]
-
-    # keep track of characters on which columns start.
-    col_starts = []
-    # first column (RECORD_NUMBER) starts at character 0.
-    col_starts.append(0) 
-    in_column = True
-
-    ind = 1  # already verified 0.
-    while ind < len(firstline):
-        is_space = firstline[ind].isspace()
-        if (not in_column) and (not is_space):
-            # "low to high" edge, we just jumped from 'padding' to 'new
-            # column'.
-            in_column = True
-            col_starts.append(ind)
-        elif is_space and firstline[ind - 1].isspace():
-            # if we've hit two spaces in a row, we can consider the col to be
-            # complete, and we're headed back into 'padding'.
-            in_column = False
-
-        # increment i for the next go-round.
-        ind += 1
-
-    # validate the column mapping:
-    if len(col_starts) != len(col_labels):
-        print(
+def column_count_error(firstline):
+    return RecordParseError("column_count",
             "error -- encountered unexpected number of columns."
-            + " num labels: " + str(len(col_labels))
-            + " num columns: " + str(len(col_starts))
+            + " num labels: " + str(len(default_col_labels))
+            + " num columns: " + str(len(find_column_starts(firstline)))
             + " -- expected equal values.")
-        return record_pb2.Record()
 
-    # if we're here, col_starts now provides a guide to slicing up the
-    # record into columns which can be independently parsed.
 
-    col_lines_map = {}  # ColumnType -> list of lines (cropped from record).
-    num_cols = len(col_labels)
+def empty_line_error():
+    return RecordParseError("empty_line",
+            "line_to_recordproto: returning empty proto for empty input.")
 
-    for i in range(num_cols):
-        col_lines_map[col_labels[i]] = []  # placeholder list.
 
-    # copy column line fragments to col_lines_map.
-    for line in lines:
-        for col_ind in range(num_cols):
-            col_start = col_starts[col_ind]
-            col_afterend = (
-                    # final column ends where 'line' ends.
-                    # otherwise, columns end at the start of next col.
-                    len(line) if col_ind == (num_cols - 1) else
-                    col_starts[col_ind+1]
-            )
+def report_parse_error(error, metrics=None):
+    # parse errors are reported on stdout, and the record is output empty.
+    print(str(error))
+    if metrics is not None:
+        metrics.count("records_failed", kind=error.code)
+
+
+class RecordParser:
+    # parses the records of a single query result file in order, caching the
+    # column layout across records. the layout is re-detected only when a new
+    # header line appears. records are returned as record_model.Record; see
+    # record_model.py.
+    #
+    # if a run_metrics.Metrics is supplied, time spent in each phase of
+    # parsing and failed records are recorded in it. after each record,
+    # 'last_error' holds the RecordParseError it failed with, or None. if a
+    # Projection is supplied, records are parsed and returned projected.
+
+    def __init__(self, layout=None, metrics=None, projection=None):
+        self.layout = layout
+        self.metrics = metrics
+        self.projection = projection
+        self.last_error = None
+
+    def observe_lines(self, lines):
+        # picks up the layout from any header line among 'lines', e.g. the
+        # text preceding the first record of a raw query result.
+        for line in lines:
+            if is_header_line(line):
+                self.layout = ColumnLayout.from_header_line(line)
+
+    def failed(self, error):
+        # reports a record that couldn't be parsed, and returns the empty
+        # Record output in its place.
+        self.last_error = error
+        report_parse_error(error, self.metrics)
+        return record_model.Record()
+
+    def parse_line(self, recordline):
+        if not recordline:
+            self.last_error = None
+            return self.failed(empty_line_error())
+        return self.parse_lines(recordline.split(sentinel_linemarker))
+
+    def parse_lines(self, lines):
+        self.last_error = None
+        metrics = self.metrics
+        phase = metrics.phase if metrics is not None else run_metrics.untimed
+
+        with phase("column_detection"):
+            lines, header_line = split_header(lines)
+
+            layout = self.layout
+            if layout is None or not layout.fits(lines[0]):
+                # no header seen yet, or this record doesn't line up with the
+                # layout inferred so far; fall back to inferring one from
+                # this record. the first successfully inferred layout is
+                # cached.
+                layout = None
+                firstline = lines[0]
+                if firstline and not firstline[0].isspace():
+                    layout = ColumnLayout.from_first_line(
+                            firstline, verbose=False)
+                    if layout is None:
+                        return self.failed(column_count_error(firstline))
+                    if self.layout is None:
+                        self.layout = layout
+
+        try:
+            record = parse_record_lines(lines, layout, metrics,
+                    self.projection)
+        except RecordParseError as e:
+            record = self.failed(e)
+
+        if header_line is not None:
+            # the header applies to the records after this one.
+            self.layout = ColumnLayout.from_header_line(header_line)
+
+        return record
+
+    def advance_layout(self, recordline):
+        # updates the cached layout exactly as parse_line would, without
+        # parsing the record. lets a dispatcher hand each batch of records to
+        # a worker along with the layout in effect at the start of the batch.
+        if self.layout is None:
+            firstline = recordline.split(sentinel_linemarker, 1)[0]
+            if firstline and not firstline[0].isspace():
+                self.layout = ColumnLayout.from_first_line(
+                        firstline, verbose=False)
+        if "No." in recordline:
+            lines, header_line = split_header(
+                    recordline.split(sentinel_linemarker))
+            if header_line is not None:
+                self.layout = ColumnLayout.from_header_line(header_line)
+
+
+def line_to_recordproto(recordline, layout=None, metrics=None,
+        projection=None):
+    # inflate flattened sixel-nixel record to a Record proto. with a
+    # Projection, only the projected fields are parsed and set.
 
-            # if col_start or col_afterend is out of bounds, str[a:b]
-            # substring syntax will seamlessly fall back to empty or truncated
-            # string.
-            cropped_line = line[col_start:col_afterend].strip()
+    # rudimentary validation
+    if not recordline:
+        report_parse_error(empty_line_error(), metrics)
+        return record_pb2.Record()
+
+    # first, pop out the record into multiple lines for easy editing.
+    return lines_to_recordproto(
+            recordline.split(sentinel_linemarker), layout, metrics,
+            projection)
+
+
+def lines_to_recordproto(lines, layout=None, metrics=None, projection=None):
+    # inflate a sixel-nixel record, given as a list of its lines, to a Record
+    # proto. if no layout is supplied, it's inferred from the record itself.
+    # records that can't be parsed are reported, and returned empty.
+    try:
+        return parse_record_lines(lines, layout, metrics,
+                projection).to_proto()
+    except RecordParseError as e:
+        report_parse_error(e, metrics)
+        return record_pb2.Record()
 
-            col_lines_map[col_labels[col_ind]].append(cropped_line)
 
-    # if we're here, each line of the record has been sliced into columns, and
-    # the columns are collected in col_lines_map indexed by ColumnType enum.
-    # leading and trailing whitespace has been trimmed.
+def parse_record_lines(lines, layout=None, metrics=None, projection=None):
+    # like lines_to_recordproto, but returns a record_model.Record, and
+    # raises RecordParseError for records that can't be parsed.
+    phase = metrics.phase if metrics is not None else run_metrics.untimed
 
-    # now, unpack individual columns.
-    record_proto = record_pb2.Record()
+    firstline = lines[0]
 
+    if not firstline or firstline[0].isspace():
+        raise RecordParseError("first_line",
+                "malformed input -- first line of record should begin with "
+                + "record number.")
+
+    with phase("column_detection"):
+        if layout is None:
+            layout = ColumnLayout.from_first_line(firstline, verbose=False)
+            if layout is None:
+                raise column_count_error(firstline)
+
+        # the layout now provides a guide to slicing up the record into
+        # columns which can be independently parsed. with a projection, only
+        # the columns it needs are sliced, and parsed below.
+        columns = projection.columns if projection is not None else None
+        col_lines_map = layout.split_columns(lines, columns)
+
+    # now, unpack individual columns. values that repeat across records
+    # (creditor names, filing offices and categories, filing dates, county
+    # lines of addresses) are interned, so that records held in memory
+    # together share a single copy of each.
+    record = record_model.Record()
+
+    if columns is None or ColumnType.RECORD_NUMBER in columns:
+        with phase("parse_record_number"):
+            parse_record_number(col_lines_map[ColumnType.RECORD_NUMBER],
+                    record)
+    if columns is None or ColumnType.DEBTOR in columns:
+        with phase("parse_debtor"):
+            debtor_starting_linenos = parse_debtors(
+                    col_lines_map[ColumnType.DEBTOR], record)
+    if columns is None or ColumnType.ADDRESS in columns:
+        with phase("parse_address"):
+            parse_addresses(col_lines_map[ColumnType.ADDRESS], record,
+                    debtor_starting_linenos)
+    if columns is None or ColumnType.FILING in columns:
+        with phase("parse_filing"):
+            parse_filing(col_lines_map[ColumnType.FILING], record, metrics,
+                    projection.filing_lines
+                        if projection is not None else None)
+    if columns is None or ColumnType.CREDITOR in columns:
+        with phase("parse_creditor"):
+            parse_creditor(col_lines_map[ColumnType.CREDITOR], record)
+
+    # if we're here, the record is now fully assembled.
+    if projection is not None:
+        record = projection.apply(record)
+    return record
+
+
+def parse_record_number(recordnum_lines, record):
     # record number ("No.")
-    recordnum_lines = col_lines_map[ColumnType.RECORD_NUMBER]
     try:
         # record number is limited to a single entry on the first line.
         # format: "1.", "36.", etc.
-        match_str = re.search('^[0-9]*', recordnum_lines[0]).group(0)
-        record_proto.record_num = int(match_str)
+        match_str = leading_digits_pattern.match(recordnum_lines[0]).group(0)
+        record.record_num = record_model.int32(int(match_str))
     except Exception as e:
-        print("error -- couldn't parse record num: " + str(e))
-        return record_pb2.Record()
+        raise RecordParseError("record_number",
+                "error -- couldn't parse record num: " + str(e))
+
 
-    # Debtor
-    debtor_lines = col_lines_map[ColumnType.DEBTOR]
+def parse_debtors(debtor_lines, record):
+    # Debtor. returns the index of the line each debtor starts on.
     debtor_starting_linenos = []
     for ind, debtor_line in enumerate(debtor_lines):
         # skip empty lines.
         if not debtor_line:
             continue
 
-        if "LexID(sm):" in debtor_line:
+        if lex_id_label in debtor_line:
             # metadata for most recent debtor encountered in the column.
             # remove prefix and store number part as string.
             try:
-                lexid_str = re.search(
-                        'LexID\(sm\):([0-9]*)', debtor_line).group(1)
+                lexid_str = leading_digits_pattern.match(
+                        debtor_line.partition(lex_id_label)[2]).group(0)
 
-                # retrieve most recently-added debtor proto in list.
-                debtor_proto = record_proto.debtors[-1]
-                debtor_proto.lex_id = lexid_str
+                # retrieve most recently-added debtor in list.
+                debtor = record.debtors[-1]
+                debtor.lex_id = lexid_str
             except Exception as e:
-                print("error -- couldn't parse debtor lex_id: " + str(e))
-                return record_pb2.Record()
+                raise RecordParseError("lex_id",
+                        "error -- couldn't parse debtor lex_id: " + str(e))
         elif ", " in debtor_line:
             # new debtor name.
             debtor_starting_linenos.append(ind)
             name_split = debtor_line.split(", ")
 
-            debtor_proto = record_proto.debtors.add()
-            debtor_proto.name = debtor_line
-            debtor_proto.parsed_surname = name_split[0]
+            debtor = record_model.Debtor()
+            record.debtors.append(debtor)
+            debtor.name = debtor_line
+            debtor.parsed_surname = name_split[0]
             if len(name_split) > 1:
-                debtor_proto.parsed_forenames = name_split[1]
+                debtor.parsed_forenames = name_split[1]
         else:
             undivided_name = debtor_line.strip()
             if undivided_name:
                 debtor_starting_linenos.append(ind)
-                debtor_proto = record_proto.debtors.add()
-                debtor_proto.name = undivided_name
+                debtor = record_model.Debtor()
+                record.debtors.append(debtor)
+                debtor.name = undivided_name
+    return debtor_starting_linenos
+
 
+def parse_addresses(address_lines, record, debtor_starting_linenos):
     # Address
     # addresses, unlike other columns, are scoped within debtors. to properly
     # match the address to the debtor, we must compare line numbers across
-    # columns.
-    address_lines = col_lines_map[ColumnType.ADDRESS]
-    num_debtors = len(record_proto.debtors)
-
-    # debugging! uncomment if these are useful....
-    # print("debtor starting indices: ")
-    # for ind, starting_lineno in enumerate(debtor_starting_linenos):
-    #     print(str(ind) + " " + str(starting_lineno))
-    # print("num_debtors: " + str(num_debtors))
+    # columns: an address line belongs to the last debtor beginning on or
+    # before it (or to the first debtor, for lines before any of them).
+    debtors = record.debtors
+    if not debtors:
+        for line_ind, address_line in enumerate(address_lines):
+            if address_line:
+                raise RecordParseError("address_debtor",
+                        "error -- couldn't match address to debtor: "
+                        + "line_ind: " + str(line_ind) + " "
+                        + "address lines: " + str(len(address_lines)) + " "
+                        + "current_debtor: -1 "
+                        + "address line: " + address_line)
+        return
 
     for line_ind, address_line in enumerate(address_lines):
         # skip empty lines.
         if not address_line:
             continue
-        
-        current_debtor = num_debtors - 1
-        while current_debtor > 0:
-            if debtor_starting_linenos[current_debtor] <= line_ind:
-                break  # last debtor beginning on or before this line.
-            current_debtor -= 1
-
-        if current_debtor < 0:
-                print(
-                        "error -- couldn't match address to debtor: "
-                        + "line_ind: " + str(line_ind) + " "
-                        + "address lines: " + str(len(address_lines)) + " "
-                        + "current_debtor: " + str(current_debtor) + " "
-                        + "address line: " + address_line)
-                return record_pb2.Record()
-        
-        # if we're here, current_debtor contains the appropriate debtor index
-        # for this address line.
-        #
+
+        current_debtor = bisect.bisect_right(
+                debtor_starting_linenos, line_ind) - 1
+
         # todo: parsing for addr components.
-        addr_proto = record_proto.debtors[current_debtor].address
-        addr_proto.raw_lines.append(address_line)
+        address = debtors[current_debtor if current_debtor > 0 else 0].address
+        if record_io.is_county_line(address_line):
+            address_line = sys.intern(address_line)
+        address.raw_lines.append(address_line)
+
+
+def parse_filing_category(filing_info, filing_line):
+    # create a new component at the end of the list, and set the category.
+    component = record_model.FilingComponent()
+    filing_info.components.append(component)
+    component.category = sys.intern(filing_line)
+
+
+def parse_filing_date(filing_info, value, filing_line, header_done):
+    # dates after the header belong to the last component.
+    try:
+        fd_str = sys.intern(value)
+        # days since 1970-01-01, or None (unset) if the date isn't valid.
+        fd_days = filing_dates.raw_filing_date_to_days(fd_str)
+
+        if header_done:
+            component = filing_info.components[-1]
+            component.raw_filing_date = fd_str
+            component.filing_date = fd_days
+        else:
+            filing_info.raw_filing_date = fd_str
+            filing_info.filing_date = fd_days
+    except Exception as e:
+        raise RecordParseError("filing_date",
+                "error -- couldn't parse filing date: " + str(e))
+
+
+def parse_amount(filing_info, value, filing_line, header_done):
+    try:
+        filing_info.amount = value
+
+        amt_str = value.replace('$', '').replace(',', '')
+        dollar_str = leading_digits_pattern.match(amt_str).group(0)
+        filing_info.amount_usd = record_model.int32(int(dollar_str))
+    except Exception as e:
+        raise RecordParseError("amount",
+                "error -- couldn't parse amount: " + str(e))
+
 
+def parse_filing_number(filing_info, value, filing_line, header_done):
+    if not header_done:
+        raise RecordParseError("filing_number_order",
+                "error -- encountered filing number before "
+                + "header completed: " + filing_line)
+    try:
+        filing_info.components[-1].filing_number = value
+    except Exception as e:
+        raise RecordParseError("filing_number",
+                "error -- couldn't parse filing number: " + str(e))
+
+
+def parse_filing_office(filing_info, value, filing_line, header_done):
+    if not header_done:
+        raise RecordParseError("filing_office_order",
+                "error -- encountered filing office before "
+                + "header completed: " + filing_line)
+    try:
+        filing_info.components[-1].filing_office = sys.intern(value)
+    except Exception as e:
+        raise RecordParseError("filing_office",
+                "error -- couldn't parse filing office: " + str(e))
+
+
+def parse_certificate_number(filing_info, value, filing_line, header_done):
+    filing_info.certificate_number = value
+
+
+# the parser of each kind of labelled filing line.
+filing_line_parsers = {
+    filing_date_label: parse_filing_date,
+    "Amount:": parse_amount,
+    "Filing Number:": parse_filing_number,
+    "Filing Office:": parse_filing_office,
+    "Certificate Number:": parse_certificate_number,
+}
+
+
+def parse_filing(filing_lines, record, metrics=None, kinds=None):
     # Filing
-    filing_lines = col_lines_map[ColumnType.FILING]
-    filing_info_proto = record_proto.filing_info
+    # 'kinds' is the set of kinds of lines to parse (keys of
+    # filing_line_fields), or None for all of them. other lines are skipped
+    # without being parsed.
+    filing_info = record.filing_info
     header_done = False
+    want_components = kinds is None or "components" in kinds
 
-    for ind, filing_line in enumerate(filing_lines):
+    for filing_line in filing_lines:
         if not filing_line:
             continue
 
@@ -212,165 +708,640 @@ def line_to_recordproto(recordline):
             # begins a new filing component, and ends the header if we were
             # still in the header.
             header_done = True
-            # create a new component message at the end of the list, and set
-            # the category.
-            component_proto = filing_info_proto.components.add()
-            component_proto.category = filing_line
-
-        elif "Filing Date:" in filing_line:
-            try:
-                # TODO: parsing/cleanup of raw date.
-                fd_str = re.search('Filing Date:(.*)$', filing_line).group(1)
-
-                if header_done:
-                    filing_info_proto.components[-1].raw_filing_date = fd_str
-                else:
-                    filing_info_proto.raw_filing_date = fd_str
-            except Exception as e:
-                print("error -- couldn't parse filing date: " + str(e))
-                return record_pb2.Record()
-
-        elif "Amount:" in filing_line: 
-            try:
-                amt_str = re.search('Amount:(.*)$', filing_line).group(1)
-                filing_info_proto.amount = amt_str
-
-                amt_str = amt_str.replace('$', '')
-                amt_str = amt_str.replace(',', '')
-                
-                dollar_str = re.search('^([0-9]*)', amt_str).group(1)
-                filing_info_proto.amount_usd = int(dollar_str)
-            except Exception as e:
-                print("error -- couldn't parse amount: " + str(e))
-                return record_pb2.Record()
-
-        elif "Filing Number:" in filing_line:
-            if not header_done:
-                print(
-                        "error -- encountered filing number before "
-                        + "header completed: " + filing_line)
-                return record_pb2.Record()
+            if want_components:
+                parse_filing_category(filing_info, filing_line)
+            continue
 
-            try:
-                fn_str = re.search('Filing Number:(.*)$', filing_line).group(1)
-                filing_info_proto.components[-1].filing_number = fn_str
-            except Exception as e:
-                print("error -- couldn't parse filing number: " + str(e))
-                return record_pb2.Record()
-
-        elif "Filing Office:" in filing_line:
-            if not header_done:
-                print(
-                        "error -- encountered filing office before "
-                        + "header completed: " + filing_line)
-                return record_pb2.Record()
-            try:
-                office_str = re.search(
-                        'Filing Office:(.*)$', filing_line).group(1)
-                filing_info_proto.components[-1].filing_office = office_str
-            except Exception as e:
-                print("error -- couldn't parse filing office: " + str(e))
-                return record_pb2.Record()
+        label, value = classify_filing_line(filing_line)
+        if label is None:
+            # not fatal; the line is skipped.
+            print("error -- unrecognized filing line: " + filing_line)
+            if metrics is not None:
+                metrics.count("lines_skipped", kind="filing")
+            continue
 
-        elif "Certificate Number:" in filing_line:
-            try:
-                certnum_str = re.search(
-                        'Certificate Number:(.*)$', filing_line).group(1)
-                filing_info_proto.certificate_number = certnum_str
-            except Exception as e:
-                print("error -- couldn't parse certificate no: " + str(e))
-                return record_pb2.Record()
+        if kinds is not None:
+            if label == filing_date_label:
+                kind = "components" if header_done else "dates"
+            else:
+                kind = filing_label_kinds[label]
+            if kind not in kinds:
+                continue
+        filing_line_parsers[label](filing_info, value, filing_line,
+                header_done)
 
-        else:
-            print("error -- unrecognized filing line: " + filing_line)
 
+def parse_creditor(creditor_lines, record):
     # Creditor
-    creditor_lines = col_lines_map[ColumnType.CREDITOR]
     seen_creditor = False
     for ind, creditor_line in enumerate(creditor_lines):
         if not creditor_line:
             continue
 
         if seen_creditor:
-            print("error -- unexpected redundant creditor line: "
+            raise RecordParseError("creditor_redundant",
+                    "error -- unexpected redundant creditor line: "
                     + creditor_line)
-            return record_pb2.Record()
 
         if not creditor_line.isupper():
-            print("error -- expected upper-case creditor line, found: "
+            raise RecordParseError("creditor_case",
+                    "error -- expected upper-case creditor line, found: "
                     + creditor_line)
-            return record_pb2.Record()
 
         # if we're here, then this is the properly-formatted creditor line.
-        record_proto.creditor.name = creditor_line
+        record.creditor.name = sys.intern(creditor_line)
         seen_creditor = True
 
-    # if we're here, the proto is now fully assembled.
-    return record_proto
 
-def convert_stream(instream, outstream, output_mode):
-    if output_mode not in ( "textproto", "json" ):
+def convert_record(record_parser, line, output_mode, for_cache=False,
+        failures=None, sequence=None, record_writer=None):
+    # parses and formats a single flattened record, recording the time spent
+    # formatting it, and its latency overall, in the parser's metrics.
+    # returns the formatted record, or with 'for_cache', (formatted record,
+    # parse cache value); see to_cache_value. records that fail to parse
+    # aren't cached: their cache value is None.
+    #
+    # if a record_writer is supplied, the record is written to it instead,
+    # and None is returned. (that saves dictjson output from parsing every
+    # formatted record again to encode it.)
+    #
+    # if the record fails to parse and a 'failures' list is supplied, a
+    # dead-letter entry for it is appended, numbered 'sequence'.
+    metrics = record_parser.metrics
+    layout = record_parser.layout
+    start = time.perf_counter()
+    record = record_parser.parse_line(line)
+    error = record_parser.last_error
+    if error is not None and failures is not None:
+        failures.append(dead_letters.make_entry(sequence, line, error, layout))
+    format_start = time.perf_counter()
+    if for_cache:
+        result = to_cache_value(record, output_mode)
+        if error is not None:
+            result = (result[0], None)
+    elif record_writer is not None:
+        record_writer.write(record)
+        result = None
+    else:
+        result = record_io.format_record(record, output_mode)
+    end = time.perf_counter()
+    metrics.add_time("serialization", end - format_start)
+    metrics.observe("record_seconds", end - start)
+    return result
+
+
+def worker_metrics():
+    # workers collect metrics of their own, and hand back a snapshot with
+    # their results. records in and out are counted by the parent.
+    return run_metrics.Metrics("flattened_to_record", progress_interval=0)
+
+
+def convert_batch(batch):
+    # worker entry point for --workers mode. converts a batch of flattened
+    # records, given the layout in effect at the start of the batch and the
+    # Projection (or None), and returns the formatted output as a single
+    # string (or byte string, for binary modes), dead-letter entries for the
+    # records that failed (numbered from the start of the batch), and a
+    # snapshot of the batch's metrics. only serialized records cross the
+    # process boundary, never record objects.
+    lines, layout, output_mode, projection = batch
+    metrics = worker_metrics()
+    record_parser = RecordParser(layout, metrics, projection)
+    failures = []
+    formatted = [
+        convert_record(record_parser, line, output_mode, failures=failures,
+            sequence=ind)
+        for ind, line in enumerate(lines)]
+    if record_io.is_binary_mode(output_mode):
+        return b"".join(formatted), failures, metrics.snapshot()
+    return ("".join([record + "\n" for record in formatted]), failures,
+            metrics.snapshot())
+
+
+def cache_value_kind(output_mode, projection=None):
+    # the form records are kept in the parse cache for an output mode: the
+    # serialized Record for binary modes, the formatted line otherwise.
+    # dictjson records are formatted as plain json; see record_io.py.
+    # projected records are kept apart from whole ones, and from those of
+    # other projections.
+    if record_io.is_binary_mode(output_mode):
+        kind = "record"
+    else:
+        kind = "json" if output_mode == "dictjson" else output_mode
+    if projection is not None:
+        kind += ":" + projection.fields
+    return kind
+
+
+def to_cache_value(record, output_mode):
+    # returns (formatted record, parse cache value).
+    if record_io.is_binary_mode(output_mode):
+        serialized = record.serialize()
+        return record_io.frame_serialized(serialized, output_mode), serialized
+    formatted = record_io.format_record(record, output_mode)
+    return formatted, formatted.encode("utf-8")
+
+
+def from_cache_value(value, output_mode):
+    # returns the formatted record for a parse cache value.
+    if record_io.is_binary_mode(output_mode):
+        return record_io.frame_serialized(value, output_mode)
+    return value.decode("utf-8")
+
+
+def convert_batch_cached(batch):
+    # worker entry point for --workers mode with --cache. like convert_batch,
+    # but 'cached' holds, for each line, the value found in the parse cache,
+    # or None. only the lines without one are parsed. returns the formatted
+    # output, the parse cache values of the parsed lines (None for those
+    # that failed), dead-letter entries, and a snapshot of the batch's
+    # metrics.
+    lines, layout, output_mode, projection, cached = batch
+    metrics = worker_metrics()
+    record_parser = RecordParser(layout, metrics, projection)
+    formatted = []
+    parsed = []
+    failures = []
+    for ind, (line, value) in enumerate(zip(lines, cached)):
+        if value is not None:
+            record_parser.advance_layout(line)
+            formatted.append(from_cache_value(value, output_mode))
+            continue
+        record, value = convert_record(record_parser, line, output_mode,
+                for_cache=True, failures=failures, sequence=ind)
+        formatted.append(record)
+        parsed.append(value)
+    if record_io.is_binary_mode(output_mode):
+        return b"".join(formatted), parsed, failures, metrics.snapshot()
+    return ("".join([record + "\n" for record in formatted]), parsed,
+            failures, metrics.snapshot())
+
+
+def iter_line_batches(instream, batch_size):
+    batch = []
+    for line in instream:
+        batch.append(line)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def convert_stream_parallel(instream, record_writer, output_mode, workers,
+        batch_size, layout=None, on_written=None, record_cache=None,
+        metrics=None, dead_letter_writer=None, projection=None):
+    # the dispatcher tracks the column layout (cheaply, without parsing) so
+    # that every batch is converted exactly as it would be in a serial run.
+    layout_tracker = RecordParser(layout)
+
+    # results are collected in submission order, so output order matches the
+    # input. the number of batches in flight is capped, so a slow writer
+    # can't cause the whole input to be read into memory.
+    max_pending = 2 * workers
+    pending = collections.deque()
+
+    def write_next():
+        num_lines, result, progress, missed_keys = pending.popleft()
+        if missed_keys is None:
+            formatted, failures, snapshot = result.get()
+        else:
+            formatted, parsed, failures, snapshot = result.get()
+            for key, value in zip(missed_keys, parsed):
+                if value is not None:
+                    record_cache.put(key, value)
+        if dead_letter_writer is not None:
+            for entry in failures:
+                dead_letter_writer.write(entry, record_writer.record_count)
+        record_writer.write_formatted(formatted, num_lines)
+        metrics.merge(snapshot)
+        metrics.count("records_out", num_lines)
+        metrics.maybe_report_progress()
+        if on_written is not None:
+            on_written(*progress)
+
+    with multiprocessing.Pool(workers) as pool:
+        for lines in iter_line_batches(instream, batch_size):
+            metrics.count("records_in", len(lines))
+            batch = (lines, layout_tracker.layout, output_mode, projection)
+            keys = []
+            for line in lines:
+                if record_cache is not None:
+                    # cache lookups happen here, in the dispatcher.
+                    keys.append(record_cache.key(layout_tracker.layout, line))
+                layout_tracker.advance_layout(line)
+
+            # where the input stands once this batch is written.
+            progress = (getattr(instream, "offset", None),
+                    layout_tracker.layout)
+            if record_cache is None:
+                pending.append((len(lines),
+                        pool.apply_async(convert_batch, (batch,)), progress,
+                        None))
+            else:
+                cached = record_cache.get_many(keys)
+                missed_keys = [key for key, value in zip(keys, cached)
+                        if value is None]
+                metrics.count("records_cached",
+                        len(lines) - len(missed_keys))
+                pending.append((len(lines),
+                        pool.apply_async(convert_batch_cached,
+                            (batch + (cached,),)),
+                        progress, missed_keys))
+            if len(pending) >= max_pending:
+                write_next()
+
+        while pending:
+            write_next()
+
+
+def convert_lines(instream, record_writer, output_mode, workers=1,
+        batch_size=default_batch_size, layout=None, on_written=None,
+        record_cache=None, metrics=None, dead_letter_writer=None,
+        projection=None):
+    # converts every flattened record in 'instream', starting with the given
+    # column layout. if supplied, on_written(input_offset, layout) is called
+    # after records are written, with the input offset just past them (for
+    # streams that track it as 'offset', e.g. FlattenedLineReader; otherwise
+    # None), and the layout in effect for the record at that offset.
+    #
+    # with a record_cache (see parse_cache.py), lines found in the cache
+    # aren't parsed, and the records parsed from the others are added to it.
+    #
+    # counters, time spent per phase and per-record latencies are recorded
+    # in 'metrics' (a run_metrics.Metrics), if supplied. records that fail to
+    # parse are written to 'dead_letter_writer' (a
+    # dead_letters.DeadLetterWriter), if supplied. with a Projection, records
+    # are parsed and written projected; see Projection.
+    if metrics is None:
+        metrics = run_metrics.Metrics("flattened_to_record",
+                progress_interval=0)
+    if workers > 1:
+        convert_stream_parallel(instream, record_writer, output_mode,
+                workers, batch_size, layout, on_written, record_cache,
+                metrics, dead_letter_writer, projection)
+        return
+
+    record_parser = RecordParser(layout, metrics, projection)
+    text_output = not record_io.is_binary_mode(output_mode)
+    failures = []
+
+    for line in instream:
+        metrics.count("records_in")
+        if record_cache is not None:
+            key = record_cache.key(record_parser.layout, line)
+            value = record_cache.get(key)
+            if value is not None:
+                metrics.count("records_cached")
+                record_parser.advance_layout(line)
+                formatted = from_cache_value(value, output_mode)
+            else:
+                formatted, value = convert_record(record_parser, line,
+                        output_mode, for_cache=True, failures=failures,
+                        sequence=record_writer.record_count)
+                if value is not None:
+                    record_cache.put(key, value)
+        else:
+            # written out as it's converted.
+            formatted = convert_record(record_parser, line, output_mode,
+                    failures=failures, sequence=record_writer.record_count,
+                    record_writer=record_writer)
+        if failures:
+            if dead_letter_writer is not None:
+                dead_letter_writer.write(failures[0])
+            del failures[:]
+
+        # now write it out:
+        if formatted is not None:
+            if text_output:
+                formatted += "\n"
+            record_writer.write_formatted(formatted, 1)
+        metrics.count("records_out")
+        metrics.maybe_report_progress()
+        if on_written is not None:
+            on_written(getattr(instream, "offset", None),
+                    record_parser.layout)
+
+
+def convert_stream(instream, outstream, output_mode, workers=1,
+        batch_size=default_batch_size, record_cache=None, metrics=None,
+        dead_letter_writer=None, projection=None):
+    # outstream should be opened in binary mode for binary output modes.
+    if output_mode not in record_io.record_modes:
         print("Unrecognized output format")
         return None
 
-    while True:
-        line = instream.readline()
-        if not line:
-            break  # end of file.
-        # generate the proper representation based on output_mode:
-        record_proto = line_to_recordproto(line)
-        record_formatted = ""
-
-        if output_mode == "textproto":
-            record_formatted = text_format.MessageToString(
-                    record_proto, as_one_line=True)
-        elif output_mode == "json":
-            record_formatted = json_format.MessageToJson(
-                    record_proto, indent=None,
-                    preserving_proto_field_name=True)
-
-        # now write it out:
-        outstream.write(record_formatted)
-        outstream.write("\n")
+    record_writer = record_io.RecordWriter(outstream, output_mode)
+    convert_lines(instream, record_writer, output_mode, workers, batch_size,
+            record_cache=record_cache, metrics=metrics,
+            dead_letter_writer=dead_letter_writer, projection=projection)
 
     # if we're here, all the lines have been converted. ok to return.
+    record_writer.close()
+
+
+class FlattenedLineReader:
+    # iterates over the lines of a flattened file opened in binary mode,
+    # decoded as they would be by a file opened in text mode, keeping track
+    # of the input offset. the last line is held back: iteration stops before
+    # it, and it's left in 'last_line'.
+
+    def __init__(self, infile):
+        self.infile = infile
+        self.offset = infile.tell()  # end of the last line yielded.
+        self.last_line = None
+
+    def __iter__(self):
+        previous = None
+        for line in self.infile:
+            if previous is not None:
+                self.offset += len(previous)
+                yield decode_flattened_line(previous)
+            previous = line
+        if previous is not None:
+            self.last_line = decode_flattened_line(previous)
+
+
+def decode_flattened_line(line):
+    line = line.decode("utf-8")
+    if line.endswith("\r\n"):
+        line = line[:-2] + "\n"
+    return line
+
+
+def convert_flattened_file_checkpointed(input_filename, output_filename,
+        output_mode, workers=1, batch_size=default_batch_size,
+        incremental=False, record_cache=None,
+        checkpoint_interval=checkpoint.default_checkpoint_interval,
+        metrics=None, dead_letter_filename=None, projection=None):
+    # like convert_flattened_file, but records checkpoints as it goes (see
+    # checkpoint.py), and picks up from the last one where it can. the
+    # column layout in effect is part of each checkpoint.
+    if metrics is None:
+        metrics = run_metrics.Metrics("flattened_to_record",
+                progress_interval=0)
+    if output_mode not in record_io.record_modes:
+        print("Unrecognized output format")
+        return None
 
-
-def convert_flattened_file(input_filename, output_filename, output_mode):
-    infile = open(input_filename, 'r')
-    outfile = open(output_filename, 'w')
-
-    convert_stream(infile, outfile, output_mode)
-
+    params = {"tool": "flattened_to_record", "output_mode": output_mode}
+    if projection is not None:
+        params["fields"] = projection.fields
+    checkpointer = checkpoint.Checkpointer(input_filename, output_filename,
+            params, checkpoint_interval)
+    resume = checkpointer.resume_point(incremental)
+    layout = None
+    if resume is not None and resume["state"]["layout"] is not None:
+        layout = ColumnLayout.from_dict(resume["state"]["layout"])
+
+    infile = open(input_filename, 'rb')
+    infile.seek(resume["input_offset"] if resume else 0)
+    outfile = checkpointer.open_output(resume,
+            binary=record_io.is_binary_mode(output_mode))
+    record_writer = record_io.RecordWriter(outfile, output_mode,
+            resume["record_count"] if resume else None)
+    reader = FlattenedLineReader(infile)
+    dead_letter_writer = None
+    if dead_letter_filename:
+        dead_letter_writer = dead_letters.DeadLetterWriter(
+                dead_letter_filename,
+                resume["record_count"] if resume else None)
+
+    def layout_state(layout):
+        return {"layout": layout.as_dict() if layout is not None else None}
+
+    # the layout in effect for the next record. the final checkpoint goes
+    # at the start of the last line, so the layout there is needed.
+    next_layout = layout
+
+    def on_written(input_offset, layout):
+        nonlocal next_layout
+        next_layout = layout
+        if checkpointer.due(input_offset):
+            if dead_letter_writer is not None:
+                dead_letter_writer.flush()
+            checkpointer.save(input_offset, outfile,
+                    record_writer.record_count, layout_state(layout))
+
+    convert_lines(reader, record_writer, output_mode, workers, batch_size,
+            layout, on_written, record_cache, metrics, dead_letter_writer,
+            projection)
+    final = (reader.offset, checkpoint.stream_offset(outfile),
+            record_writer.record_count, layout_state(next_layout))
+    if reader.last_line is not None:
+        metrics.count("records_in")
+        failures = []
+        formatted = convert_record(
+                RecordParser(next_layout, metrics, projection),
+                reader.last_line, output_mode, failures=failures,
+                sequence=record_writer.record_count)
+        for entry in failures:
+            if dead_letter_writer is not None:
+                dead_letter_writer.write(entry)
+        if not record_io.is_binary_mode(output_mode):
+            formatted += "\n"
+        record_writer.write_formatted(formatted, 1)
+        metrics.count("records_out")
+    record_writer.close()
+
+    if dead_letter_writer is not None:
+        dead_letter_writer.close()
+
+    input_offset, output_offset, record_count, state = final
+    checkpointer.save(input_offset, outfile, record_count, state,
+            complete=True, output_offset=output_offset)
     outfile.close()
     infile.close()
 
 
+def retry_dead_letters(dead_letter_filename, output_filename, output_mode,
+        metrics=None, projection=None):
+    # parses the records in a dead-letter file again (e.g. after a parser
+    # fix), and puts those that now parse in place of the empty records in
+    # the output, which must be in the same output mode (and projection).
+    # the dead-letter file is rewritten to hold only the records that still
+    # fail.
+    if output_mode not in record_io.record_modes:
+        print("Unrecognized output format")
+        return None
+    if metrics is None:
+        metrics = run_metrics.Metrics("flattened_to_record",
+                progress_interval=0)
+
+    entries = dead_letters.read_dead_letters(dead_letter_filename)
+    replacements = {}
+    failures = []
+    for entry in entries:
+        layout = None
+        if entry["layout"] is not None:
+            layout = ColumnLayout.from_dict(entry["layout"])
+        record_parser = RecordParser(layout, metrics, projection)
+        metrics.count("records_in")
+        formatted = convert_record(record_parser, entry["line"], output_mode,
+                failures=failures, sequence=entry["sequence"])
+        if record_parser.last_error is None:
+            replacements[entry["sequence"]] = formatted
+
+    replaced = record_io.replace_records(output_filename, output_mode,
+            replacements)
+    metrics.count("records_out", replaced)
+    if replaced != len(replacements):
+        print("warning -- " + str(len(replacements) - replaced) + " of the "
+                + "retried records are past the end of " + output_filename)
+
+    dead_letter_writer = dead_letters.DeadLetterWriter(dead_letter_filename)
+    for entry in failures:
+        dead_letter_writer.write(entry)
+    dead_letter_writer.close()
+    print("retried " + str(len(entries)) + " records from "
+            + dead_letter_filename + ": " + str(replaced) + " fixed, "
+            + str(len(failures)) + " still failing")
+
+
+def convert_flattened_file(input_filename, output_filename, output_mode,
+        workers=1, batch_size=default_batch_size, checkpointed=False,
+        incremental=False, cache_filename=None,
+        cache_max_bytes=parse_cache.default_max_bytes, metrics=None,
+        dead_letter_filename=None, projection=None):
+    # 'metrics', if supplied, is a run_metrics.Metrics to record the run in.
+    # records that fail to parse are written to 'dead_letter_filename', if
+    # supplied; see dead_letters.py. with a Projection, only the projected
+    # fields are parsed and written.
+    record_cache = None
+    if cache_filename:
+        record_cache = parse_cache.ParseCache(cache_filename,
+                cache_value_kind(output_mode, projection), cache_max_bytes)
+
+    if checkpointed or incremental:
+        convert_flattened_file_checkpointed(input_filename, output_filename,
+                output_mode, workers, batch_size, incremental, record_cache,
+                metrics=metrics, dead_letter_filename=dead_letter_filename,
+                projection=projection)
+    else:
+        infile = open(input_filename, 'r')
+        outfile = open(output_filename,
+                'wb' if record_io.is_binary_mode(output_mode) else 'w')
+        dead_letter_writer = None
+        if dead_letter_filename:
+            dead_letter_writer = dead_letters.DeadLetterWriter(
+                    dead_letter_filename)
+
+        convert_stream(infile, outfile, output_mode, workers, batch_size,
+                record_cache, metrics, dead_letter_writer, projection)
+
+        if dead_letter_writer is not None:
+            dead_letter_writer.close()
+        outfile.close()
+        infile.close()
+
+    if record_cache is not None:
+        record_cache.close()
+        eprint(record_cache.summary())
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="flattened_to_record")
 
-    parser.add_argument("input_filename", type=str,
+    parser.add_argument("input_filename", type=str, nargs="?",
             help="filename of flattened query text result (one record per "
-            + "line, with escaped newlines).")
+            + "line, with escaped newlines). omitted with --retry_from.")
 
     parser.add_argument("output_filename", type=str,
             help="filename to write a file where each line is a serialized "
             + "representation of an input record (json by default).")
 
     parser.add_argument("--output_mode", type=str,
-            choices=[
-                "textproto",
-                "json"
-            ],
-            help="format of output records. expects one record per line, in "
-            + "the specified format (json, textproto). "
-            + "default: json",
+            choices=record_io.record_modes,
+            help="format of output records. one record per line, in the "
+            + "specified format (json, dictjson, textproto), or a "
+            + "length-delimited binary stream (binary) or framed "
+            + "RecordCollection file (collection). default: json",
             default="json")
 
+    parser.add_argument("--workers", type=int, default=1,
+            help="number of worker processes. with more than one, batches of "
+            + "input lines are converted in parallel; output order is "
+            + "preserved. default: 1")
+
+    parser.add_argument("--batch_size", type=int,
+            default=default_batch_size,
+            help="number of input lines per batch handed to a worker. "
+            + "default: " + str(default_batch_size))
+
+    parser.add_argument("--checkpoint", action="store_true",
+            help="record progress in OUTPUT_FILENAME.checkpoint as the run "
+            + "goes, and resume an interrupted run from there.")
+
+    parser.add_argument("--incremental", action="store_true",
+            help="like --checkpoint, but also pick up after a run that "
+            + "completed: only input appended since then is converted, and "
+            + "appended to the existing output.")
+
+    parser.add_argument("--cache", type=str,
+            help="filename of a parse cache (a sqlite file, created if "
+            + "needed). records already in the cache aren't parsed again, "
+            + "which makes re-runs of overlapping exports cheap.")
+
+    parser.add_argument("--cache_max_mb", type=int,
+            default=parse_cache.default_max_bytes // (1024 * 1024),
+            help="size cap of the parse cache, in MB. least recently used "
+            + "records are evicted beyond it. default: "
+            + str(parse_cache.default_max_bytes // (1024 * 1024)))
+
+    parser.add_argument("--dead_letter_filename", type=str,
+            help="if supplied, write the input lines of records that fail to "
+            + "parse to this file (json lines, with their position in the "
+            + "output and the error), for --retry_from.")
+
+    parser.add_argument("--retry_from", type=str,
+            help="filename of a dead-letter file written by an earlier run. "
+            + "parses only its records again, and puts those that now parse "
+            + "in place in OUTPUT_FILENAME, which must be in the same "
+            + "--output_mode. records that still fail are kept in the "
+            + "dead-letter file.")
+
+    parser.add_argument("--fields", type=str,
+            help="comma-separated Record fields to emit, e.g. "
+            + "record_num,filing_info.amount_usd,creditor.name (a message "
+            + "field, e.g. creditor, takes all of it). columns none of them "
+            + "come from are skipped entirely, so errors in those columns go "
+            + "unnoticed. pass the same --fields with --retry_from. default: "
+            + "all fields.")
+
+    run_metrics.add_arguments(parser)
+
     args = parser.parse_args()
+    if args.retry_from and args.input_filename:
+        parser.error("--retry_from takes only OUTPUT_FILENAME")
+    if not args.retry_from and not args.input_filename:
+        parser.error("the following arguments are required: input_filename")
+    projection = None
+    if args.fields:
+        try:
+            projection = Projection(args.fields)
+        except ValueError as e:
+            parser.error("--fields: " + str(e))
+
+    metrics = run_metrics.Metrics("flattened_to_record",
+            args.progress_interval)
+    if args.retry_from:
+        retry_dead_letters(args.retry_from, args.output_filename,
+                args.output_mode, metrics, projection)
+        metrics.finish(args.metrics_filename, args.metrics_format)
+        sys.exit(0)
 
     convert_flattened_file(
             args.input_filename,
             args.output_filename,
-            args.output_mode)
+            args.output_mode,
+            args.workers,
+            args.batch_size,
+            args.checkpoint,
+            args.incremental,
+            args.cache,
+            args.cache_max_mb * 1024 * 1024,
+            metrics,
+            args.dead_letter_filename,
+            projection)
+    metrics.finish(args.metrics_filename, args.metrics_format)
 
@@ -0,0 +1,192 @@
+# generate_raw_export.py
+
+import argparse
+import random
+
+# usage: python3 generate_raw_export.py output_filename [--records N]
+#                                                       [--seed SEED]
+#                                                       [--malformed_rate R]
+#                                                       [--records_per_query N]
+
+# writes a synthetic raw query result, in the same fixed-width layout as
+# test_data/input/sixel-nixel-raw-data.txt, for exercising and benchmarking
+# the pipeline at any size. records vary in their number of debtors (people
+# with LexIDs, and corporations without), filing components and optional
+# lines, and a fraction of them are deliberately malformed in ways the parser
+# rejects. output is deterministic for a given seed.
+
+# character offsets at which each column starts, as in the sample export.
+column_starts = (0, 13, 50, 87, 159)
+header_names = ("No.", "Debtor", "Address", "Filing", "Creditor")
+
+default_num_records = 10000
+default_seed = 0
+default_malformed_rate = 0.01
+
+surnames = ["DAMIEN", "STEELPENTAGRAM", "FERALPYTHON", "NIGHTSHADE",
+        "GRIMWALD", "VOIDWALKER", "ASHENHEART", "MOURNINGSTAR", "BLACKTHORN",
+        "DREADMOOR", "HOLLOWAY", "CINDERFELL"]
+forenames = ["DRACO D", "AZARIEL PHD", "SERAPHINE R", "MORGANA", "LUCIUS T",
+        "BELLADONNA K", "CASSIUS", "RAVENNA J", "THADDEUS", "LILITH M"]
+corporate_names = ["SUPERTHREAD INC", "GLOOMWORKS LLC", "OBSIDIAN HOLDINGS",
+        "CRYPT & SONS CO", "MIDNIGHT LOGISTICS INC", "GARGOYLE PROPERTIES LP"]
+streets = ["S POZOS DE ALQUITRAN AVE", "SANTA MONICA BLVD", "VICTORY BLVD",
+        "SUNSET BLVD", "HOLLOWAY DR", "LAUREL CANYON BLVD", "MULHOLLAND DR"]
+cities = [("LOS ANGELES", "CA", "9006"), ("BEVERLY HILLS", "CA", "9021"),
+        ("NORTH HOLLYWOOD", "CA", "9160"), ("PASADENA", "CA", "9110"),
+        ("BURBANK", "CA", "9150")]
+categories = ["CIVIL JUDGMENT", "STATE TAX LIEN", "FEDERAL TAX LIEN",
+        "JUDGMENT RELEASE", "SMALL CLAIMS JUDGMENT"]
+offices = ["RIVERDALE COUNTY SUPREME COURT, NY",
+        "FAIRFAX DISTRICT COURT, VA",
+        "CIVIL COURT OF THE CITY OF NEW NEW YORK, NY",
+        "LOS ANGELES COUNTY SUPERIOR COURT, CA",
+        "COUNTY RECORDER, LOS ANGELES, CA"]
+creditors = ["NEFAROUS GROUP LLC", "FOULMOUTH VILLAIN LLC",
+        "SOUTHERN PURCHASING SYSTEMS INC", "STATE OF CALIFORNIA",
+        "INTERNAL REVENUE SERVICE", "MIDNIGHT CAPITAL FUNDING"]
+
+# ways a record can be malformed, each of which makes the parser reject it.
+malformed_kinds = ("amount", "filing_number_first", "creditor_case",
+        "record_number")
+
+
+def format_row(cells):
+    # lays out a single row of up to five columns, trimmed on the right.
+    row = ""
+    for col_start, cell in zip(column_starts, cells):
+        if cell:
+            row = row.ljust(col_start) + cell
+    return row
+
+
+def random_date(rng):
+    return (str(rng.randint(1, 12)) + "/" + str(rng.randint(1, 28)) + "/"
+            + str(rng.randint(1990, 2099)))
+
+
+def random_debtor(rng):
+    # returns (name, lex_id or None, address lines).
+    city, state, zip_prefix = rng.choice(cities)
+    address = [
+        str(rng.randint(100, 99999)) + " " + rng.choice(streets),
+        city + ", " + state + " " + zip_prefix + str(rng.randint(0, 9))
+            + "-" + str(rng.randint(0, 9999)).zfill(4),
+        city + " COUNTY"]
+    if rng.random() < 0.3:
+        return rng.choice(corporate_names), None, address
+    name = rng.choice(surnames) + ", " + rng.choice(forenames)
+    lex_id = str(rng.randint(10 ** 11, 10 ** 12 - 1))
+    return name, lex_id, address
+
+
+def random_filing_lines(rng, malformed):
+    filing_date = random_date(rng)
+    amount = rng.choice([rng.randint(100, 5000), rng.randint(5000, 500000)])
+    lines = ["Filing Date:" + filing_date,
+            "Amount:$" + ("TBD" if malformed == "amount" else
+                "{:,}".format(amount))]
+    if rng.random() < 0.1:
+        lines.append("Certificate Number:"
+                + str(rng.randint(10 ** 6, 10 ** 8)))
+    if malformed == "filing_number_first":
+        lines.append("Filing Number:" + str(rng.randint(10 ** 6, 10 ** 7)))
+
+    num_components = rng.choice([1, 1, 1, 2, 2, 3])
+    for _ in range(num_components):
+        lines.extend([
+            rng.choice(categories),
+            "Filing Number:" + str(rng.randint(10 ** 6, 10 ** 7)),
+            "Filing Date:" + (filing_date if rng.random() < 0.7 else
+                random_date(rng)),
+            "Filing Office:" + rng.choice(offices)])
+    return lines
+
+
+def random_record_rows(rng, record_num, malformed=None):
+    # returns the rows of a single record, including the blank rows that
+    # follow it.
+    num_debtors = rng.choice([1, 1, 1, 2, 2, 3, 4])
+    debtors = [random_debtor(rng) for _ in range(num_debtors)]
+    filing_lines = random_filing_lines(rng, malformed)
+
+    creditor = rng.choice(creditors)
+    if malformed == "creditor_case":
+        creditor = creditor.title()
+    number = str(record_num) + "."
+    if malformed == "record_number":
+        number = "#" + number
+
+    cells = {}  # (row, column) -> text
+
+    # the first debtor starts on the record's first row; each of the others
+    # starts two blank rows below everything above it.
+    row = 0
+    for debtor_ind, (name, lex_id, address) in enumerate(debtors):
+        if debtor_ind > 0:
+            row = max([cell_row for cell_row, _ in cells]
+                    + [len(filing_lines) - 1]) + 3
+        cells[(row, 1)] = name
+        if lex_id is not None:
+            cells[(row + 2, 1)] = "LexID(sm):" + lex_id
+        for line_ind, address_line in enumerate(address):
+            cells[(row + line_ind, 2)] = address_line
+
+    for line_ind, filing_line in enumerate(filing_lines):
+        cells[(line_ind, 3)] = filing_line
+    cells[(0, 0)] = number
+    cells[(0, 4)] = creditor
+
+    num_rows = max([cell_row for cell_row, _ in cells]) + 1
+    rows = [format_row([cells.get((row, col), "") for col in range(5)])
+            for row in range(num_rows)]
+    return rows + [""]
+
+
+def iter_raw_export_lines(num_records, seed=default_seed,
+        malformed_rate=default_malformed_rate, records_per_query=0):
+    # yields the lines (without newlines) of a synthetic raw export. with
+    # records_per_query, the export is several query results in a row, each
+    # with its own header.
+    rng = random.Random(seed)
+    header = format_row(header_names)
+    for record_ind in range(num_records):
+        if record_ind == 0 or (records_per_query
+                and record_ind % records_per_query == 0):
+            yield header
+            yield ""
+        malformed = None
+        if rng.random() < malformed_rate:
+            malformed = rng.choice(malformed_kinds)
+        for row in random_record_rows(rng, record_ind + 1, malformed):
+            yield row
+
+
+def write_raw_export(output_filename, num_records, seed=default_seed,
+        malformed_rate=default_malformed_rate, records_per_query=0):
+    with open(output_filename, 'w') as outfile:
+        for line in iter_raw_export_lines(num_records, seed, malformed_rate,
+                records_per_query):
+            outfile.write(line + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="generate_raw_export")
+    parser.add_argument("output_filename", type=str,
+            help="filename to write the synthetic raw query result to.")
+    parser.add_argument("--records", type=int, default=default_num_records,
+            help="number of records to generate. default: "
+            + str(default_num_records))
+    parser.add_argument("--seed", type=int, default=default_seed,
+            help="random seed. default: " + str(default_seed))
+    parser.add_argument("--malformed_rate", type=float,
+            default=default_malformed_rate,
+            help="fraction of records to make malformed. default: "
+            + str(default_malformed_rate))
+    parser.add_argument("--records_per_query", type=int, default=0,
+            help="if supplied, starts a new query result (with its own "
+            + "header) every this many records.")
+    args = parser.parse_args()
+
+    write_raw_export(args.output_filename, args.records, args.seed,
+            args.malformed_rate, args.records_per_query)
@@ -0,0 +1,190 @@
+# parse_cache.py
+
+import hashlib
+import json
+import sqlite3
+
+# content-addressed cache of parsed records, for flattened_to_record.py
+# --cache.
+#
+# exports of the same query taken weeks apart are mostly the same records,
+# so parsed records are kept in a sqlite file, keyed by a hash of the
+# flattened line, the column layout it was parsed with, parser_version, and
+# the form the record is cached in: the serialized Record (for binary output
+# modes), or the record formatted as json or textproto. a hit skips parsing
+# and formatting entirely. (with the pure-python protobuf runtime, parsing a
+# serialized Record costs about as much as parsing the flattened line, so
+# text output modes cache the formatted text instead.)
+#
+# the cache is capped in size. every entry is stamped with the value of a
+# clock that ticks once per flush, on insert and whenever it's hit; when the
+# cache outgrows its cap, the least recently used entries are evicted.
+
+# bump whenever a change to flattened_to_record.py changes the Record parsed
+# from some line, so that stale entries are never used. (version 2: records
+# that fail to parse are no longer cached, so they're reported every run.
+# version 3: filing dates are parsed into filing_date.)
+parser_version = 3
+
+default_max_bytes = 1024 * 1024 * 1024
+
+# entries are written (and hits re-stamped) in batches of this many.
+flush_size = 10000
+
+# when evicting, the cache is trimmed to this fraction of its cap, so that
+# evictions don't happen on every flush.
+evict_to_fraction = 0.9
+
+# the key is a truncated sha256; 16 bytes is plenty to rule out collisions.
+key_size = 16
+
+
+class ParseCache:
+    def __init__(self, filename, value_kind="record",
+            max_bytes=default_max_bytes):
+        # value_kind names the form records are cached in, e.g. "record" or
+        # "json". entries of each kind are independent.
+        self.filename = filename
+        self.value_kind = value_kind
+        self.max_bytes = max_bytes
+        self.db = sqlite3.connect(filename)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS records ("
+                "key BLOB PRIMARY KEY, record BLOB NOT NULL, "
+                "last_used INTEGER NOT NULL) WITHOUT ROWID")
+        self.db.execute("CREATE INDEX IF NOT EXISTS records_by_last_used "
+                "ON records (last_used)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta ("
+                "name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self.db.commit()
+
+        self.clock = self.meta("clock") + 1
+        self.total_bytes = self.meta("total_bytes")
+
+        self.pending_puts = {}
+        self.pending_hits = []
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # the part of the key shared by every line with the same layout.
+        self.last_layout = None
+        self.last_layout_key = None
+
+    def meta(self, name):
+        row = self.db.execute(
+                "SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def key(self, layout, line):
+        # 'layout' is the ColumnLayout in effect for the line (or None).
+        if self.last_layout_key is None or layout is not self.last_layout:
+            self.last_layout = layout
+            self.last_layout_key = json.dumps(
+                    [parser_version, self.value_kind,
+                        layout.as_dict() if layout is not None else None],
+                    sort_keys=True).encode("utf-8")
+        digest = hashlib.sha256(self.last_layout_key)
+        digest.update(b"\0")
+        digest.update(line.rstrip("\n").encode("utf-8"))
+        return digest.digest()[:key_size]
+
+    def get(self, key):
+        # returns the cached value (as bytes) for the key, or None.
+        row = self.db.execute(
+                "SELECT record FROM records WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            value = self.pending_puts.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+        else:
+            value = row[0]
+            self.pending_hits.append(key)
+        self.hits += 1
+        return value
+
+    def get_many(self, keys):
+        # like get(), for a list of keys. returns a list.
+        found = {}
+        unique_keys = list(set(keys))
+        for start in range(0, len(unique_keys), 500):
+            chunk = unique_keys[start:start + 500]
+            found.update(self.db.execute(
+                    "SELECT key, record FROM records WHERE key IN ("
+                    + ",".join("?" * len(chunk)) + ")", chunk))
+        values = []
+        for key in keys:
+            value = found.get(key)
+            if value is not None:
+                self.pending_hits.append(key)
+            else:
+                value = self.pending_puts.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            values.append(value)
+        return values
+
+    def put(self, key, value):
+        self.pending_puts[key] = value
+        if len(self.pending_puts) + len(self.pending_hits) >= flush_size:
+            self.flush()
+
+    def flush(self):
+        self.db.executemany("UPDATE records SET last_used = ? WHERE key = ?",
+                [(self.clock, key) for key in self.pending_hits])
+        cursor = self.db.executemany(
+                "INSERT OR IGNORE INTO records VALUES (?, ?, ?)",
+                [(key, value, self.clock)
+                    for key, value in self.pending_puts.items()])
+        if cursor.rowcount == len(self.pending_puts):
+            self.total_bytes += sum(
+                    [len(value)
+                        for value in self.pending_puts.values()])
+        else:
+            # some other run inserted the same records meanwhile.
+            self.total_bytes = self.db.execute(
+                    "SELECT COALESCE(SUM(LENGTH(record)), 0) "
+                    "FROM records").fetchone()[0]
+        self.pending_puts = {}
+        self.pending_hits = []
+
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+        self.db.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                [("clock", self.clock), ("total_bytes", self.total_bytes)])
+        self.db.commit()
+        self.clock += 1
+
+    def evict(self):
+        # deletes the least recently used entries, until the cache is down to
+        # evict_to_fraction of its cap.
+        to_free = self.total_bytes - int(self.max_bytes * evict_to_fraction)
+        evicted_keys = []
+        freed = 0
+        for key, size in self.db.execute("SELECT key, LENGTH(record) "
+                "FROM records ORDER BY last_used"):
+            if freed >= to_free:
+                break
+            evicted_keys.append((key,))
+            freed += size
+        self.db.executemany("DELETE FROM records WHERE key = ?",
+                evicted_keys)
+        self.total_bytes -= freed
+        self.evictions += len(evicted_keys)
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def summary(self):
+        lookups = self.hits + self.misses
+        hit_rate = 100.0 * self.hits / lookups if lookups else 0.0
+        return ("parse cache " + self.filename + ": "
+                + str(self.hits) + " hits, " + str(self.misses) + " misses ("
+                + "{:.1f}".format(hit_rate) + "% hit rate), "
+                + str(self.evictions) + " evicted, "
+                + str(self.total_bytes) + " bytes cached")
@@ -0,0 +1,315 @@
+# query_server.py
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import traceback
+import urllib.parse
+import record_index
+import record_io
+
+# usage: python3 query_server.py RECORDS_FILENAME
+#                                [--input_mode {json,textproto,binary,...}]
+#                                [--host HOST] [--port PORT]
+#                                [--unix_socket PATH]
+
+# long-running local server for record lookups. the record file and its
+# indexes (see record_index.py) are opened once and memory-mapped, and the
+# columns used by --where expressions (see columnar_filter.py) are loaded
+# into memory at startup, so queries never re-read the file. clients are
+# served concurrently by a single asyncio event loop.
+#
+# endpoints (HTTP GET), each streaming matching records back as json lines:
+#
+#   /lookup?kind=lex_id&key=999999999999
+#       records with the given key. kind is one of the index kinds built
+#       with record_index.py: lex_id, filing_number, creditor, surname.
+#
+#   /query?where=amount_usd > 10000 %26 creditor == 'NEFAROUS GROUP LLC'
+#          [&limit=N]
+#       records matching a columnar_filter expression (note the '&' has to
+#       be escaped in the url). requires numpy.
+#
+#   /stats
+#       a json object describing the loaded file and indexes.
+#
+# e.g. curl -G localhost:8642/lookup --data-urlencode kind=lex_id \
+#          --data-urlencode key=999999999999
+
+default_port = 8642
+
+# records per column batch held in memory for /query.
+default_column_batch_size = 65536
+
+# records written between flushes of a response, so that large responses
+# don't hold up other clients.
+response_chunk_size = 256
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+class QueryEngine:
+    # the state shared by all connections: memory-mapped record file and
+    # indexes, and in-memory column batches for predicate queries.
+
+    def __init__(self, records_filename, input_mode,
+            column_batch_size=default_column_batch_size):
+        self.records_filename = records_filename
+        self.input_mode = input_mode
+        self.record_file = record_index.RecordFile(records_filename,
+                input_mode)
+
+        self.indexes = {}
+        for kind in record_index.index_kinds:
+            filename = record_index.index_filename(records_filename, kind)
+            if os.path.exists(filename):
+                self.indexes[kind] = record_index.RecordIndex(filename,
+                        records_filename)
+
+        # list of (ColumnBatch, [(offset, length)]), or None without numpy.
+        self.column_batches = None
+        self.num_records = 0
+        try:
+            import columnar_filter
+        except ImportError:
+            eprint("numpy not available; /query is disabled.")
+        else:
+            self.columnar_filter = columnar_filter
+            self.load_columns(column_batch_size)
+
+    def load_columns(self, column_batch_size):
+        columnar_filter = self.columnar_filter
+        column_names = columnar_filter.known_columns
+        from_protos = self.input_mode not in record_io.json_modes
+
+        self.column_batches = []
+        locations = []
+        records = []
+
+        def flush():
+            if from_protos:
+                batch = columnar_filter.ColumnBatch.from_recordprotos(
+                        records, column_names)
+            else:
+                batch = columnar_filter.ColumnBatch.from_dicts(
+                        records, column_names)
+            self.column_batches.append((batch, list(locations)))
+            self.num_records += len(records)
+            del locations[:]
+            del records[:]
+
+        with open(self.records_filename, 'rb') as infile:
+            for offset, length, record in record_index.iter_record_locations(
+                    infile, self.input_mode):
+                locations.append((offset, length))
+                records.append(record)
+                if len(records) >= column_batch_size:
+                    flush()
+        if records:
+            flush()
+
+    def lookup(self, kind, key):
+        # returns [(offset, length)] of the records with the key.
+        return self.indexes[kind].lookup(record_index.normalize_key(kind, key))
+
+    def iter_query(self, where_expression, limit=None):
+        # yields (offset, length) of the records matching the expression.
+        num_matches = 0
+        for batch, locations in self.column_batches:
+            for ind in where_expression.evaluate(batch).nonzero()[0]:
+                yield locations[ind]
+                num_matches += 1
+                if limit is not None and num_matches >= limit:
+                    return
+
+    def record_json_line(self, offset, length):
+        # the record as a line of json (as bytes, newline-terminated).
+        # records in json files are served as-is.
+        if self.input_mode == "json":
+            return bytes(self.record_file.raw_record(offset, length)) + b"\n"
+        if self.input_mode == "dictjson":
+            return (json.dumps(self.record_file.record_dict(offset, length))
+                    + "\n").encode("utf-8")
+        record_proto = self.record_file.record(offset, length)
+        return (record_io.format_record(record_proto, "json")
+                + "\n").encode("utf-8")
+
+    def stats(self):
+        return {
+            "records_filename": self.records_filename,
+            "input_mode": self.input_mode,
+            "indexes": {kind: index.num_entries
+                for kind, index in self.indexes.items()},
+            "num_records": self.num_records,
+            "query_enabled": self.column_batches is not None,
+        }
+
+
+class QueryError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+async def write_response_head(writer, status, content_type):
+    reason = {200: "OK", 400: "Bad Request", 404: "Not Found",
+            405: "Method Not Allowed", 500: "Internal Server Error"}.get(
+                    status, "Error")
+    writer.write(("HTTP/1.1 " + str(status) + " " + reason + "\r\n"
+            + "Content-Type: " + content_type + "\r\n"
+            + "Connection: close\r\n\r\n").encode("ascii"))
+
+
+async def stream_records(writer, engine, locations):
+    chunk = []
+    for offset, length in locations:
+        chunk.append(engine.record_json_line(offset, length))
+        if len(chunk) >= response_chunk_size:
+            writer.write(b"".join(chunk))
+            chunk = []
+            await writer.drain()
+            # drain() only waits if the client is slow to read, and looking
+            # up and decoding records doesn't yield either, so yield here to
+            # let other clients make progress between chunks.
+            await asyncio.sleep(0)
+    writer.write(b"".join(chunk))
+    await writer.drain()
+
+
+def resolve_request(engine, path, params):
+    # returns an iterable of record locations, or a json-serializable object
+    # for non-record endpoints. raises QueryError for bad requests.
+    def param(name):
+        values = params.get(name)
+        if not values:
+            raise QueryError(400, "missing parameter: " + name)
+        return values[0]
+
+    if path == "/lookup":
+        kind = param("kind")
+        if kind not in engine.indexes:
+            raise QueryError(404, "no index for kind: " + kind)
+        return engine.lookup(kind, param("key"))
+
+    if path == "/query":
+        if engine.column_batches is None:
+            raise QueryError(404, "/query requires numpy")
+        try:
+            where_expression = engine.columnar_filter.WhereExpression(
+                    param("where"))
+        except ValueError as e:
+            raise QueryError(400, "invalid where expression: " + str(e))
+        limit = params.get("limit")
+        try:
+            limit = int(limit[0]) if limit else None
+        except ValueError:
+            raise QueryError(400, "invalid limit: " + limit[0])
+        return engine.iter_query(where_expression, limit)
+
+    if path == "/stats":
+        return engine.stats()
+
+    raise QueryError(404, "unknown endpoint: " + path)
+
+
+async def handle_client(engine, reader, writer):
+    head_written = False
+    try:
+        request_line = await reader.readline()
+        # discard headers; every request is answered with 'Connection: close'.
+        while True:
+            header_line = await reader.readline()
+            if header_line in (b"\r\n", b"\n", b""):
+                break
+
+        try:
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+            if method != "GET":
+                raise QueryError(405, "only GET is supported")
+            url = urllib.parse.urlsplit(target)
+            result = resolve_request(engine, url.path,
+                    urllib.parse.parse_qs(url.query))
+        except QueryError as e:
+            await write_response_head(writer, e.status, "text/plain")
+            head_written = True
+            writer.write((str(e) + "\n").encode("utf-8"))
+        except ValueError:
+            await write_response_head(writer, 400, "text/plain")
+            head_written = True
+            writer.write(b"malformed request\n")
+        else:
+            if isinstance(result, dict):
+                await write_response_head(writer, 200, "application/json")
+                head_written = True
+                writer.write((json.dumps(result) + "\n").encode("utf-8"))
+            else:
+                await write_response_head(writer, 200, "application/x-ndjson")
+                head_written = True
+                await stream_records(writer, engine, result)
+        await writer.drain()
+    except ConnectionError:
+        pass  # client went away.
+    except Exception:
+        eprint("!!! error handling request:\n" + traceback.format_exc())
+        # once records are streaming, the client only sees a truncated
+        # response.
+        if not head_written:
+            try:
+                await write_response_head(writer, 500, "text/plain")
+                writer.write(b"internal error\n")
+                await writer.drain()
+            except ConnectionError:
+                pass
+    finally:
+        writer.close()
+
+
+async def serve(engine, host, port, unix_socket):
+    def client_connected(reader, writer):
+        return handle_client(engine, reader, writer)
+
+    if unix_socket:
+        server = await asyncio.start_unix_server(
+                client_connected, path=unix_socket)
+        eprint("serving " + engine.records_filename + " on " + unix_socket)
+    else:
+        server = await asyncio.start_server(client_connected, host, port)
+        eprint("serving " + engine.records_filename + " on http://" + host
+                + ":" + str(port))
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="query_server")
+
+    parser.add_argument("records_filename", type=str,
+            help="filename of the record file to serve. indexes built with "
+            + "record_index.py are picked up from alongside it.")
+
+    parser.add_argument("--input_mode", type=str,
+            choices=record_io.record_modes, default="json",
+            help="format of the record file. default: json")
+
+    parser.add_argument("--host", type=str, default="127.0.0.1",
+            help="address to listen on. default: 127.0.0.1")
+
+    parser.add_argument("--port", type=int, default=default_port,
+            help="port to listen on. default: " + str(default_port))
+
+    parser.add_argument("--unix_socket", type=str,
+            help="if supplied, listen on this unix socket instead of tcp.")
+
+    args = parser.parse_args()
+
+    query_engine = QueryEngine(args.records_filename, args.input_mode)
+    eprint("loaded " + json.dumps(query_engine.stats()))
+    try:
+        asyncio.run(serve(query_engine, args.host, args.port,
+                args.unix_socket))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,423 @@
+# raw_index.py
+
+import argparse
+import array
+import contextlib
+import mmap
+import re
+import struct
+import sys
+import checkpoint
+import flattened_to_record
+import raw_to_flattened
+import record_io
+import run_metrics
+
+# usage: python3 raw_index.py build RAW_FILENAME [--encoding ENCODING]
+#        python3 raw_index.py read RAW_FILENAME
+#                             [--seqs START:STOP[:STEP]]
+#                             [--record_nums FIRST-LAST]
+#                             [--shard I/N]
+#                             [--output_mode {json,textproto,binary,...}]
+#                             [--output_filename OUTPUT_FILENAME]
+#                             [--fields FIELDS] [--encoding ENCODING]
+
+# random access to the records of a raw query result, without a flattened
+# copy of it. an offset index, RAW_FILENAME.offsets.idx, lists where every
+# record starts and ends in the raw file, found with the same rule as
+# raw_to_flattened.py: a record starts at every line beginning with a digit,
+# and runs up to the next one. RawRecordFile memory-maps the raw file, and
+# hands the lines of any record straight to the parser.
+#
+# records are addressed by sequence number (their position in the file,
+# from 0), or by record number (the "No." column, which restarts at 1 in each
+# of several concatenated queries). the column layout each record is parsed
+# with is the one a front-to-back read would use: that of the query header
+# preceding it, which the index points to.
+#
+# index file layout (all integers little-endian int64, so that every array is
+# 8-byte aligned):
+#
+#   header:          magic, number of records n, size of the indexed raw
+#                    file, hash of the raw file (see checkpoint.prefix_hash)
+#   record_bounds:   n + 1 byte offsets. record i spans
+#                    record_bounds[i]:record_bounds[i + 1].
+#   record_nums:     n record numbers.
+#   header_offsets:  n byte offsets of the header line in effect for each
+#                    record, or -1 where there is none.
+#   by_record_num:   n sequence numbers, sorted by record number (and by
+#                    sequence number among equal record numbers).
+#
+# the index is only used while the raw file's size and hash still match it.
+
+index_magic = b"SXNXRAW1"
+index_header = struct.Struct("<8sqq64s")
+
+# matches the start of a record (capturing its record number), or of a query
+# header line. records and headers after the first line are searched for
+# along with the newline in front of them, which is several times faster than
+# a multi-line "^" pattern.
+line_start_pattern = re.compile(rb"(?:([0-9]+)|No\.\s)")
+boundary_pattern = re.compile(rb"\n" + line_start_pattern.pattern)
+
+int64_max = (1 << 63) - 1
+
+
+def index_filename(raw_filename):
+    return raw_filename + ".offsets.idx"
+
+
+def iter_line_starts(buf):
+    # yields (offset, record number digits) for every line that starts a
+    # record, and (offset, None) for every header line.
+    match = line_start_pattern.match(buf)
+    if match is not None:
+        yield 0, match.group(1)
+    for match in boundary_pattern.finditer(buf):
+        yield match.start() + 1, match.group(1)
+
+
+def scan_boundaries(buf):
+    # returns (record_bounds, record_nums, header_offsets) for the raw file
+    # in 'buf', as arrays of int64.
+    record_bounds = array.array('q')
+    record_nums = array.array('q')
+    header_offsets = array.array('q')
+    header_offset = -1
+    for line_start, digits in iter_line_starts(buf):
+        if digits is None:
+            header_offset = line_start
+            continue
+        record_num = int(digits)
+        if record_num > int64_max:
+            raise ValueError("record number at offset " + str(line_start)
+                    + " doesn't fit in the index: " + digits.decode("ascii"))
+        record_bounds.append(line_start)
+        record_nums.append(record_num)
+        header_offsets.append(header_offset)
+    record_bounds.append(len(buf))
+    return record_bounds, record_nums, header_offsets
+
+
+def sort_by_record_num(record_nums):
+    # sequence numbers in record number order. a single query is already in
+    # order, so that case skips the sort.
+    num_records = len(record_nums)
+    if all(record_nums[ind] <= record_nums[ind + 1]
+            for ind in range(num_records - 1)):
+        return array.array('q', range(num_records))
+    return array.array('q', sorted(range(num_records),
+            key=record_nums.__getitem__))
+
+
+def build_index(raw_filename, encoding=raw_to_flattened.default_encoding):
+    if not raw_to_flattened.is_ascii_compatible(encoding):
+        raise ValueError("offset indexes require an ascii-compatible "
+                + "encoding, not " + encoding)
+    with open(raw_filename, 'rb') as infile:
+        file_size = infile.seek(0, 2)
+        if file_size:
+            buf = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+            record_bounds, record_nums, header_offsets = scan_boundaries(buf)
+            buf.close()
+        else:
+            record_bounds, record_nums, header_offsets = scan_boundaries(b"")
+    by_record_num = sort_by_record_num(record_nums)
+    raw_hash = checkpoint.prefix_hash(raw_filename, file_size)
+
+    with open(index_filename(raw_filename), 'wb') as outfile:
+        outfile.write(index_header.pack(index_magic, len(record_nums),
+                file_size, raw_hash.encode("ascii")))
+        for values in (record_bounds, record_nums, header_offsets,
+                by_record_num):
+            if sys.byteorder != "little":
+                values.byteswap()
+            values.tofile(outfile)
+    return len(record_nums)
+
+
+class RawIndex:
+    # memory-mapped reader for an offset index.
+
+    def __init__(self, filename):
+        self.infile = open(filename, 'rb')
+        self.buf = mmap.mmap(self.infile.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.num_records, self.file_size, raw_hash = (
+                index_header.unpack_from(self.buf, 0))
+        if magic != index_magic:
+            raise ValueError("not a raw offset index file: " + filename)
+        self.raw_hash = raw_hash.decode("ascii")
+
+        num_records = self.num_records
+        record_bounds_start = index_header.size
+        record_nums_start = record_bounds_start + 8 * (num_records + 1)
+        header_offsets_start = record_nums_start + 8 * num_records
+        by_record_num_start = header_offsets_start + 8 * num_records
+        end = by_record_num_start + 8 * num_records
+        view = memoryview(self.buf)
+        self.record_bounds = view[
+                record_bounds_start:record_nums_start].cast('q')
+        self.record_nums = view[
+                record_nums_start:header_offsets_start].cast('q')
+        self.header_offsets = view[
+                header_offsets_start:by_record_num_start].cast('q')
+        self.by_record_num = view[by_record_num_start:end].cast('q')
+
+    def lower_bound(self, record_num):
+        # position in by_record_num of the first record with a record number
+        # of at least 'record_num'.
+        low, high = 0, self.num_records
+        while low < high:
+            mid = (low + high) // 2
+            if self.record_nums[self.by_record_num[mid]] < record_num:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def seqs_for_record_nums(self, first, last):
+        # sequence numbers of the records numbered 'first' through 'last',
+        # in file order.
+        return sorted(self.by_record_num[
+                self.lower_bound(first):self.lower_bound(last + 1)])
+
+    def close(self):
+        self.record_bounds.release()
+        self.record_nums.release()
+        self.header_offsets.release()
+        self.by_record_num.release()
+        self.buf.close()
+        self.infile.close()
+
+
+class RawRecordFile:
+    # memory-mapped raw query result, read through its offset index. records
+    # are parsed with a flattened_to_record.RecordParser, which may carry a
+    # Projection and metrics.
+
+    def __init__(self, raw_filename,
+            encoding=raw_to_flattened.default_encoding, record_parser=None):
+        self.encoding = encoding
+        self.index = RawIndex(index_filename(raw_filename))
+        self.infile = open(raw_filename, 'rb')
+        file_size = self.infile.seek(0, 2)
+        if file_size != self.index.file_size or checkpoint.prefix_hash(
+                raw_filename, file_size) != self.index.raw_hash:
+            self.index.close()
+            self.infile.close()
+            raise ValueError("offset index is out of date, rebuild it: "
+                    + index_filename(raw_filename))
+        self.buf = (mmap.mmap(self.infile.fileno(), 0, access=mmap.ACCESS_READ)
+                if file_size else b"")
+        self.record_parser = (record_parser if record_parser is not None
+                else flattened_to_record.RecordParser())
+        self.layouts = {}  # header offset: ColumnLayout.
+        self.inferred_layout = None  # (seq, ColumnLayout), once found.
+
+    def __len__(self):
+        return self.index.num_records
+
+    def record_bytes(self, seq):
+        # the raw bytes of a record's lines (newlines included).
+        bounds = self.index.record_bounds
+        return self.buf[bounds[seq]:bounds[seq + 1]]
+
+    def record_lines(self, seq):
+        # the record's lines, without newlines, as raw_to_record.py groups
+        # them.
+        record = self.record_bytes(seq)
+        if b"\r" in record:
+            record = record.replace(b"\r\n", b"\n")
+        return record.decode(self.encoding).split("\n")
+
+    def layout(self, seq):
+        # the column layout a front-to-back read would parse the record with.
+        # without a header, that's the one RecordParser caches: inferred from
+        # the first record it can be inferred from. records before that one
+        # have none, and the parser infers (or fails to infer) their own.
+        header_offset = self.index.header_offsets[seq]
+        if header_offset < 0:
+            if self.inferred_layout is None:
+                self.inferred_layout = self.infer_layout()
+            first_seq, layout = self.inferred_layout
+            return layout if seq >= first_seq else None
+        if header_offset not in self.layouts:
+            line_end = self.buf.find(b"\n", header_offset)
+            if line_end < 0:
+                line_end = len(self.buf)
+            header_line = self.buf[header_offset:line_end].rstrip(b"\r")
+            self.layouts[header_offset] = (
+                    flattened_to_record.ColumnLayout.from_header_line(
+                        header_line.decode(self.encoding)))
+        return self.layouts[header_offset]
+
+    def infer_layout(self):
+        # returns (seq, layout) for the first of the records before any
+        # header whose layout can be inferred from its first line, or
+        # (len(self), None) if there's none.
+        header_offsets = self.index.header_offsets
+        for seq in range(len(self)):
+            if header_offsets[seq] >= 0:
+                break
+            firstline = self.record_lines(seq)[0]
+            if firstline and not firstline[0].isspace():
+                layout = flattened_to_record.ColumnLayout.from_first_line(
+                        firstline, verbose=False)
+                if layout is not None:
+                    return seq, layout
+        return len(self), None
+
+    def record(self, seq):
+        # the record as a record_model.Record. failures are reported by the
+        # parser, as in the other tools, and come back as empty records.
+        self.record_parser.layout = self.layout(seq)
+        return self.record_parser.parse_lines(self.record_lines(seq))
+
+    def seqs(self, start=None, stop=None, step=None):
+        # sequence numbers of a slice of the file, e.g. seqs(0, None, 100)
+        # samples every 100th record.
+        return range(len(self))[slice(start, stop, step)]
+
+    def seqs_for_record_nums(self, first, last):
+        return self.index.seqs_for_record_nums(first, last)
+
+    def shard_seqs(self, shard_ind, num_shards):
+        # the sequence numbers of the shard_ind'th of num_shards contiguous,
+        # equally sized runs of records.
+        num_records = len(self)
+        return range(num_records * shard_ind // num_shards,
+                num_records * (shard_ind + 1) // num_shards)
+
+    def iter_records(self, seqs):
+        for seq in seqs:
+            yield self.record(seq)
+
+    def close(self):
+        if self.buf:
+            self.buf.close()
+        self.infile.close()
+        self.index.close()
+
+
+def parse_seqs_slice(text):
+    # "START:STOP[:STEP]", with each part optional, as in a python slice.
+    parts = text.split(":")
+    if not 2 <= len(parts) <= 3:
+        raise ValueError("expected START:STOP[:STEP], not " + text)
+    return [int(part) if part else None for part in parts]
+
+
+def parse_range(text, separator):
+    first, last = text.split(separator)
+    return int(first), int(last)
+
+
+def select_seqs(raw_record_file, args, parser):
+    selections = [arg for arg in (args.seqs, args.record_nums, args.shard)
+            if arg is not None]
+    if len(selections) > 1:
+        parser.error("pass at most one of --seqs, --record_nums and --shard")
+    try:
+        if args.seqs is not None:
+            return raw_record_file.seqs(*parse_seqs_slice(args.seqs))
+        if args.record_nums is not None:
+            first, last = parse_range(args.record_nums, "-")
+            return raw_record_file.seqs_for_record_nums(first, last)
+        if args.shard is not None:
+            shard_ind, num_shards = parse_range(args.shard, "/")
+            if not 0 <= shard_ind < num_shards:
+                raise ValueError("expected 0 <= I < N")
+            return raw_record_file.shard_seqs(shard_ind, num_shards)
+    except ValueError as e:
+        parser.error(str(e))
+    return raw_record_file.seqs()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="raw_index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build",
+            help="build the offset index of a raw query result.")
+    build_parser.add_argument("raw_filename", type=str,
+            help="filename of l-n query result.")
+
+    read_parser = subparsers.add_parser("read",
+            help="parse and write out some of the records of an indexed raw "
+            + "query result.")
+    read_parser.add_argument("raw_filename", type=str,
+            help="filename of the indexed l-n query result.")
+    read_parser.add_argument("--seqs", type=str,
+            help="START:STOP[:STEP] slice of the records by sequence number "
+            + "(from 0, in file order), as in python; e.g. ::100 samples "
+            + "every 100th record.")
+    read_parser.add_argument("--record_nums", type=str,
+            help="FIRST-LAST range of record numbers (the No. column), "
+            + "inclusive. in concatenated queries, every query's records "
+            + "in the range are read.")
+    read_parser.add_argument("--shard", type=str,
+            help="I/N: the I'th (from 0) of N contiguous shards of about the "
+            + "same number of records.")
+    read_parser.add_argument("--output_mode", type=str,
+            choices=record_io.record_modes, default="json",
+            help="format of output records. default: json")
+    read_parser.add_argument("--output_filename", type=str,
+            help="filename to write the records to. default: stdout")
+    read_parser.add_argument("--fields", type=str,
+            help="comma-separated Record fields to emit, as in "
+            + "flattened_to_record.py. default: all fields.")
+    run_metrics.add_arguments(read_parser)
+
+    for subparser in (build_parser, read_parser):
+        subparser.add_argument("--encoding", type=str,
+                default=raw_to_flattened.default_encoding,
+                help="text encoding of the raw file; must be "
+                + "ascii-compatible. default: "
+                + raw_to_flattened.default_encoding)
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        try:
+            num_records = build_index(args.raw_filename, args.encoding)
+        except ValueError as e:
+            parser.error(str(e))
+        print("indexed " + str(num_records) + " records in "
+                + index_filename(args.raw_filename))
+    elif args.command == "read":
+        projection = None
+        if args.fields:
+            try:
+                projection = flattened_to_record.Projection(args.fields)
+            except ValueError as e:
+                parser.error("--fields: " + str(e))
+        metrics = run_metrics.Metrics("raw_index", args.progress_interval)
+        try:
+            raw_record_file = RawRecordFile(args.raw_filename, args.encoding,
+                    flattened_to_record.RecordParser(metrics=metrics,
+                        projection=projection))
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+        seqs = select_seqs(raw_record_file, args, parser)
+
+        binary = record_io.is_binary_mode(args.output_mode)
+        if args.output_filename:
+            outstream = open(args.output_filename, 'wb' if binary else 'w')
+        else:
+            outstream = sys.stdout.buffer if binary else sys.stdout
+        record_writer = record_io.RecordWriter(outstream, args.output_mode)
+        # the parser reports failed records on stdout, so they go to stderr
+        # while records are written there.
+        with (contextlib.nullcontext() if args.output_filename
+                else contextlib.redirect_stdout(sys.stderr)):
+            for record in raw_record_file.iter_records(seqs):
+                metrics.count("records_in")
+                with metrics.phase("serialization"):
+                    record_writer.write(record)
+                metrics.count("records_out")
+                metrics.maybe_report_progress()
+        record_writer.close()
+        raw_record_file.close()
+        if args.output_filename:
+            outstream.close()
+        metrics.finish(args.metrics_filename, args.metrics_format)
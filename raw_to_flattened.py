@@ -1,8 +1,23 @@
 # raw_to_flattened.py
 
 import argparse
+import checkpoint
+import collections
+import io
+import multiprocessing
+import os
+import re
+import run_metrics
+import sys
+import time
 
-# usage: python3 row_to_flattened.py infile outfile
+# usage: python3 row_to_flattened.py infile outfile [--encoding ENCODING]
+#                                                   [--workers N]
+#                                                   [--checkpoint]
+#                                                   [--incremental]
+#                                                   [--metrics_filename FILE]
+#                                                   [--metrics_format FORMAT]
+#                                                   [--progress_interval S]
 
 # infile: filename of a multi-line query result txt.
 
@@ -10,49 +25,393 @@ import argparse
 # record occupies exactly one line, consisting of the record's lines from the
 # input file concatenated together with escaped '\\n' sequences.
 
+# a record starts at every line beginning with an ascii digit (0-9; not other
+# unicode digits). lines end at '\n', and '\r\n' line endings are read as
+# '\n'; a lone '\r' is kept as is, and doesn't end a line. both engines below,
+# and raw_index.py, follow these rules.
+
 sentinel_linemarker = "\\n"
 
+default_encoding = "utf-8"
+
+# size of each read from the input file in the byte-oriented engine. every
+# chunk is extended to the end of the line it stops in, so chunks always end
+# on a line boundary.
+default_chunk_size = 16 * 1024 * 1024
+
+# target size of each byte range handed to a worker in --workers mode. the
+# input is split into many more shards than workers, so uneven shards even
+# out across the pool. at most max_pending_shards_per_worker shards per worker
+# are in flight at once, so memory use stays bounded even when writing the
+# output falls behind.
+default_shard_size = 64 * 1024 * 1024
+max_pending_shards_per_worker = 2
+
+# matches the first byte of any line that begins with an ascii digit, i.e.
+# the start of a new record.
+record_start_pattern = re.compile(rb"^[0-9]", re.MULTILINE)
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
 def starts_with_digit(instring):
-    return instring[:1].isdigit()
+    # for str or bytes lines. only ascii digits count, as in the byte engine.
+    first = instring[:1]
+    return first.isdigit() and first.isascii()
+
+
+def iter_record_lines(instream, preamble=None):
+    # text-mode record grouping. yields each record as the list of its lines
+    # (newlines included). text before the first record (i.e. the header) is
+    # skipped, or appended line by line to 'preamble', if supplied.
+    #
+    # 'instream' should be opened with newline="\n", so that lines are split
+    # and '\r\n' translated as in the byte engine, not by universal newlines.
+    record_lines = None  # lines of the record in progress.
+    for line in instream:
+        if line.endswith("\r\n"):
+            line = line[:-2] + "\n"
+        if starts_with_digit(line):
+            # line is the start of a new record. emit the old one, if any.
+            if record_lines is not None:
+                yield record_lines
+            record_lines = []
+        elif record_lines is None:
+            # still reading ahead past the header, to the first record line.
+            if preamble is not None:
+                preamble.append(line)
+            continue
+        record_lines.append(line)
+
+    # emit the final entry.
+    if record_lines is not None:
+        yield record_lines
+
 
-def flatten_instream_to_outstream(instream, outstream):
-    # first, read ahead past the header, to the first record line. this is the
-    # first line that begins with a digit.
-    to_emit = ""
+def iter_flattened_records(instream):
+    # yields each record as a single flattened string (without a trailing
+    # newline). each record's lines are joined once, so the cost is linear in
+    # record length.
+    for record_lines in iter_record_lines(instream):
+        yield "".join(
+                [line.replace("\n", sentinel_linemarker)
+                    for line in record_lines])
+
+
+def flatten_instream_to_outstream(instream, outstream, metrics=None):
+    records = iter_flattened_records(instream)
+    if metrics is not None:
+        records = run_metrics.timed_iter(records, metrics, "flatten")
+    for flattened in records:
+        outstream.write(flattened + "\n")
+        if metrics is not None:
+            metrics.count("records_in")
+            metrics.count("records_out")
+            metrics.maybe_report_progress()
+
+
+def is_ascii_compatible(encoding):
+    # the byte-oriented engine finds digits and newlines without decoding,
+    # which only works if the encoding represents them as single ascii bytes.
+    probe = "0123456789\n" + sentinel_linemarker
+    try:
+        return probe.encode(encoding) == probe.encode("ascii")
+    except LookupError:
+        return False
+
+
+def iter_raw_record_batches(instream, chunk_size=default_chunk_size,
+        preamble=None, progress=None):
+    # byte-oriented record grouping over a binary stream. yields lists of
+    # complete records, one list per chunk read, where each record is the raw
+    # bytes of its lines (newlines included). text before the first record
+    # (i.e. the header) is skipped, or appended to 'preamble', if supplied.
+    #
+    # if a 'progress' dictionary is supplied, then whenever a list of records
+    # is yielded, progress["record_offset"] holds the input offset of the
+    # start of the record following them, and progress["final"] is set for
+    # the final list, which holds just the last record.
+    offset = instream.tell() if progress is not None else 0
+    pending = None  # fragments of the record in progress.
     while True:
-        line = instream.readline()
-        if not line:
+        chunk = instream.read(chunk_size)
+        if not chunk:
             break  # end of file.
-        if starts_with_digit(line):
-            to_emit = line.replace("\n", sentinel_linemarker)
-            break  # exit read-loop, 'to_emit' contains first line of record.
+        if not chunk.endswith(b"\n"):
+            # extend the chunk to a line boundary, so that every line start in
+            # the chunk is visible to the pattern.
+            chunk += instream.readline()
+        chunk_offset = offset
+        offset += len(chunk)
+
+        starts = [m.start() for m in record_start_pattern.finditer(chunk)]
+        if b"\r" in chunk:
+            # match text-mode newline translation of '\r\n' line endings.
+            # (record starts are found first, so they're input offsets.)
+            pieces = [piece.replace(b"\r\n", b"\n") for piece in
+                    split_at(chunk, starts)]
+        else:
+            pieces = split_at(chunk, starts)
+
+        if not starts:
+            # no record boundary in this chunk; it's all part of the record in
+            # progress (or of the header).
+            if pending is not None:
+                pending.append(pieces[0])
+            elif preamble is not None:
+                preamble.append(pieces[0])
+            continue
+
+        records = []
+        if pending is not None:
+            pending.append(pieces[0])
+            records.append(b"".join(pending))
+        elif preamble is not None:
+            preamble.append(pieces[0])
+        records.extend(pieces[1:-1])
+        pending = [pieces[-1]]
+
+        if progress is not None:
+            progress["record_offset"] = chunk_offset + starts[-1]
+            progress["final"] = False
+        yield records
+
+    # emit the final entry.
+    if pending is not None:
+        if progress is not None:
+            progress["final"] = True
+        yield [b"".join(pending)]
+
+
+def split_at(chunk, starts):
+    # splits 'chunk' at each offset in 'starts', which are in order. always
+    # returns len(starts) + 1 pieces; the first is empty if starts[0] is 0.
+    bounds = [0] + starts + [len(chunk)]
+    return [chunk[bounds[ind]:bounds[ind + 1]]
+            for ind in range(len(bounds) - 1)]
+
 
-    # if we're here, and to_emit is empty, it means we hit the end of the file.
-    if not to_emit:
+def write_flattened_records(records, outstream, sentinel, metrics=None):
+    # flattens a list of raw records (as yielded by iter_raw_record_batches)
+    # and writes them out, one per line.
+    if metrics is None:
+        outstream.write(b"".join(
+                [record.replace(b"\n", sentinel) + b"\n"
+                    for record in records]))
         return
+    start = time.perf_counter()
+    flattened = b"".join(
+            [record.replace(b"\n", sentinel) + b"\n" for record in records])
+    write_start = time.perf_counter()
+    outstream.write(flattened)
+    metrics.add_time("write", time.perf_counter() - write_start)
+    metrics.add_time("flatten", write_start - start)
+    metrics.count("records_in", len(records))
+    metrics.count("records_out", len(records))
+    metrics.count("bytes_out", len(flattened))
+
+
+def flatten_binstream_to_binstream(instream, outstream,
+        encoding=default_encoding, chunk_size=default_chunk_size,
+        metrics=None):
+    # byte-oriented equivalent of flatten_instream_to_outstream. records are
+    # never decoded; output bytes are in the same encoding as the input.
+    sentinel = sentinel_linemarker.encode(encoding)
+    batches = iter_raw_record_batches(instream, chunk_size)
+    if metrics is not None:
+        # reading, and finding where records start.
+        batches = run_metrics.timed_iter(batches, metrics, "read")
+    for records in batches:
+        write_flattened_records(records, outstream, sentinel, metrics)
+        if metrics is not None:
+            metrics.maybe_report_progress()
+
+
+def find_record_start(infile, offset):
+    # returns the byte offset of the first record start at or after 'offset'
+    # in a binary file, or the file size if there is none.
+    if offset <= 0:
+        offset = 0
+        infile.seek(0)
+    else:
+        # step back one byte and discard the rest of the line; if 'offset' is
+        # already at a line start, this only consumes the preceding newline.
+        infile.seek(offset - 1)
+        infile.readline()
 
-    # if we're here, then to_emit contains the first record, in progress.
-    # loop through to the end.
     while True:
-        line = instream.readline()
+        line_start = infile.tell()
+        line = infile.readline()
         if not line:
-            break  # end of file.
+            return line_start  # end of file.
         if starts_with_digit(line):
-            # line is the start of a new record. emit the old one.
-            outstream.write(to_emit + "\n")
-            to_emit = ""
-        # then, add the contents of the current line to the entry in progress.    
-        to_emit = to_emit + line.replace("\n", sentinel_linemarker)
+            return line_start
+
+
+def find_shard_ranges(input_filename, num_shards, start=0):
+    # splits the file (from 'start' on) into up to 'num_shards' byte ranges,
+    # where every range but the first begins at a record start. concatenating
+    # the flattened shards in order gives the same result as flattening the
+    # whole file.
+    file_size = os.path.getsize(input_filename)
+    boundaries = [start]
+    with open(input_filename, 'rb') as infile:
+        for shard_ind in range(1, num_shards):
+            boundary = find_record_start(infile,
+                    start + (file_size - start) * shard_ind // num_shards)
+            # a long record can swallow several nominal split points.
+            if boundary > boundaries[-1]:
+                boundaries.append(boundary)
+    if file_size > boundaries[-1]:
+        boundaries.append(file_size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def flatten_shard(shard):
+    # worker entry point for --workers mode: flattens one byte range of the
+    # input file and returns the flattened bytes, and a snapshot of the
+    # shard's metrics.
+    input_filename, start, end, encoding = shard
+    metrics = run_metrics.Metrics("raw_to_flattened", progress_interval=0)
+    with metrics.phase("read"):
+        with open(input_filename, 'rb') as infile:
+            infile.seek(start)
+            shard_bytes = infile.read(end - start)
+    outstream = io.BytesIO()
+    flatten_binstream_to_binstream(
+            io.BytesIO(shard_bytes), outstream, encoding, metrics=metrics)
+    return outstream.getvalue(), metrics.snapshot()
 
-    # emit the final entry.
-    outstream.write(to_emit + "\n")
 
+def iter_flattened_shards(pool, shards, workers):
+    # flattens shards in the pool, and yields (shard, (flattened, snapshot))
+    # for each, in file order.
+    max_pending = max_pending_shards_per_worker * workers
+    pending = collections.deque()
+    for shard in shards:
+        pending.append((shard, pool.apply_async(flatten_shard, (shard,))))
+        if len(pending) >= max_pending:
+            shard, result = pending.popleft()
+            yield shard, result.get()
+    while pending:
+        shard, result = pending.popleft()
+        yield shard, result.get()
 
-def flatten_by_filename(input_filename, output_filename):
-    infile = open(input_filename, 'r')
-    outfile = open(output_filename, 'w')
 
-    flatten_instream_to_outstream(infile, outfile)
+def flatten_by_filename_parallel(input_filename, output_filename, workers,
+        encoding=default_encoding, shard_size=default_shard_size,
+        metrics=None):
+    if metrics is None:
+        metrics = run_metrics.Metrics("raw_to_flattened", progress_interval=0)
+    file_size = os.path.getsize(input_filename)
+    num_shards = max(workers, -(-file_size // shard_size))
+    shards = [(input_filename, start, end, encoding)
+            for start, end in find_shard_ranges(input_filename, num_shards)]
+
+    outfile = open(output_filename, 'wb')
+    with multiprocessing.Pool(workers) as pool:
+        for _, (flattened, snapshot) in iter_flattened_shards(pool, shards,
+                workers):
+            outfile.write(flattened)
+            metrics.merge(snapshot)
+            metrics.maybe_report_progress()
+    outfile.close()
+
+
+def flatten_by_filename_checkpointed(input_filename, output_filename,
+        encoding=default_encoding, workers=1, incremental=False,
+        checkpoint_interval=checkpoint.default_checkpoint_interval,
+        metrics=None):
+    # like flatten_by_filename, but records checkpoints as it goes (see
+    # checkpoint.py), and picks up from the last one where it can.
+    if metrics is None:
+        metrics = run_metrics.Metrics("raw_to_flattened", progress_interval=0)
+    checkpointer = checkpoint.Checkpointer(input_filename, output_filename,
+            {"tool": "raw_to_flattened", "encoding": encoding},
+            checkpoint_interval)
+    resume = checkpointer.resume_point(incremental)
+    start = resume["input_offset"] if resume else 0
+    record_count = resume["record_count"] if resume else 0
+    outfile = checkpointer.open_output(resume, binary=True)
+
+    if workers > 1:
+        # every shard but the last is flattened in parallel, and checkpointed
+        # once written. the last one is left to the loop below, which knows
+        # where the last record starts.
+        remaining = os.path.getsize(input_filename) - start
+        num_shards = max(workers, -(-remaining // default_shard_size))
+        shard_ranges = find_shard_ranges(input_filename, num_shards, start)
+        shards = [(input_filename, shard_start, shard_end, encoding)
+                for shard_start, shard_end in shard_ranges[:-1]]
+        with multiprocessing.Pool(workers) as pool:
+            for shard, (flattened, snapshot) in iter_flattened_shards(pool,
+                    shards, workers):
+                outfile.write(flattened)
+                metrics.merge(snapshot)
+                metrics.maybe_report_progress()
+                record_count += flattened.count(b"\n")
+                start = shard[2]
+                if checkpointer.due(start):
+                    checkpointer.save(start, outfile, record_count)
+
+    sentinel = sentinel_linemarker.encode(encoding)
+    # the final checkpoint: the start of the last record.
+    final = (start, checkpoint.stream_offset(outfile), record_count)
+    progress = {}
+    infile = open(input_filename, 'rb')
+    infile.seek(start)
+    for records in run_metrics.timed_iter(
+            iter_raw_record_batches(infile, progress=progress), metrics,
+            "read"):
+        if progress["final"]:
+            final = (progress["record_offset"],
+                    checkpoint.stream_offset(outfile), record_count)
+        write_flattened_records(records, outfile, sentinel, metrics)
+        metrics.maybe_report_progress()
+        record_count += len(records)
+        if not progress["final"] and checkpointer.due(
+                progress["record_offset"]):
+            checkpointer.save(progress["record_offset"], outfile,
+                    record_count)
+    infile.close()
+
+    input_offset, output_offset, final_count = final
+    checkpointer.save(input_offset, outfile, final_count, complete=True,
+            output_offset=output_offset)
+    outfile.close()
+
+
+def flatten_by_filename(input_filename, output_filename,
+        encoding=default_encoding, workers=1, checkpointed=False,
+        incremental=False, metrics=None):
+    # 'metrics', if supplied, is a run_metrics.Metrics to record the run in.
+    if not is_ascii_compatible(encoding):
+        if workers > 1:
+            eprint("--workers requires an ascii-compatible encoding. "
+                    + "falling back to a single worker for " + encoding)
+        if checkpointed or incremental:
+            eprint("--checkpoint and --incremental require an "
+                    + "ascii-compatible encoding. converting all of the "
+                    + "input, without checkpoints.")
+        # fall back to the text-mode engine for encodings like utf-16.
+        infile = open(input_filename, 'r', encoding=encoding, newline="\n")
+        outfile = open(output_filename, 'w', encoding=encoding, newline="\n")
+        flatten_instream_to_outstream(infile, outfile, metrics)
+    elif checkpointed or incremental:
+        flatten_by_filename_checkpointed(input_filename, output_filename,
+                encoding, workers, incremental, metrics=metrics)
+        return
+    elif workers > 1:
+        flatten_by_filename_parallel(input_filename, output_filename,
+                workers, encoding, metrics=metrics)
+        return
+    else:
+        infile = open(input_filename, 'rb')
+        outfile = open(output_filename, 'wb')
+        flatten_binstream_to_binstream(infile, outfile, encoding,
+                metrics=metrics)
 
     outfile.close()
     infile.close()
@@ -64,6 +423,25 @@ if __name__ == "__main__":
             help="filename of l-n query result.")
     parser.add_argument("output_filename", metavar="output_filename", type=str,
             help="filename of output file (single line per record).")
+    parser.add_argument("--encoding", type=str, default=default_encoding,
+            help="text encoding of the input file. the output is written in "
+            + "the same encoding. default: " + default_encoding)
+    parser.add_argument("--workers", type=int, default=1,
+            help="number of worker processes. with more than one, the input "
+            + "is split into shards at record boundaries, which are "
+            + "flattened in parallel and concatenated in order. default: 1")
+    parser.add_argument("--checkpoint", action="store_true",
+            help="record progress in OUTPUT_FILENAME.checkpoint as the run "
+            + "goes, and resume an interrupted run from there.")
+    parser.add_argument("--incremental", action="store_true",
+            help="like --checkpoint, but also pick up after a run that "
+            + "completed: only input appended since then is flattened, and "
+            + "appended to the existing output.")
+    run_metrics.add_arguments(parser)
     args = parser.parse_args()
 
-    flatten_by_filename(args.input_filename, args.output_filename)    
+    metrics = run_metrics.Metrics("raw_to_flattened", args.progress_interval)
+    flatten_by_filename(args.input_filename, args.output_filename,
+            args.encoding, args.workers, args.checkpoint, args.incremental,
+            metrics)
+    metrics.finish(args.metrics_filename, args.metrics_format)
@@ -0,0 +1,201 @@
+# raw_to_record.py
+
+import argparse
+import io
+import raw_to_flattened
+import flattened_to_record
+import filter_records
+import record_io
+import run_metrics
+import sqlite_store
+import time
+
+# usage: python3 raw_to_record.py infile outfile
+#                                 [--output_mode MODE]
+#                                 [--exec EXEC]
+#                                 [--encoding ENCODING]
+#                                 [--metrics_filename METRICS_FILENAME]
+#                                 [--metrics_format {json,prometheus}]
+#                                 [--progress_interval SECONDS]
+
+# single-pass equivalent of raw_to_flattened.py followed by
+# flattened_to_record.py (and, if --exec is supplied, filter_records.py).
+#
+# each stage is a generator: records are grouped from the raw query result,
+# handed as lists of lines straight to the parser, optionally filtered, and
+# serialized. no intermediate flattened file is written, and records never
+# go through the '\\n' sentinel escape/unescape round trip.
+#
+# besides the record modes of record_io.py, --output_mode sqlite loads the
+# records into a sqlite database (see sqlite_store.py) named by outfile.
+
+output_modes = record_io.record_modes + ("sqlite",)
+
+
+def iter_raw_record_lines(instream, encoding, preamble=None):
+    # stage 1: group the lines of a binary raw query result into records.
+    # yields a list of lines (without newlines) per record. the lines before
+    # the first record are added to 'preamble', if supplied, before the first
+    # record is yielded.
+    if not raw_to_flattened.is_ascii_compatible(encoding):
+        # fall back to text-mode grouping for encodings like utf-16.
+        textstream = io.TextIOWrapper(instream, encoding=encoding,
+                newline="\n")
+        raw_preamble = []
+        for record_lines in raw_to_flattened.iter_record_lines(
+                textstream, raw_preamble):
+            if raw_preamble and preamble is not None:
+                preamble.extend([line.rstrip("\n") for line in raw_preamble])
+            del raw_preamble[:]
+            yield [line.rstrip("\n") for line in record_lines]
+        return
+
+    raw_preamble = []
+    for records in raw_to_flattened.iter_raw_record_batches(
+            instream, preamble=raw_preamble):
+        if raw_preamble and preamble is not None:
+            preamble_text = b"".join(raw_preamble).decode(encoding)
+            preamble.extend(preamble_text.split("\n"))
+        del raw_preamble[:]
+        for record in records:
+            yield record.decode(encoding).split("\n")
+
+
+def iter_records(record_lines_iter, preamble=None, metrics=None):
+    # stage 2: parse each record into a record_model.Record. the column
+    # layout is taken from the query header in 'preamble', once stage 1 has
+    # filled it in, and from any later headers between concatenated queries.
+    record_parser = flattened_to_record.RecordParser(metrics=metrics)
+    for record_lines in record_lines_iter:
+        if preamble:
+            record_parser.observe_lines(preamble)
+            del preamble[:]
+        if metrics is None:
+            yield record_parser.parse_lines(record_lines)
+            continue
+        metrics.count("records_in")
+        start = time.perf_counter()
+        record = record_parser.parse_lines(record_lines)
+        metrics.observe("record_seconds", time.perf_counter() - start)
+        yield record
+
+
+def iter_filtered_records(record_iter, string_to_execute, metrics=None):
+    # stage 3 (optional): keep only the records which pass the EXEC block.
+    # see filter_records.py for the contract of the block.
+    record_filter = filter_records.RecordFilter(string_to_execute)
+    phase = metrics.phase if metrics is not None else run_metrics.untimed
+    for record in record_iter:
+        with phase("exec"):
+            to_emit = record_filter.passes_record_model(record)
+        if to_emit:
+            yield record
+        elif metrics is not None:
+            metrics.count("filtered_out", kind="exec")
+
+
+def convert_raw_stream(instream, outstream, output_mode,
+        encoding=raw_to_flattened.default_encoding, string_to_execute=None,
+        metrics=None, record_writer=None):
+    # outstream should be opened in binary mode for binary output modes.
+    # 'metrics', if supplied, is a run_metrics.Metrics to record the run in.
+    # if a 'record_writer' is supplied (e.g. a
+    # sqlite_store.SqliteStoreWriter), records are written to it instead.
+    if record_writer is None and output_mode not in record_io.record_modes:
+        print("Unrecognized output format")
+        return None
+    if metrics is None:
+        metrics = run_metrics.Metrics("raw_to_record", progress_interval=0)
+
+    preamble = []
+    records = iter_records(
+            iter_raw_record_lines(instream, encoding, preamble), preamble,
+            metrics)
+    if string_to_execute:
+        records = iter_filtered_records(records, string_to_execute, metrics)
+
+    if record_writer is None:
+        record_writer = record_io.RecordWriter(outstream, output_mode)
+    for record in records:
+        with metrics.phase("serialization"):
+            record_writer.write(record)
+        metrics.count("records_out")
+        metrics.maybe_report_progress()
+    if output_mode == "sqlite":
+        # the last, partial batch of rows is inserted as part of
+        # serialization, then the database's indexes are built.
+        with metrics.phase("serialization"):
+            record_writer.flush()
+        with metrics.phase("index"):
+            record_writer.build_indexes()
+        with metrics.phase("commit"):
+            record_writer.close()
+    else:
+        record_writer.close()
+
+
+def convert_raw_file(input_filename, output_filename, output_mode,
+        encoding=raw_to_flattened.default_encoding, string_to_execute=None,
+        metrics=None):
+    infile = open(input_filename, 'rb')
+    if output_mode == "sqlite":
+        convert_raw_stream(infile, None, output_mode, encoding,
+                string_to_execute, metrics,
+                sqlite_store.SqliteStoreWriter(output_filename))
+        infile.close()
+        return
+
+    outfile = open(output_filename,
+            'wb' if record_io.is_binary_mode(output_mode) else 'w')
+
+    convert_raw_stream(infile, outfile, output_mode, encoding,
+            string_to_execute, metrics)
+
+    outfile.close()
+    infile.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="raw_to_record")
+
+    parser.add_argument("input_filename", type=str,
+            help="filename of l-n query result.")
+
+    parser.add_argument("output_filename", type=str,
+            help="filename to write a file where each line is a serialized "
+            + "representation of an input record (json by default).")
+
+    parser.add_argument("--output_mode", type=str,
+            choices=output_modes,
+            help="format of output records. one record per line, in the "
+            + "specified format (json, dictjson, textproto), or a "
+            + "length-delimited binary stream (binary) or framed "
+            + "RecordCollection file (collection). with sqlite, records "
+            + "are loaded into the sqlite database output_filename (see "
+            + "sqlite_store.py). default: json",
+            default="json")
+
+    parser.add_argument("--exec", type=str,
+            help="optional python block, executed once for each record, as "
+            + "in filter_records.py. if supplied, only records for which the "
+            + "block sets to_emit to True are written. *DO NOT* write to "
+            + "stdout.")
+
+    parser.add_argument("--encoding", type=str,
+            default=raw_to_flattened.default_encoding,
+            help="text encoding of the input file. default: "
+            + raw_to_flattened.default_encoding)
+
+    run_metrics.add_arguments(parser)
+
+    args = parser.parse_args()
+
+    metrics = run_metrics.Metrics("raw_to_record", args.progress_interval)
+    convert_raw_file(
+            args.input_filename,
+            args.output_filename,
+            args.output_mode,
+            args.encoding,
+            args.exec,
+            metrics)
+    metrics.finish(args.metrics_filename, args.metrics_format)
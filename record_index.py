@@ -0,0 +1,450 @@
+# record_index.py
+
+import argparse
+import heapq
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import checkpoint
+import record_io
+import record_json
+import record_pb2
+
+# usage: python3 record_index.py build RECORDS_FILENAME
+#                                [--input_mode {json,textproto,binary,...}]
+#                                [--kinds KIND,KIND,...]
+#        python3 record_index.py lookup RECORDS_FILENAME KIND VALUE
+#                                [--input_mode {json,textproto,binary,...}]
+#                                [--output_mode {json,textproto,binary,...}]
+
+# secondary indexes over a record file, for point lookups without a full
+# scan. each index maps one kind of key to the byte offsets of the records
+# which contain it:
+#
+#   lex_id         Debtor.lex_id
+#   filing_number  FilingComponent.filing_number
+#   creditor       Creditor.name
+#   surname        Debtor.parsed_surname
+#
+# an index is a single file, RECORDS_FILENAME.KIND.idx, with entries sorted by
+# key. it's memory-mapped for lookups, which binary-search the keys and then
+# read only the matching records from the record file.
+#
+# index file layout (all integers little-endian int64, so that every array is
+# 8-byte aligned):
+#
+#   header:         magic, number of entries n, size of key blob, size of
+#                   the indexed record file, hash of the record file (see
+#                   checkpoint.prefix_hash)
+#   key_offsets:    n + 1 offsets into the key blob
+#   record_offsets: n byte offsets of records in the record file
+#   record_lengths: n byte lengths of records in the record file
+#   key blob:       the utf-8 keys, concatenated in sorted order
+#
+# for text record files a record's offset and length cover its line (without
+# the newline); for binary record files they cover its frame.
+#
+# name keys (creditor, surname) are stripped and upper-cased, both when
+# building and when looking up.
+#
+# an index is only opened along with the record file it was built from; if
+# that file has since been rewritten or appended to, its size or hash no
+# longer match, and the index has to be rebuilt.
+
+index_kinds = ("lex_id", "filing_number", "creditor", "surname")
+name_index_kinds = ("creditor", "surname")
+
+index_magic = b"SXNXIDX2"
+# indexes written before the header carried the record file's size and hash.
+old_index_magics = (b"SXNXIDX1",)
+index_header = struct.Struct("<8sqqq64s")
+
+# index entries held in memory at once while building; beyond that, sorted
+# runs are spilled to temporary files and merged at the end.
+default_run_size = 1000000
+
+run_entry_header = struct.Struct("<Iqq")  # key length, offset, length.
+
+
+def normalize_key(kind, key):
+    key = key.strip()
+    if kind in name_index_kinds:
+        key = key.upper()
+    return key
+
+
+def index_filename(records_filename, kind):
+    return records_filename + "." + kind + ".idx"
+
+
+def keys_from_record(record):
+    # returns {kind: set of keys} for a record dictionary (as loaded from
+    # json).
+    debtors = record.get("debtors", [])
+    components = record.get("filing_info", {}).get("components", [])
+    return {
+        "lex_id": {debtor["lex_id"] for debtor in debtors
+            if debtor.get("lex_id")},
+        "filing_number": {component["filing_number"]
+            for component in components if component.get("filing_number")},
+        "creditor": {record["creditor"]["name"]}
+            if record.get("creditor", {}).get("name") else set(),
+        "surname": {debtor["parsed_surname"] for debtor in debtors
+            if debtor.get("parsed_surname")},
+    }
+
+
+def keys_from_recordproto(record_proto):
+    return {
+        "lex_id": {debtor.lex_id for debtor in record_proto.debtors
+            if debtor.lex_id},
+        "filing_number": {component.filing_number
+            for component in record_proto.filing_info.components
+            if component.filing_number},
+        "creditor": {record_proto.creditor.name}
+            if record_proto.creditor.name else set(),
+        "surname": {debtor.parsed_surname for debtor in record_proto.debtors
+            if debtor.parsed_surname},
+    }
+
+
+def iter_record_locations(infile, input_mode):
+    # yields (offset, length, record) for each record in a record file opened
+    # in binary mode. the record is a dictionary for json and dictjson (as
+    # loaded by json.loads(), and decoded), or a Record proto for other modes.
+    # the string dictionary lines of dictjson files are skipped.
+    if record_io.is_binary_mode(input_mode):
+        for offset, serialized in record_io.iter_frames(infile, input_mode):
+            # the frame is the payload plus the prefix in front of it.
+            length = infile_frame_length(serialized, input_mode)
+            yield offset, length, record_pb2.Record.FromString(serialized)
+        return
+
+    string_dictionary = record_io.StringDictionary()
+    offset = 0
+    for line in infile:
+        stripped = line.rstrip(b"\r\n")
+        if stripped.strip():
+            if input_mode == "json":
+                record = json.loads(stripped)
+            elif input_mode == "dictjson":
+                record = string_dictionary.read_line(stripped)
+                if record is None:
+                    offset += len(line)
+                    continue
+            else:
+                record = record_io.parse_record(
+                        stripped.decode("utf-8"), input_mode)
+            yield offset, len(stripped), record
+        offset += len(line)
+
+
+def iter_record_keys(infile, input_mode):
+    # yields (offset, length, {kind: keys}) for each record in a record file
+    # opened in binary mode.
+    for offset, length, record in iter_record_locations(infile, input_mode):
+        if input_mode in record_io.json_modes:
+            yield offset, length, keys_from_record(record)
+        else:
+            yield offset, length, keys_from_recordproto(record)
+
+
+def infile_frame_length(serialized, mode):
+    prefix = len(record_io.encode_varint(len(serialized)))
+    if mode == "collection":
+        prefix += 1
+    return prefix + len(serialized)
+
+
+class _RunWriter:
+    # accumulates index entries for one kind, spilling sorted runs to
+    # temporary files once there are too many to hold in memory.
+
+    def __init__(self, run_size, temp_dir):
+        self.run_size = run_size
+        self.temp_dir = temp_dir
+        self.entries = []
+        self.run_files = []
+        self.num_entries = 0
+        self.key_blob_size = 0
+
+    def add(self, key, offset, length):
+        encoded = key.encode("utf-8")
+        self.entries.append((encoded, offset, length))
+        self.num_entries += 1
+        self.key_blob_size += len(encoded)
+        if len(self.entries) >= self.run_size:
+            self.spill()
+
+    def spill(self):
+        self.entries.sort()
+        run_file = tempfile.TemporaryFile(dir=self.temp_dir)
+        for encoded, offset, length in self.entries:
+            run_file.write(run_entry_header.pack(len(encoded), offset, length))
+            run_file.write(encoded)
+        run_file.seek(0)
+        self.run_files.append(run_file)
+        self.entries = []
+
+    def iter_sorted(self):
+        self.entries.sort()
+        runs = [iter_run(run_file) for run_file in self.run_files]
+        return heapq.merge(iter(self.entries), *runs)
+
+
+def iter_run(run_file):
+    while True:
+        header = run_file.read(run_entry_header.size)
+        if not header:
+            run_file.close()
+            return
+        key_length, offset, length = run_entry_header.unpack(header)
+        yield run_file.read(key_length), offset, length
+
+
+def write_index(filename, run_writer, records_size, records_hash):
+    # writes the sorted entries of a _RunWriter to an index file, filling in
+    # each section of the presized file in a single merge pass.
+    num_entries = run_writer.num_entries
+    arrays_start = index_header.size
+    record_offsets_start = arrays_start + 8 * (num_entries + 1)
+    record_lengths_start = record_offsets_start + 8 * num_entries
+    blob_start = record_lengths_start + 8 * num_entries
+    file_size = blob_start + run_writer.key_blob_size
+
+    with open(filename, 'w+b') as outfile:
+        outfile.truncate(file_size)
+        outfile.write(index_header.pack(
+                index_magic, num_entries, run_writer.key_blob_size,
+                records_size, records_hash.encode("ascii")))
+        outfile.flush()
+        out = mmap.mmap(outfile.fileno(), file_size)
+        key_offsets = memoryview(out)[
+                arrays_start:record_offsets_start].cast('q')
+        record_offsets = memoryview(out)[
+                record_offsets_start:record_lengths_start].cast('q')
+        record_lengths = memoryview(out)[
+                record_lengths_start:blob_start].cast('q')
+
+        blob_pos = 0
+        for ind, (encoded, offset, length) in enumerate(
+                run_writer.iter_sorted()):
+            key_offsets[ind] = blob_pos
+            record_offsets[ind] = offset
+            record_lengths[ind] = length
+            out[blob_start + blob_pos:blob_start + blob_pos + len(encoded)] = (
+                    encoded)
+            blob_pos += len(encoded)
+        key_offsets[num_entries] = blob_pos
+
+        key_offsets.release()
+        record_offsets.release()
+        record_lengths.release()
+        out.flush()
+        out.close()
+
+
+def build_indexes(records_filename, input_mode, kinds=index_kinds,
+        run_size=default_run_size):
+    run_writers = {kind: _RunWriter(run_size,
+            os.path.dirname(os.path.abspath(records_filename)))
+            for kind in kinds}
+
+    with open(records_filename, 'rb') as infile:
+        records_size = os.fstat(infile.fileno()).st_size
+        for offset, length, record_keys in iter_record_keys(
+                infile, input_mode):
+            for kind in kinds:
+                keys = {normalize_key(kind, key) for key in record_keys[kind]}
+                for key in keys:
+                    run_writers[kind].add(key, offset, length)
+    records_hash = checkpoint.prefix_hash(records_filename, records_size)
+
+    for kind in kinds:
+        write_index(index_filename(records_filename, kind), run_writers[kind],
+                records_size, records_hash)
+
+
+class RecordIndex:
+    # memory-mapped reader for a single index file, over the record file
+    # 'records_filename'.
+
+    def __init__(self, filename, records_filename):
+        self.infile = open(filename, 'rb')
+        self.buf = mmap.mmap(self.infile.fileno(), 0, access=mmap.ACCESS_READ)
+        magic = self.buf[:len(index_magic)]
+        if magic != index_magic:
+            self.buf.close()
+            self.infile.close()
+            if magic in old_index_magics:
+                raise ValueError("record index is out of date, rebuild it: "
+                        + filename)
+            raise ValueError("not a record index file: " + filename)
+        (_, self.num_entries, key_blob_size, records_size,
+                records_hash) = index_header.unpack_from(self.buf, 0)
+        if (os.path.getsize(records_filename) != records_size
+                or checkpoint.prefix_hash(records_filename, records_size)
+                    != records_hash.decode("ascii")):
+            self.buf.close()
+            self.infile.close()
+            raise ValueError("record index is out of date, rebuild it: "
+                    + filename)
+
+        arrays_start = index_header.size
+        record_offsets_start = arrays_start + 8 * (self.num_entries + 1)
+        record_lengths_start = record_offsets_start + 8 * self.num_entries
+        self.blob_start = record_lengths_start + 8 * self.num_entries
+        view = memoryview(self.buf)
+        self.key_offsets = view[arrays_start:record_offsets_start].cast('q')
+        self.record_offsets = view[
+                record_offsets_start:record_lengths_start].cast('q')
+        self.record_lengths = view[
+                record_lengths_start:self.blob_start].cast('q')
+
+    def key(self, ind):
+        start = self.blob_start + self.key_offsets[ind]
+        end = self.blob_start + self.key_offsets[ind + 1]
+        return self.buf[start:end]
+
+    def lower_bound(self, encoded):
+        low, high = 0, self.num_entries
+        while low < high:
+            mid = (low + high) // 2
+            if self.key(mid) < encoded:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def lookup(self, key):
+        # returns [(record offset, record length)] for every record with the
+        # key, in record file order.
+        encoded = key.encode("utf-8")
+        matches = []
+        ind = self.lower_bound(encoded)
+        while ind < self.num_entries and self.key(ind) == encoded:
+            matches.append(
+                    (self.record_offsets[ind], self.record_lengths[ind]))
+            ind += 1
+        return sorted(matches)
+
+    def close(self):
+        self.key_offsets.release()
+        self.record_offsets.release()
+        self.record_lengths.release()
+        self.buf.close()
+        self.infile.close()
+
+
+class RecordFile:
+    # memory-mapped record file, for reading individual records by offset.
+    # the string dictionary of a dictjson file is read in full when it's
+    # opened.
+
+    def __init__(self, filename, mode):
+        self.mode = mode
+        self.infile = open(filename, 'rb')
+        self.string_dictionary = None
+        if mode == "dictjson":
+            self.string_dictionary = record_io.StringDictionary()
+            self.string_dictionary.read_stream(self.infile)
+        self.buf = mmap.mmap(self.infile.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def raw_record(self, offset, length):
+        # the record's line (as bytes) for text modes, or its serialized
+        # bytes for binary modes.
+        if record_io.is_binary_mode(self.mode):
+            return record_io.read_frame(self.buf, offset, self.mode)
+        return self.buf[offset:offset + length]
+
+    def record_dict(self, offset, length):
+        # the record as a dictionary in json form, for json modes.
+        raw = self.raw_record(offset, length)
+        if self.string_dictionary is not None:
+            return self.string_dictionary.decode(json.loads(raw))
+        return json.loads(raw)
+
+    def record(self, offset, length):
+        if self.string_dictionary is not None:
+            return record_json.dict_to_record(self.record_dict(offset, length))
+        raw = self.raw_record(offset, length)
+        if record_io.is_binary_mode(self.mode):
+            return record_pb2.Record.FromString(raw)
+        return record_io.parse_record(raw.decode("utf-8"), self.mode)
+
+    def close(self):
+        self.buf.close()
+        self.infile.close()
+
+
+def lookup_records(records_filename, input_mode, kind, value):
+    # returns an iterator over each record (as a Record proto) with the given
+    # key. raises ValueError right away if the index is out of date.
+    record_index = RecordIndex(index_filename(records_filename, kind),
+            records_filename)
+    record_file = RecordFile(records_filename, input_mode)
+    return iter_lookup(record_index, record_file, kind, value)
+
+
+def iter_lookup(record_index, record_file, kind, value):
+    try:
+        for offset, length in record_index.lookup(normalize_key(kind, value)):
+            yield record_file.record(offset, length)
+    finally:
+        record_index.close()
+        record_file.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="record_index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build",
+            help="build indexes over a record file.")
+    build_parser.add_argument("records_filename", type=str,
+            help="filename of the record file to index.")
+    build_parser.add_argument("--kinds", type=str,
+            default=",".join(index_kinds),
+            help="comma-separated kinds of index to build. default: "
+            + ",".join(index_kinds))
+
+    lookup_parser = subparsers.add_parser("lookup",
+            help="print the records with a given key.")
+    lookup_parser.add_argument("records_filename", type=str,
+            help="filename of the indexed record file.")
+    lookup_parser.add_argument("kind", type=str, choices=index_kinds,
+            help="kind of key to look up.")
+    lookup_parser.add_argument("value", type=str,
+            help="key to look up.")
+    lookup_parser.add_argument("--output_mode", type=str,
+            choices=record_io.record_modes, default="json",
+            help="format to print records in. default: json")
+
+    for subparser in (build_parser, lookup_parser):
+        subparser.add_argument("--input_mode", type=str,
+                choices=record_io.record_modes, default="json",
+                help="format of the record file. default: json")
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        kinds = [kind for kind in args.kinds.split(",") if kind]
+        for kind in kinds:
+            if kind not in index_kinds:
+                parser.error("unknown index kind: " + kind)
+        build_indexes(args.records_filename, args.input_mode, kinds)
+    elif args.command == "lookup":
+        outstream = (sys.stdout.buffer
+                if record_io.is_binary_mode(args.output_mode) else sys.stdout)
+        try:
+            records = lookup_records(args.records_filename, args.input_mode,
+                    args.kind, args.value)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+        record_writer = record_io.RecordWriter(outstream, args.output_mode)
+        for record_proto in records:
+            record_writer.write(record_proto)
+        record_writer.close()
@@ -0,0 +1,489 @@
+# record_io.py
+
+import hashlib
+import json
+import os
+import struct
+import record_json
+import record_model
+import record_pb2
+import google.protobuf.text_format as text_format
+
+# reading and writing streams of Record protos, in every format the tools
+# speak:
+#
+# textproto:  one text proto per line.
+# json:       one json object per line.
+# dictjson:   json, with repeated strings dictionary-encoded. see below.
+# binary:     a stream of serialized Record messages, each preceded by its
+#             length as a varint. (the same framing as the java/c++
+#             writeDelimitedTo / parseDelimitedFrom helpers.)
+# collection: a small header, followed by a serialized RecordCollection
+#             message. see below.
+#
+# the binary formats are for passing records between pipeline stages: they're
+# far smaller and faster to encode and decode than the text formats.
+
+text_modes = ("textproto", "json", "dictjson")
+binary_modes = ("binary", "collection")
+record_modes = text_modes + binary_modes
+
+# text modes whose records are json objects, i.e. can be read with
+# json.loads() (after decoding, for dictjson).
+json_modes = ("json", "dictjson")
+
+# dictjson: a few string fields hold the same handful of values across a whole
+# file (creditor names, filing offices and categories, filing dates, the county
+# lines of addresses). dictjson writes each of those strings once, in a string
+# dictionary interleaved with the records, and records refer to them by id:
+#
+#   ["NEFAROUS GROUP LLC", "CIVIL JUDGMENT", "1/31/2099", ...]
+#   {"record_num": 1, ..., "creditor": {"name": 0}}
+#
+# a line holding a json array adds its strings to the dictionary, numbered on
+# from the strings before it; every other line is a record, as in json mode,
+# with the values of the dictionary fields (see map_dictionary_fields)
+# replaced by ids. a string is added just before the first record that refers
+# to it, so a dictjson stream can be written and read in one pass. readers
+# rebuild one python string per dictionary entry, shared by every record that
+# refers to it, and take any dictionary field that still holds a string as
+# is.
+#
+# dictionary ids depend on everything written before, so format_record formats
+# dictjson records as plain json, and RecordWriter encodes them as they're
+# written.
+
+# collection file header: magic, record count (little-endian uint64) and a
+# schema hash (the first 8 bytes of the sha256 of record.proto's serialized
+# descriptor), so that readers can detect files written against another
+# version of the schema.
+#
+# the RecordCollection payload is written incrementally: each record is
+# emitted as a field 1 ('records') entry, so the payload is a valid
+# RecordCollection message no matter how many records are appended.
+collection_magic = b"SXNXRCOL"
+collection_header = struct.Struct("<8sQ8s")
+collection_records_tag = b"\x0a"  # field 1, wire type 2 (length-delimited).
+
+# record count written to collection headers when the output can't be
+# rewound to fill in the actual count (e.g. stdout).
+unknown_record_count = 0xFFFFFFFFFFFFFFFF
+
+# size of each read from a binary record stream.
+default_read_size = 1024 * 1024
+
+schema_hash = hashlib.sha256(record_pb2.DESCRIPTOR.serialized_pb).digest()[:8]
+
+
+def is_binary_mode(mode):
+    return mode in binary_modes
+
+
+def encode_varint(value):
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def decode_varint(buf, pos):
+    # decodes the varint at buf[pos:]. returns (value, position after the
+    # varint), or (None, pos) if buf ends before the varint does.
+    result = 0
+    shift = 0
+    end = len(buf)
+    while pos < end:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+    return None, pos
+
+
+def frame_serialized(serialized, mode):
+    # frames an already-serialized Record for a binary stream.
+    if mode == "collection":
+        return (collection_records_tag + encode_varint(len(serialized))
+                + serialized)
+    return encode_varint(len(serialized)) + serialized
+
+
+def is_county_line(address_line):
+    # the other lines of an address (street, city and zip code) are mostly
+    # unique, and aren't worth a dictionary entry.
+    return address_line.endswith("COUNTY")
+
+
+def map_dictionary_fields(record, convert, lines=is_county_line):
+    # replaces the value of every dictionary field in a record dictionary (in
+    # json form) with convert(value), in place, and returns the record. only
+    # the address lines for which lines(line) is true are converted.
+    creditor = record.get("creditor")
+    if creditor is not None and "name" in creditor:
+        creditor["name"] = convert(creditor["name"])
+    for debtor in record.get("debtors", ()):
+        address = debtor.get("address")
+        if address is not None and "raw_lines" in address:
+            address["raw_lines"] = [convert(line) if lines(line) else line
+                    for line in address["raw_lines"]]
+    filing_info = record.get("filing_info")
+    if filing_info is not None:
+        if "raw_filing_date" in filing_info:
+            filing_info["raw_filing_date"] = convert(
+                    filing_info["raw_filing_date"])
+        for component in filing_info.get("components", ()):
+            for key in ("category", "raw_filing_date", "filing_office"):
+                if key in component:
+                    component[key] = convert(component[key])
+    return record
+
+
+class StringDictionary:
+    # the string dictionary of a dictjson stream, built up as the stream is
+    # written or read.
+
+    def __init__(self):
+        self.strings = []
+        self.ids = {}
+
+    def add_strings(self, strings):
+        for value in strings:
+            if not isinstance(value, str):
+                raise ValueError("invalid dictjson string dictionary entry: "
+                        + repr(value))
+            self.ids.setdefault(value, len(self.strings))
+            self.strings.append(value)
+
+    def encode(self, record):
+        # returns the dictjson lines (newline-terminated) for a record
+        # dictionary in json form: a dictionary line for the strings it adds,
+        # if any, and the record line. 'record' is modified in place.
+        ids = self.ids
+        added = []
+
+        def string_id(value):
+            ind = ids.get(value)
+            if ind is None:
+                ind = ids[value] = len(self.strings)
+                self.strings.append(value)
+                added.append(value)
+            return ind
+
+        line = json.dumps(map_dictionary_fields(record, string_id)) + "\n"
+        if added:
+            return json.dumps(added) + "\n" + line
+        return line
+
+    def encode_lines(self, formatted):
+        # encodes newline-terminated json lines, e.g. as formatted by worker
+        # processes.
+        return "".join([self.encode(json.loads(line))
+                for line in formatted.split("\n") if line])
+
+    def decode(self, record):
+        # replaces the ids in a dictjson record (as loaded by json.loads())
+        # with their strings, in place, and returns it.
+        strings = self.strings
+
+        def string_value(value):
+            if type(value) is int and 0 <= value < len(strings):
+                return strings[value]
+            if isinstance(value, str):
+                return value
+            raise ValueError("invalid dictjson string id: " + repr(value))
+
+        def is_id(line):
+            return not isinstance(line, str)
+
+        return map_dictionary_fields(record, string_value, is_id)
+
+    def read_line(self, line):
+        # reads a line of a dictjson stream: returns the record dictionary
+        # for a record line, or None for a dictionary line (whose strings are
+        # added to the dictionary).
+        obj = json.loads(line)
+        if isinstance(obj, list):
+            self.add_strings(obj)
+            return None
+        return self.decode(obj)
+
+    def read_stream(self, instream):
+        # adds the strings of every dictionary line in a dictjson stream
+        # (e.g. one that's about to be appended to, or read at random).
+        for line in instream:
+            if line.lstrip()[:1] in ("[", b"["):
+                self.add_strings(json.loads(line))
+
+
+def iter_dictjson(instream):
+    # yields each record in a dictjson stream, as a decoded record dictionary.
+    string_dictionary = StringDictionary()
+    for line in instream:
+        line = line.strip()
+        if not line:
+            continue
+        record = string_dictionary.read_line(line)
+        if record is not None:
+            yield record
+
+
+def format_record(record_proto, mode):
+    # serializes a single record. returns a line of text (without the
+    # newline) for text modes, or a framed byte string for binary modes.
+    # 'record_proto' may also be a record_model.Record, which is written
+    # without building a proto. dictjson records are formatted as plain json;
+    # see above.
+    if isinstance(record_proto, record_model.Record):
+        if mode == "textproto":
+            return record_proto.to_textproto()
+        elif mode in json_modes:
+            return record_proto.to_json()
+        elif mode in binary_modes:
+            return frame_serialized(record_proto.serialize(), mode)
+        raise ValueError("unrecognized record format: " + str(mode))
+    if mode == "textproto":
+        return text_format.MessageToString(record_proto, as_one_line=True)
+    elif mode in json_modes:
+        return record_json.record_to_json(record_proto)
+    elif mode in binary_modes:
+        return frame_serialized(record_proto.SerializeToString(), mode)
+    raise ValueError("unrecognized record format: " + str(mode))
+
+
+def parse_record(line, mode):
+    # parses a single line of a text mode stream. (dictjson records can only
+    # be parsed along with their string dictionary; see iter_records.)
+    if mode == "json":
+        return record_json.json_to_record(line)
+    record_proto = record_pb2.Record()
+    if mode == "textproto":
+        text_format.Parse(line, record_proto)
+    else:
+        raise ValueError("unrecognized text record format: " + str(mode))
+    return record_proto
+
+
+def read_collection_header(instream):
+    # returns the record count from a collection header, or None if the
+    # writer couldn't fill it in.
+    header = instream.read(collection_header.size)
+    if len(header) < collection_header.size:
+        raise ValueError("truncated collection header")
+    magic, record_count, file_schema_hash = collection_header.unpack(header)
+    if magic != collection_magic:
+        raise ValueError("not a record collection file")
+    if file_schema_hash != schema_hash:
+        raise ValueError(
+                "record collection was written with a different schema")
+    return None if record_count == unknown_record_count else record_count
+
+
+def iter_frames(instream, mode, chunk_size=default_read_size):
+    # yields (offset, serialized bytes) for each record in a binary stream,
+    # where offset is the position of the record's frame in the stream. the
+    # stream is read in large chunks, and frames are decoded from memory.
+    if mode == "collection":
+        read_collection_header(instream)
+    try:
+        buf_offset = instream.tell()  # stream offset of buf[0].
+    except (AttributeError, OSError):
+        buf_offset = collection_header.size if mode == "collection" else 0
+
+    buf = b""
+    pos = 0
+    at_eof = False
+    while True:
+        frame_start = pos
+        if mode == "collection" and pos < len(buf):
+            if buf[pos:pos + 1] != collection_records_tag:
+                raise ValueError("unexpected field in record collection")
+            pos += 1
+        length, payload_start = decode_varint(buf, pos)
+
+        if (length is None or payload_start + length > len(buf)
+                or pos == len(buf)):
+            # the frame continues past the end of the buffer; read more.
+            if at_eof:
+                if frame_start < len(buf):
+                    raise ValueError("truncated record in binary stream")
+                return  # end of stream.
+            more = instream.read(max(chunk_size, (length or 0) + 16))
+            at_eof = not more
+            buf = buf[frame_start:] + more
+            buf_offset += frame_start
+            pos = 0
+            continue
+
+        pos = payload_start + length
+        yield buf_offset + frame_start, buf[payload_start:pos]
+
+
+def iter_serialized(instream, mode, chunk_size=default_read_size):
+    # yields the serialized bytes of each record in a binary stream.
+    for _, serialized in iter_frames(instream, mode, chunk_size):
+        yield serialized
+
+
+def read_frame(buf, offset, mode):
+    # returns the serialized bytes of the record whose frame starts at
+    # buf[offset], e.g. in a memory-mapped binary record file.
+    if mode == "collection":
+        offset += 1
+    length, payload_start = decode_varint(buf, offset)
+    if length is None:
+        raise ValueError("truncated record in binary stream")
+    return buf[payload_start:payload_start + length]
+
+
+def iter_records(instream, mode, as_model=False):
+    # yields each record in a stream, in any record mode. text mode streams
+    # should be opened in text mode, binary mode streams in binary mode.
+    # blank lines in text mode streams are skipped.
+    #
+    # with 'as_model', json and dictjson lines are read straight into
+    # record_model.Record, without building a proto, for consumers that work
+    # from either (e.g. columnar_store.ColumnarStoreWriter). records in other
+    # modes are still yielded as protos.
+    if mode in binary_modes:
+        for serialized in iter_serialized(instream, mode):
+            yield record_pb2.Record.FromString(serialized)
+        return
+    if mode == "dictjson":
+        for record in iter_dictjson(instream):
+            if as_model:
+                yield record_model.Record.from_dict(record)
+            else:
+                yield record_json.dict_to_record(record)
+        return
+
+    for line in instream:
+        line = line.strip()
+        if not line:
+            continue
+        if as_model and mode == "json":
+            yield record_model.Record.from_dict(json.loads(line))
+        else:
+            yield parse_record(line, mode)
+
+
+def replace_records(filename, mode, replacements):
+    # rewrites a record file in place, with some of its records replaced.
+    # 'replacements' maps the position of a record in the file (counting from
+    # 0) to the record to put there, as formatted by format_record. returns
+    # the number of records replaced.
+    replaced = 0
+    if mode == "dictjson":
+        # replacements may need strings of their own, so the whole file is
+        # encoded again, against a new dictionary.
+        infile = open(filename, 'r')
+        outfile = open(filename + ".tmp", 'w')
+        string_dictionary = StringDictionary()
+        for ind, record in enumerate(iter_dictjson(infile)):
+            replacement = replacements.get(ind)
+            if replacement is not None:
+                record = json.loads(replacement)
+                replaced += 1
+            outfile.write(string_dictionary.encode(record))
+    elif mode in binary_modes:
+        infile = open(filename, 'rb')
+        outfile = open(filename + ".tmp", 'wb')
+        if mode == "collection":
+            outfile.write(infile.read(collection_header.size))
+            infile.seek(0)
+        for ind, (_, serialized) in enumerate(iter_frames(infile, mode)):
+            replacement = replacements.get(ind)
+            if replacement is None:
+                replacement = frame_serialized(serialized, mode)
+            else:
+                replaced += 1
+            outfile.write(replacement)
+    else:
+        infile = open(filename, 'r')
+        outfile = open(filename + ".tmp", 'w')
+        for ind, line in enumerate(infile):
+            replacement = replacements.get(ind)
+            if replacement is None:
+                outfile.write(line)
+            else:
+                outfile.write(replacement + "\n")
+                replaced += 1
+    outfile.close()
+    infile.close()
+    os.replace(filename + ".tmp", filename)
+    return replaced
+
+
+class RecordWriter:
+    # writes records to a stream in any record mode. text mode streams should
+    # be opened in text mode, binary mode streams in binary mode.
+
+    def __init__(self, outstream, mode, resume_count=None):
+        # when appending to a stream that already holds records (e.g. when
+        # resuming a run), 'resume_count' is the number of records in it. no
+        # header is written then; a collection's header is at offset 0. a
+        # dictjson stream's dictionary is read back in, so the stream has to
+        # be readable then.
+        if mode not in record_modes:
+            raise ValueError("unrecognized record format: " + str(mode))
+        self.outstream = outstream
+        self.mode = mode
+        self.record_count = resume_count or 0
+        self.header_offset = None
+        self.string_dictionary = None
+
+        if mode == "dictjson":
+            self.string_dictionary = StringDictionary()
+            if resume_count is not None:
+                outstream.seek(0)
+                self.string_dictionary.read_stream(outstream)
+                outstream.seek(0, os.SEEK_END)
+        elif mode == "collection" and resume_count is not None:
+            self.header_offset = 0
+        elif mode == "collection":
+            try:
+                self.header_offset = outstream.tell()
+            except (AttributeError, OSError):
+                self.header_offset = None
+            outstream.write(collection_header.pack(
+                    collection_magic, unknown_record_count, schema_hash))
+
+    def write(self, record_proto):
+        if self.string_dictionary is not None:
+            if isinstance(record_proto, record_model.Record):
+                record = record_proto.to_dict()
+            else:
+                record = record_json.record_to_dict(record_proto)
+            self.outstream.write(self.string_dictionary.encode(record))
+            self.record_count += 1
+            return
+        formatted = format_record(record_proto, self.mode)
+        if self.mode in text_modes:
+            formatted += "\n"
+        self.write_formatted(formatted, 1)
+
+    def write_formatted(self, formatted, record_count):
+        # writes 'record_count' records that were already serialized with
+        # format_record and joined (text mode records newline-terminated),
+        # e.g. by a worker process.
+        if self.string_dictionary is not None:
+            formatted = self.string_dictionary.encode_lines(formatted)
+        self.outstream.write(formatted)
+        self.record_count += record_count
+
+    def close(self):
+        # fills in the record count of a collection header, if the stream can
+        # be rewound. doesn't close the underlying stream.
+        if self.mode != "collection" or self.header_offset is None:
+            return
+        try:
+            end_offset = self.outstream.tell()
+            self.outstream.seek(self.header_offset)
+        except (AttributeError, OSError):
+            return
+        self.outstream.write(collection_header.pack(
+                collection_magic, self.record_count, schema_hash))
+        self.outstream.seek(end_offset)
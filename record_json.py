@@ -0,0 +1,242 @@
+# record_json.py
+
+import base64
+import json
+import record_pb2
+from google.protobuf import descriptor
+import google.protobuf.json_format as json_format
+
+# fast json conversion for the messages in record.proto. output is identical
+# to json_format.MessageToJson(message, indent=None,
+# preserving_proto_field_name=True), and parsing accepts what json_format.Parse
+# does, but without json_format's per-field reflection: at import, a pair of
+# plain python functions is generated for every message type, from
+# record_pb2's descriptors,
+#
+#   <Message>_to_dict(message)       -> dictionary, as json_format would build
+#   <Message>_from_dict(obj, message)   fills in 'message' from a dictionary
+#
+# e.g. for Creditor:
+#
+#   def Creditor_to_dict(message):
+#       obj = {}
+#       if message.HasField("name"):
+#           obj["name"] = message.name
+#       return obj
+#
+# fields are emitted in field number order, as json_format does. field types
+# the generated code doesn't specialize (floats, and messages from other
+# files, such as the well-known types) are converted by json_format, field by
+# field. anything unexpected while parsing (a field name not in the schema, a
+# value of the wrong type) makes the whole message fall back to
+# json_format.ParseDict, so errors are reported exactly as before.
+
+FieldDescriptor = descriptor.FieldDescriptor
+
+# used for the fields the generated code leaves to json_format.
+printer = json_format._Printer(preserving_proto_field_name=True)
+
+int_cpp_types = (FieldDescriptor.CPPTYPE_INT32, FieldDescriptor.CPPTYPE_UINT32)
+int64_cpp_types = (FieldDescriptor.CPPTYPE_INT64,
+        FieldDescriptor.CPPTYPE_UINT64)
+
+
+class FallBack(Exception):
+    # raised by generated parsers for input they don't handle.
+    pass
+
+
+def function_name(message_descriptor, suffix):
+    return message_descriptor.full_name.replace(".", "_") + suffix
+
+
+def is_generated(message_descriptor):
+    # messages defined in record.proto get generated functions.
+    return message_descriptor.file is record_pb2.DESCRIPTOR
+
+
+def value_to_json(field, value_expr):
+    # returns a python expression converting the value of a single
+    # (non-repeated) field to its json form.
+    cpp_type = field.cpp_type
+    if cpp_type == FieldDescriptor.CPPTYPE_MESSAGE:
+        if is_generated(field.message_type):
+            return function_name(field.message_type, "_to_dict") + "(" + (
+                    value_expr + ")")
+    elif cpp_type == FieldDescriptor.CPPTYPE_STRING:
+        if field.type == FieldDescriptor.TYPE_BYTES:
+            return "base64.b64encode(" + value_expr + ").decode('utf-8')"
+        return value_expr
+    elif cpp_type in int_cpp_types or cpp_type == FieldDescriptor.CPPTYPE_BOOL:
+        return value_expr
+    elif cpp_type in int64_cpp_types:
+        return "str(" + value_expr + ")"
+    elif cpp_type == FieldDescriptor.CPPTYPE_ENUM:
+        return ("enum_names[" + repr(field.enum_type.full_name) + "].get("
+                + value_expr + ", " + value_expr + ")")
+    return ("printer._FieldToJsonObject(fields[" + repr(field.full_name)
+            + "], " + value_expr + ")")
+
+
+def generate_to_dict(message_descriptor):
+    lines = ["def " + function_name(message_descriptor, "_to_dict")
+            + "(message):", "    obj = {}"]
+    for field in sorted(message_descriptor.fields,
+            key=lambda field: field.number):
+        attribute = "message." + field.name
+        key = repr(field.name)
+        if field.label == FieldDescriptor.LABEL_REPEATED:
+            lines.append("    value = " + attribute)
+            lines.append("    if value:")
+            converted = value_to_json(field, "item")
+            if converted == "item":
+                # slicing a repeated field gives a list of its values.
+                lines.append("        obj[" + key + "] = value[:]")
+            else:
+                lines.append("        obj[" + key + "] = [" + converted
+                        + " for item in value]")
+        else:
+            lines.append("    if message.HasField(" + key + "):")
+            lines.append("        obj[" + key + "] = "
+                    + value_to_json(field, attribute))
+    lines.append("    return obj")
+    return "\n".join(lines)
+
+
+def value_from_json(field, value_expr):
+    # returns a python expression converting a json value to what's stored
+    # in a (non-message) field. the field's setter checks its type.
+    if field.cpp_type == FieldDescriptor.CPPTYPE_STRING and (
+            field.type == FieldDescriptor.TYPE_BYTES):
+        return "base64.b64decode(" + value_expr + ")"
+    if field.cpp_type == FieldDescriptor.CPPTYPE_ENUM:
+        return ("(enum_values[" + repr(field.enum_type.full_name) + "]["
+                + value_expr + "] if isinstance(" + value_expr + ", str) else "
+                + value_expr + ")")
+    return value_expr
+
+
+def generate_from_dict(message_descriptor):
+    lines = ["def " + function_name(message_descriptor, "_from_dict")
+            + "(obj, message):",
+            "    for key, value in obj.items():",
+            "        if value is None:",
+            "            continue"]
+    keyword = "if"
+    for field in message_descriptor.fields:
+        names = sorted(set([field.name, field.json_name]))
+        lines.append("        " + keyword + " key in " + repr(tuple(names))
+                + ":")
+        keyword = "elif"
+        attribute = "message." + field.name
+        is_message = field.cpp_type == FieldDescriptor.CPPTYPE_MESSAGE
+        if is_message and not is_generated(field.message_type):
+            lines.append("            raise FallBack()")
+        elif field.label == FieldDescriptor.LABEL_REPEATED and is_message:
+            lines.append("            for item in value:")
+            lines.append("                "
+                    + function_name(field.message_type, "_from_dict")
+                    + "(item, " + attribute + ".add())")
+        elif field.label == FieldDescriptor.LABEL_REPEATED:
+            converted = value_from_json(field, "item")
+            if converted == "item":
+                lines.append("            " + attribute + ".extend(value)")
+            else:
+                lines.append("            " + attribute + ".extend(["
+                        + converted + " for item in value])")
+        elif is_message:
+            lines.append("            " + attribute + ".SetInParent()")
+            lines.append("            "
+                    + function_name(field.message_type, "_from_dict")
+                    + "(value, " + attribute + ")")
+        else:
+            lines.append("            " + attribute + " = "
+                    + value_from_json(field, "value"))
+    if keyword == "if":
+        lines.append("        raise FallBack()")
+    else:
+        lines.append("        else:")
+        lines.append("            raise FallBack()")
+    return "\n".join(lines)
+
+
+def iter_message_descriptors(message_descriptors):
+    for message_descriptor in message_descriptors:
+        yield message_descriptor
+        for nested in iter_message_descriptors(
+                message_descriptor.nested_types):
+            yield nested
+
+
+def generate_source(file_descriptor):
+    return "\n\n".join(
+            [generate(message_descriptor)
+                for message_descriptor in iter_message_descriptors(
+                    file_descriptor.message_types_by_name.values())
+                for generate in (generate_to_dict, generate_from_dict)])
+
+
+def compile_functions(file_descriptor):
+    namespace = {
+        "base64": base64,
+        "printer": printer,
+        "FallBack": FallBack,
+        "fields": {},
+        "enum_names": {},
+        "enum_values": {},
+    }
+    for message_descriptor in iter_message_descriptors(
+            file_descriptor.message_types_by_name.values()):
+        for field in message_descriptor.fields:
+            namespace["fields"][field.full_name] = field
+            if field.enum_type is not None:
+                enum_type = field.enum_type
+                namespace["enum_names"][enum_type.full_name] = {
+                    value.number: value.name for value in enum_type.values}
+                namespace["enum_values"][enum_type.full_name] = {
+                    value.name: value.number for value in enum_type.values}
+    exec(compile(generated_source, "<record_json>", "exec"), namespace)
+    return namespace
+
+
+generated_source = generate_source(record_pb2.DESCRIPTOR)
+generated = compile_functions(record_pb2.DESCRIPTOR)
+
+
+def message_to_dict(message):
+    # the same dictionary as json_format.MessageToDict(message,
+    # preserving_proto_field_name=True), for any message in record.proto.
+    return generated[function_name(message.DESCRIPTOR, "_to_dict")](message)
+
+
+def dict_to_message(obj, message):
+    # fills in 'message' from a dictionary, as json_format.ParseDict would,
+    # and returns it.
+    try:
+        generated[function_name(message.DESCRIPTOR, "_from_dict")](
+                obj, message)
+    except (FallBack, AttributeError, KeyError, TypeError, ValueError):
+        message.Clear()
+        json_format.ParseDict(obj, message)
+    return message
+
+
+record_to_dict = generated["Record_to_dict"]
+
+
+def record_to_json(record_proto):
+    # a single line of json, identical to json_format.MessageToJson(
+    # record_proto, indent=None, preserving_proto_field_name=True).
+    return json.dumps(record_to_dict(record_proto))
+
+
+def dict_to_record(obj):
+    return dict_to_message(obj, record_pb2.Record())
+
+
+def json_to_record(line):
+    try:
+        obj = json.loads(line)
+    except ValueError as e:
+        raise json_format.ParseError("Failed to load JSON: " + str(e) + ".")
+    return dict_to_record(obj)
@@ -0,0 +1,509 @@
+# record_model.py
+
+import json
+import record_io
+import record_json
+import record_pb2
+from google.protobuf import text_encoding
+
+# compact in-memory mirror of record.proto, filled in by the parser
+# (flattened_to_record.py) in place of Record protos. building protos field
+# by field is slow with the pure-python protobuf runtime, so records stay in
+# these plain __slots__ classes, and are written from them directly:
+#
+#   to_dict()     the same dictionary as record_json.record_to_dict(), so
+#                 json output is identical to the proto's.
+#   serialize()   the same bytes as the proto's SerializeToString().
+#   to_textproto()  the same line as text_format.MessageToString(proto,
+#                 as_one_line=True).
+#   to_proto()    a record_pb2 message, only for callers that need one (e.g.
+#                 an --exec block reading record_proto).
+#
+# optional fields that aren't set are None, repeated fields are lists, and
+# message fields always hold an instance; a message field is written only
+# if something in it is set. (unlike in a proto, an empty message can't be
+# marked present. the parser never leaves one.)
+#
+# the classes mirror record.proto by hand; they're checked against
+# record_pb2's descriptors at import, so a field added to the schema and not
+# here is caught straight away.
+
+int32_min = -(1 << 31)
+int32_max = (1 << 31) - 1
+
+
+def int32(value):
+    # checks that 'value' fits in an int32 field, as a proto field's setter
+    # would, with the same error.
+    if not int32_min <= value <= int32_max:
+        raise ValueError("Value out of range: " + str(value))
+    return value
+
+
+def append_varint_field(out, tag, value):
+    # negative int32 values are encoded as 64-bit two's complement.
+    out += tag
+    out += record_io.encode_varint(value & 0xFFFFFFFFFFFFFFFF)
+
+
+def append_string_field(out, tag, value):
+    data = value.encode("utf-8")
+    out += tag
+    out += record_io.encode_varint(len(data))
+    out += data
+
+
+def append_message_field(out, tag, message):
+    data = message.serialize()
+    out += tag
+    out += record_io.encode_varint(len(data))
+    out += data
+
+
+def append_string_text(parts, name, value):
+    # strings are escaped as text_format escapes them, i.e. as utf-8 bytes.
+    parts.append(name + ': "' + text_encoding.CEscape(value.encode("utf-8"),
+            False) + '" ')
+
+
+def append_message_text(parts, name, message):
+    parts.append(name + " { ")
+    message.append_text(parts)
+    parts.append("} ")
+
+
+def check_field_names(cls, obj):
+    # raises KeyError for a dictionary with fields the class doesn't have.
+    if not obj.keys() <= cls.field_names:
+        raise KeyError(", ".join(sorted(obj.keys() - cls.field_names)))
+
+
+def check_scalars(strings, int32s):
+    # raises TypeError unless each of 'strings' is a string or None and each
+    # of 'int32s' an int that fits an int32 field or None. (json_format also
+    # takes a bool, float or numeric string for an int32; from_dict leaves
+    # those to record_json.)
+    for value in strings:
+        if type(value) is not str and value is not None:
+            raise TypeError("unexpected value " + repr(value))
+    for value in int32s:
+        if value is not None and (type(value) is not int
+                or not int32_min <= value <= int32_max):
+            raise TypeError("unexpected value " + repr(value))
+
+
+def string_values(obj, name):
+    # a list copy of the repeated string obj[name]. raises TypeError unless
+    # every value is a string.
+    values = list(obj.get(name, ()))
+    for value in values:
+        if type(value) is not str:
+            raise TypeError(name + ": unexpected value " + repr(value))
+    return values
+
+
+class Address:
+    __slots__ = ("raw_lines",)
+    field_names = frozenset(__slots__)
+
+    def __init__(self):
+        self.raw_lines = []
+
+    def is_empty(self):
+        return not self.raw_lines
+
+    def to_dict(self):
+        obj = {}
+        if self.raw_lines:
+            obj["raw_lines"] = list(self.raw_lines)
+        return obj
+
+    def serialize(self):
+        out = bytearray()
+        for raw_line in self.raw_lines:
+            append_string_field(out, b"\x0a", raw_line)
+        return bytes(out)
+
+    def append_text(self, parts):
+        for raw_line in self.raw_lines:
+            append_string_text(parts, "raw_lines", raw_line)
+
+    @classmethod
+    def from_dict(cls, obj):
+        check_field_names(cls, obj)
+        address = cls()
+        address.raw_lines = string_values(obj, "raw_lines")
+        return address
+
+
+class Debtor:
+    __slots__ = ("name", "lex_id", "address", "parsed_surname",
+            "parsed_forenames", "cluster_id")
+    field_names = frozenset(__slots__)
+
+    def __init__(self):
+        self.name = None
+        self.lex_id = None
+        self.address = Address()
+        self.parsed_surname = None
+        self.parsed_forenames = None
+        self.cluster_id = None
+
+    def to_dict(self):
+        obj = {}
+        if self.name is not None:
+            obj["name"] = self.name
+        if self.lex_id is not None:
+            obj["lex_id"] = self.lex_id
+        if not self.address.is_empty():
+            obj["address"] = self.address.to_dict()
+        if self.parsed_surname is not None:
+            obj["parsed_surname"] = self.parsed_surname
+        if self.parsed_forenames is not None:
+            obj["parsed_forenames"] = self.parsed_forenames
+        if self.cluster_id is not None:
+            obj["cluster_id"] = self.cluster_id
+        return obj
+
+    def serialize(self):
+        out = bytearray()
+        if self.name is not None:
+            append_string_field(out, b"\x0a", self.name)
+        if self.lex_id is not None:
+            append_string_field(out, b"\x12", self.lex_id)
+        if not self.address.is_empty():
+            append_message_field(out, b"\x1a", self.address)
+        if self.parsed_surname is not None:
+            append_string_field(out, b"\x22", self.parsed_surname)
+        if self.parsed_forenames is not None:
+            append_string_field(out, b"\x2a", self.parsed_forenames)
+        if self.cluster_id is not None:
+            append_varint_field(out, b"\x30", self.cluster_id)
+        return bytes(out)
+
+    def append_text(self, parts):
+        if self.name is not None:
+            append_string_text(parts, "name", self.name)
+        if self.lex_id is not None:
+            append_string_text(parts, "lex_id", self.lex_id)
+        if not self.address.is_empty():
+            append_message_text(parts, "address", self.address)
+        if self.parsed_surname is not None:
+            append_string_text(parts, "parsed_surname", self.parsed_surname)
+        if self.parsed_forenames is not None:
+            append_string_text(parts, "parsed_forenames",
+                    self.parsed_forenames)
+        if self.cluster_id is not None:
+            parts.append("cluster_id: " + str(self.cluster_id) + " ")
+
+    @classmethod
+    def from_dict(cls, obj):
+        check_field_names(cls, obj)
+        debtor = cls()
+        debtor.name = obj.get("name")
+        debtor.lex_id = obj.get("lex_id")
+        if "address" in obj:
+            debtor.address = Address.from_dict(obj["address"])
+        debtor.parsed_surname = obj.get("parsed_surname")
+        debtor.parsed_forenames = obj.get("parsed_forenames")
+        debtor.cluster_id = obj.get("cluster_id")
+        check_scalars((debtor.name, debtor.lex_id, debtor.parsed_surname,
+                debtor.parsed_forenames), (debtor.cluster_id,))
+        return debtor
+
+
+class Creditor:
+    __slots__ = ("name",)
+    field_names = frozenset(__slots__)
+
+    def __init__(self):
+        self.name = None
+
+    def is_empty(self):
+        return self.name is None
+
+    def to_dict(self):
+        obj = {}
+        if self.name is not None:
+            obj["name"] = self.name
+        return obj
+
+    def serialize(self):
+        out = bytearray()
+        if self.name is not None:
+            append_string_field(out, b"\x0a", self.name)
+        return bytes(out)
+
+    def append_text(self, parts):
+        if self.name is not None:
+            append_string_text(parts, "name", self.name)
+
+    @classmethod
+    def from_dict(cls, obj):
+        check_field_names(cls, obj)
+        creditor = cls()
+        creditor.name = obj.get("name")
+        check_scalars((creditor.name,), ())
+        return creditor
+
+
+class FilingComponent:
+    __slots__ = ("category", "filing_number", "raw_filing_date",
+            "filing_office", "filing_date")
+    field_names = frozenset(__slots__)
+
+    def __init__(self):
+        self.category = None
+        self.filing_number = None
+        self.raw_filing_date = None
+        self.filing_office = None
+        self.filing_date = None
+
+    def to_dict(self):
+        obj = {}
+        if self.category is not None:
+            obj["category"] = self.category
+        if self.filing_number is not None:
+            obj["filing_number"] = self.filing_number
+        if self.raw_filing_date is not None:
+            obj["raw_filing_date"] = self.raw_filing_date
+        if self.filing_office is not None:
+            obj["filing_office"] = self.filing_office
+        if self.filing_date is not None:
+            obj["filing_date"] = self.filing_date
+        return obj
+
+    def serialize(self):
+        out = bytearray()
+        if self.category is not None:
+            append_string_field(out, b"\x0a", self.category)
+        if self.filing_number is not None:
+            append_string_field(out, b"\x12", self.filing_number)
+        if self.raw_filing_date is not None:
+            append_string_field(out, b"\x1a", self.raw_filing_date)
+        if self.filing_office is not None:
+            append_string_field(out, b"\x22", self.filing_office)
+        if self.filing_date is not None:
+            append_varint_field(out, b"\x28", self.filing_date)
+        return bytes(out)
+
+    def append_text(self, parts):
+        if self.category is not None:
+            append_string_text(parts, "category", self.category)
+        if self.filing_number is not None:
+            append_string_text(parts, "filing_number", self.filing_number)
+        if self.raw_filing_date is not None:
+            append_string_text(parts, "raw_filing_date", self.raw_filing_date)
+        if self.filing_office is not None:
+            append_string_text(parts, "filing_office", self.filing_office)
+        if self.filing_date is not None:
+            parts.append("filing_date: " + str(self.filing_date) + " ")
+
+    @classmethod
+    def from_dict(cls, obj):
+        check_field_names(cls, obj)
+        component = cls()
+        component.category = obj.get("category")
+        component.filing_number = obj.get("filing_number")
+        component.raw_filing_date = obj.get("raw_filing_date")
+        component.filing_office = obj.get("filing_office")
+        component.filing_date = obj.get("filing_date")
+        check_scalars((component.category, component.filing_number,
+                component.raw_filing_date, component.filing_office),
+                (component.filing_date,))
+        return component
+
+
+class FilingInfo:
+    __slots__ = ("raw_filing_date", "filing_date", "amount", "amount_usd",
+            "certificate_number", "components")
+    field_names = frozenset(__slots__)
+
+    def __init__(self):
+        self.raw_filing_date = None
+        self.filing_date = None
+        self.amount = None
+        self.amount_usd = None
+        self.certificate_number = None
+        self.components = []
+
+    def is_empty(self):
+        return (self.raw_filing_date is None and self.filing_date is None
+                and self.amount is None and self.amount_usd is None
+                and self.certificate_number is None and not self.components)
+
+    # fields are written in field number order, as protobuf does.
+    def to_dict(self):
+        obj = {}
+        if self.raw_filing_date is not None:
+            obj["raw_filing_date"] = self.raw_filing_date
+        if self.amount is not None:
+            obj["amount"] = self.amount
+        if self.certificate_number is not None:
+            obj["certificate_number"] = self.certificate_number
+        if self.components:
+            obj["components"] = [component.to_dict()
+                    for component in self.components]
+        if self.amount_usd is not None:
+            obj["amount_usd"] = self.amount_usd
+        if self.filing_date is not None:
+            obj["filing_date"] = self.filing_date
+        return obj
+
+    def serialize(self):
+        out = bytearray()
+        if self.raw_filing_date is not None:
+            append_string_field(out, b"\x0a", self.raw_filing_date)
+        if self.amount is not None:
+            append_string_field(out, b"\x12", self.amount)
+        if self.certificate_number is not None:
+            append_string_field(out, b"\x1a", self.certificate_number)
+        for component in self.components:
+            append_message_field(out, b"\x22", component)
+        if self.amount_usd is not None:
+            append_varint_field(out, b"\x28", self.amount_usd)
+        if self.filing_date is not None:
+            append_varint_field(out, b"\x30", self.filing_date)
+        return bytes(out)
+
+    def append_text(self, parts):
+        if self.raw_filing_date is not None:
+            append_string_text(parts, "raw_filing_date", self.raw_filing_date)
+        if self.amount is not None:
+            append_string_text(parts, "amount", self.amount)
+        if self.certificate_number is not None:
+            append_string_text(parts, "certificate_number",
+                    self.certificate_number)
+        for component in self.components:
+            append_message_text(parts, "components", component)
+        if self.amount_usd is not None:
+            parts.append("amount_usd: " + str(self.amount_usd) + " ")
+        if self.filing_date is not None:
+            parts.append("filing_date: " + str(self.filing_date) + " ")
+
+    @classmethod
+    def from_dict(cls, obj):
+        check_field_names(cls, obj)
+        filing_info = cls()
+        filing_info.raw_filing_date = obj.get("raw_filing_date")
+        filing_info.filing_date = obj.get("filing_date")
+        filing_info.amount = obj.get("amount")
+        filing_info.amount_usd = obj.get("amount_usd")
+        filing_info.certificate_number = obj.get("certificate_number")
+        filing_info.components = [FilingComponent.from_dict(component)
+                for component in obj.get("components", ())]
+        check_scalars((filing_info.raw_filing_date, filing_info.amount,
+                filing_info.certificate_number),
+                (filing_info.filing_date, filing_info.amount_usd))
+        return filing_info
+
+
+class Record:
+    __slots__ = ("record_num", "sequence_no", "debtors", "filing_info",
+            "creditor")
+    field_names = frozenset(__slots__)
+
+    def __init__(self):
+        self.record_num = None
+        self.sequence_no = None
+        self.debtors = []
+        self.filing_info = FilingInfo()
+        self.creditor = Creditor()
+
+    def to_dict(self):
+        obj = {}
+        if self.record_num is not None:
+            obj["record_num"] = self.record_num
+        if self.debtors:
+            obj["debtors"] = [debtor.to_dict() for debtor in self.debtors]
+        if not self.filing_info.is_empty():
+            obj["filing_info"] = self.filing_info.to_dict()
+        if not self.creditor.is_empty():
+            obj["creditor"] = self.creditor.to_dict()
+        if self.sequence_no is not None:
+            obj["sequence_no"] = self.sequence_no
+        return obj
+
+    def to_json(self):
+        # identical to record_json.record_to_json(self.to_proto()).
+        return json.dumps(self.to_dict())
+
+    def serialize(self):
+        out = bytearray()
+        if self.record_num is not None:
+            append_varint_field(out, b"\x08", self.record_num)
+        for debtor in self.debtors:
+            append_message_field(out, b"\x12", debtor)
+        if not self.filing_info.is_empty():
+            append_message_field(out, b"\x1a", self.filing_info)
+        if not self.creditor.is_empty():
+            append_message_field(out, b"\x22", self.creditor)
+        if self.sequence_no is not None:
+            append_varint_field(out, b"\x28", self.sequence_no)
+        return bytes(out)
+
+    def append_text(self, parts):
+        if self.record_num is not None:
+            parts.append("record_num: " + str(self.record_num) + " ")
+        for debtor in self.debtors:
+            append_message_text(parts, "debtors", debtor)
+        if not self.filing_info.is_empty():
+            append_message_text(parts, "filing_info", self.filing_info)
+        if not self.creditor.is_empty():
+            append_message_text(parts, "creditor", self.creditor)
+        if self.sequence_no is not None:
+            parts.append("sequence_no: " + str(self.sequence_no) + " ")
+
+    def to_textproto(self):
+        parts = []
+        self.append_text(parts)
+        return "".join(parts).rstrip()
+
+    def to_proto(self):
+        # (through record_json's generated setters, which are faster than
+        # parsing serialize() with the pure-python runtime.)
+        return record_json.dict_to_record(self.to_dict())
+
+    @classmethod
+    def from_dict(cls, obj):
+        # builds a record from a dictionary with proto field names, e.g.
+        # json.loads() of a json line written by these tools. anything else
+        # (e.g. json field names, numbers written as strings, values out of
+        # range, or a message that isn't an object) goes through record_json,
+        # which accepts or rejects it just as json_format does.
+        try:
+            return cls.from_dict_fields(obj)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return cls.from_proto(record_json.dict_to_record(obj))
+
+    @classmethod
+    def from_dict_fields(cls, obj):
+        check_field_names(cls, obj)
+        record = cls()
+        record.record_num = obj.get("record_num")
+        record.sequence_no = obj.get("sequence_no")
+        check_scalars((), (record.record_num, record.sequence_no))
+        record.debtors = [Debtor.from_dict(debtor)
+                for debtor in obj.get("debtors", ())]
+        if "filing_info" in obj:
+            record.filing_info = FilingInfo.from_dict(obj["filing_info"])
+        if "creditor" in obj:
+            record.creditor = Creditor.from_dict(obj["creditor"])
+        return record
+
+    @classmethod
+    def from_proto(cls, record_proto):
+        return cls.from_dict(record_json.record_to_dict(record_proto))
+
+
+def check_against_schema():
+    for cls in (Address, Debtor, Creditor, FilingComponent, FilingInfo,
+            Record):
+        fields = record_pb2.DESCRIPTOR.message_types_by_name[
+                cls.__name__].fields
+        if set(cls.__slots__) != set([field.name for field in fields]):
+            raise RuntimeError("record_model." + cls.__name__
+                    + " doesn't match record.proto")
+
+
+check_against_schema()
@@ -2,10 +2,9 @@
 # Generated by the protocol buffer compiler.  DO NOT EDIT!
 # source: record.proto
 """Generated protocol buffer code."""
-from google.protobuf.internal import enum_type_wrapper
+from google.protobuf.internal import builder as _builder
 from google.protobuf import descriptor as _descriptor
-from google.protobuf import message as _message
-from google.protobuf import reflection as _reflection
+from google.protobuf import descriptor_pool as _descriptor_pool
 from google.protobuf import symbol_database as _symbol_database
 # @@protoc_insertion_point(imports)
 
@@ -14,462 +13,27 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor.FileDescriptor(
-  name='record.proto',
-  package='',
-  syntax='proto2',
-  serialized_options=None,
-  create_key=_descriptor._internal_create_key,
-  serialized_pb=b'\n\x0crecord.proto\"\x1c\n\x07\x41\x64\x64ress\x12\x11\n\traw_lines\x18\x01 \x03(\t\"s\n\x06\x44\x65\x62tor\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\x0e\n\x06lex_id\x18\x02 \x01(\t\x12\x19\n\x07\x61\x64\x64ress\x18\x03 \x01(\x0b\x32\x08.Address\x12\x16\n\x0eparsed_surname\x18\x04 \x01(\t\x12\x18\n\x10parsed_forenames\x18\x05 \x01(\t\"\x18\n\x08\x43reditor\x12\x0c\n\x04name\x18\x01 \x01(\t\"j\n\x0f\x46ilingComponent\x12\x10\n\x08\x63\x61tegory\x18\x01 \x01(\t\x12\x15\n\rfiling_number\x18\x02 \x01(\t\x12\x17\n\x0fraw_filing_date\x18\x03 \x01(\t\x12\x15\n\rfiling_office\x18\x04 \x01(\t\"\x8b\x01\n\nFilingInfo\x12\x17\n\x0fraw_filing_date\x18\x01 \x01(\t\x12\x0e\n\x06\x61mount\x18\x02 \x01(\t\x12\x12\n\namount_usd\x18\x05 \x01(\x05\x12\x1a\n\x12\x63\x65rtificate_number\x18\x03 \x01(\t\x12$\n\ncomponents\x18\x04 \x03(\x0b\x32\x10.FilingComponent\"\x8a\x01\n\x06Record\x12\x12\n\nrecord_num\x18\x01 \x01(\x05\x12\x13\n\x0bsequence_no\x18\x05 \x01(\x05\x12\x18\n\x07\x64\x65\x62tors\x18\x02 \x03(\x0b\x32\x07.Debtor\x12 \n\x0b\x66iling_info\x18\x03 \x01(\x0b\x32\x0b.FilingInfo\x12\x1b\n\x08\x63reditor\x18\x04 \x01(\x0b\x32\t.Creditor\",\n\x10RecordCollection\x12\x18\n\x07records\x18\x01 \x03(\x0b\x32\x07.Record*o\n\nColumnType\x12\x1b\n\x17\x43OLUMN_TYPE_UNSPECIFIED\x10\x00\x12\x11\n\rRECORD_NUMBER\x10\x01\x12\n\n\x06\x44\x45\x42TOR\x10\x02\x12\x0b\n\x07\x41\x44\x44RESS\x10\x03\x12\n\n\x06\x46ILING\x10\x04\x12\x0c\n\x08\x43REDITOR\x10\x05'
-)
-
-_COLUMNTYPE = _descriptor.EnumDescriptor(
-  name='ColumnType',
-  full_name='ColumnType',
-  filename=None,
-  file=DESCRIPTOR,
-  create_key=_descriptor._internal_create_key,
-  values=[
-    _descriptor.EnumValueDescriptor(
-      name='COLUMN_TYPE_UNSPECIFIED', index=0, number=0,
-      serialized_options=None,
-      type=None,
-      create_key=_descriptor._internal_create_key),
-    _descriptor.EnumValueDescriptor(
-      name='RECORD_NUMBER', index=1, number=1,
-      serialized_options=None,
-      type=None,
-      create_key=_descriptor._internal_create_key),
-    _descriptor.EnumValueDescriptor(
-      name='DEBTOR', index=2, number=2,
-      serialized_options=None,
-      type=None,
-      create_key=_descriptor._internal_create_key),
-    _descriptor.EnumValueDescriptor(
-      name='ADDRESS', index=3, number=3,
-      serialized_options=None,
-      type=None,
-      create_key=_descriptor._internal_create_key),
-    _descriptor.EnumValueDescriptor(
-      name='FILING', index=4, number=4,
-      serialized_options=None,
-      type=None,
-      create_key=_descriptor._internal_create_key),
-    _descriptor.EnumValueDescriptor(
-      name='CREDITOR', index=5, number=5,
-      serialized_options=None,
-      type=None,
-      create_key=_descriptor._internal_create_key),
-  ],
-  containing_type=None,
-  serialized_options=None,
-  serialized_start=626,
-  serialized_end=737,
-)
-_sym_db.RegisterEnumDescriptor(_COLUMNTYPE)
-
-ColumnType = enum_type_wrapper.EnumTypeWrapper(_COLUMNTYPE)
-COLUMN_TYPE_UNSPECIFIED = 0
-RECORD_NUMBER = 1
-DEBTOR = 2
-ADDRESS = 3
-FILING = 4
-CREDITOR = 5
-
-
-
-_ADDRESS = _descriptor.Descriptor(
-  name='Address',
-  full_name='Address',
-  filename=None,
-  file=DESCRIPTOR,
-  containing_type=None,
-  create_key=_descriptor._internal_create_key,
-  fields=[
-    _descriptor.FieldDescriptor(
-      name='raw_lines', full_name='Address.raw_lines', index=0,
-      number=1, type=9, cpp_type=9, label=3,
-      has_default_value=False, default_value=[],
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
-  ],
-  extensions=[
-  ],
-  nested_types=[],
-  enum_types=[
-  ],
-  serialized_options=None,
-  is_extendable=False,
-  syntax='proto2',
-  extension_ranges=[],
-  oneofs=[
-  ],
-  serialized_start=16,
-  serialized_end=44,
-)
-
-
-_DEBTOR = _descriptor.Descriptor(
-  name='Debtor',
-  full_name='Debtor',
-  filename=None,
-  file=DESCRIPTOR,
-  containing_type=None,
-  create_key=_descriptor._internal_create_key,
-  fields=[
-    _descriptor.FieldDescriptor(
-      name='name', full_name='Debtor.name', index=0,
-      number=1, type=9, cpp_type=9, label=1,
-      has_default_value=False, default_value=b"".decode('utf-8'),
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
-    _descriptor.FieldDescriptor(
-      name='lex_id', full_name='Debtor.lex_id', index=1,
-      number=2, type=9, cpp_type=9, label=1,
-      has_default_value=False, default_value=b"".decode('utf-8'),
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
-    _descriptor.FieldDescriptor(
-      name='address', full_name='Debtor.address', index=2,
-      number=3, type=11, cpp_type=10, label=1,
-      has_default_value=False, default_value=None,
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
-    _descriptor.FieldDescriptor(
-      name='parsed_surname', full_name='Debtor.parsed_surname', index=3,
-      number=4, type=9, cpp_type=9, label=1,
-      has_default_value=False, default_value=b"".decode('utf-8'),
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
-    _descriptor.FieldDescriptor(
-      name='parsed_forenames', full_name='Debtor.parsed_forenames', index=4,
-      number=5, type=9, cpp_type=9, label=1,
-      has_default_value=False, default_value=b"".decode('utf-8'),
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
-  ],
-  extensions=[
-  ],
-  nested_types=[],
-  enum_types=[
-  ],
-  serialized_options=None,
-  is_extendable=False,
-  syntax='proto2',
-  extension_ranges=[],
-  oneofs=[
-  ],
-  serialized_start=46,
-  serialized_end=161,
-)
-
-
-_CREDITOR = _descriptor.Descriptor(
-  name='Creditor',
-  full_name='Creditor',
-  filename=None,
-  file=DESCRIPTOR,
-  containing_type=None,
-  create_key=_descriptor._internal_create_key,
-  fields=[
-    _descriptor.FieldDescriptor(
-      name='name', full_name='Creditor.name', index=0,
-      number=1, type=9, cpp_type=9, label=1,
-      has_default_value=False, default_value=b"".decode('utf-8'),
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
-  ],
-  extensions=[
-  ],
-  nested_types=[],
-  enum_types=[
-  ],
-  serialized_options=None,
-  is_extendable=False,
-  syntax='proto2',
-  extension_ranges=[],
-  oneofs=[
-  ],
-  serialized_start=163,
-  serialized_end=187,
-)
-
-
-_FILINGCOMPONENT = _descriptor.Descriptor(
-  name='FilingComponent',
-  full_name='FilingComponent',
-  filename=None,
-  file=DESCRIPTOR,
-  containing_type=None,
-  create_key=_descriptor._internal_create_key,
-  fields=[
-    _descriptor.FieldDescriptor(
-      name='category', full_name='FilingComponent.category', index=0,
-      number=1, type=9, cpp_type=9, label=1,
-      has_default_value=False, default_value=b"".decode('utf-8'),
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
-    _descriptor.FieldDescriptor(
-      name='filing_number', full_name='FilingComponent.filing_number', index=1,
-      number=2, type=9, cpp_type=9, label=1,
-      has_default_value=False, default_value=b"".decode('utf-8'),
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
-    _descriptor.FieldDescriptor(
-      name='raw_filing_date', full_name='FilingComponent.raw_filing_date', index=2,
-      number=3, type=9, cpp_type=9, label=1,
-      has_default_value=False, default_value=b"".decode('utf-8'),
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
-    _descriptor.FieldDescriptor(
-      name='filing_office', full_name='FilingComponent.filing_office', index=3,
-      number=4, type=9, cpp_type=9, label=1,
-      has_default_value=False, default_value=b"".decode('utf-8'),
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
-  ],
-  extensions=[
-  ],
-  nested_types=[],
-  enum_types=[
-  ],
-  serialized_options=None,
-  is_extendable=False,
-  syntax='proto2',
-  extension_ranges=[],
-  oneofs=[
-  ],
-  serialized_start=189,
-  serialized_end=295,
-)
-
-
-_FILINGINFO = _descriptor.Descriptor(
-  name='FilingInfo',
-  full_name='FilingInfo',
-  filename=None,
-  file=DESCRIPTOR,
-  containing_type=None,
-  create_key=_descriptor._internal_create_key,
-  fields=[
-    _descriptor.FieldDescriptor(
-      name='raw_filing_date', full_name='FilingInfo.raw_filing_date', index=0,
-      number=1, type=9, cpp_type=9, label=1,
-      has_default_value=False, default_value=b"".decode('utf-8'),
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
-    _descriptor.FieldDescriptor(
-      name='amount', full_name='FilingInfo.amount', index=1,
-      number=2, type=9, cpp_type=9, label=1,
-      has_default_value=False, default_value=b"".decode('utf-8'),
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
-    _descriptor.FieldDescriptor(
-      name='amount_usd', full_name='FilingInfo.amount_usd', index=2,
-      number=5, type=5, cpp_type=1, label=1,
-      has_default_value=False, default_value=0,
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
-    _descriptor.FieldDescriptor(
-      name='certificate_number', full_name='FilingInfo.certificate_number', index=3,
-      number=3, type=9, cpp_type=9, label=1,
-      has_default_value=False, default_value=b"".decode('utf-8'),
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
-    _descriptor.FieldDescriptor(
-      name='components', full_name='FilingInfo.components', index=4,
-      number=4, type=11, cpp_type=10, label=3,
-      has_default_value=False, default_value=[],
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
-  ],
-  extensions=[
-  ],
-  nested_types=[],
-  enum_types=[
-  ],
-  serialized_options=None,
-  is_extendable=False,
-  syntax='proto2',
-  extension_ranges=[],
-  oneofs=[
-  ],
-  serialized_start=298,
-  serialized_end=437,
-)
-
-
-_RECORD = _descriptor.Descriptor(
-  name='Record',
-  full_name='Record',
-  filename=None,
-  file=DESCRIPTOR,
-  containing_type=None,
-  create_key=_descriptor._internal_create_key,
-  fields=[
-    _descriptor.FieldDescriptor(
-      name='record_num', full_name='Record.record_num', index=0,
-      number=1, type=5, cpp_type=1, label=1,
-      has_default_value=False, default_value=0,
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
-    _descriptor.FieldDescriptor(
-      name='sequence_no', full_name='Record.sequence_no', index=1,
-      number=5, type=5, cpp_type=1, label=1,
-      has_default_value=False, default_value=0,
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
-    _descriptor.FieldDescriptor(
-      name='debtors', full_name='Record.debtors', index=2,
-      number=2, type=11, cpp_type=10, label=3,
-      has_default_value=False, default_value=[],
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
-    _descriptor.FieldDescriptor(
-      name='filing_info', full_name='Record.filing_info', index=3,
-      number=3, type=11, cpp_type=10, label=1,
-      has_default_value=False, default_value=None,
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
-    _descriptor.FieldDescriptor(
-      name='creditor', full_name='Record.creditor', index=4,
-      number=4, type=11, cpp_type=10, label=1,
-      has_default_value=False, default_value=None,
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
-  ],
-  extensions=[
-  ],
-  nested_types=[],
-  enum_types=[
-  ],
-  serialized_options=None,
-  is_extendable=False,
-  syntax='proto2',
-  extension_ranges=[],
-  oneofs=[
-  ],
-  serialized_start=440,
-  serialized_end=578,
-)
-
-
-_RECORDCOLLECTION = _descriptor.Descriptor(
-  name='RecordCollection',
-  full_name='RecordCollection',
-  filename=None,
-  file=DESCRIPTOR,
-  containing_type=None,
-  create_key=_descriptor._internal_create_key,
-  fields=[
-    _descriptor.FieldDescriptor(
-      name='records', full_name='RecordCollection.records', index=0,
-      number=1, type=11, cpp_type=10, label=3,
-      has_default_value=False, default_value=[],
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
-  ],
-  extensions=[
-  ],
-  nested_types=[],
-  enum_types=[
-  ],
-  serialized_options=None,
-  is_extendable=False,
-  syntax='proto2',
-  extension_ranges=[],
-  oneofs=[
-  ],
-  serialized_start=580,
-  serialized_end=624,
-)
-
-_DEBTOR.fields_by_name['address'].message_type = _ADDRESS
-_FILINGINFO.fields_by_name['components'].message_type = _FILINGCOMPONENT
-_RECORD.fields_by_name['debtors'].message_type = _DEBTOR
-_RECORD.fields_by_name['filing_info'].message_type = _FILINGINFO
-_RECORD.fields_by_name['creditor'].message_type = _CREDITOR
-_RECORDCOLLECTION.fields_by_name['records'].message_type = _RECORD
-DESCRIPTOR.message_types_by_name['Address'] = _ADDRESS
-DESCRIPTOR.message_types_by_name['Debtor'] = _DEBTOR
-DESCRIPTOR.message_types_by_name['Creditor'] = _CREDITOR
-DESCRIPTOR.message_types_by_name['FilingComponent'] = _FILINGCOMPONENT
-DESCRIPTOR.message_types_by_name['FilingInfo'] = _FILINGINFO
-DESCRIPTOR.message_types_by_name['Record'] = _RECORD
-DESCRIPTOR.message_types_by_name['RecordCollection'] = _RECORDCOLLECTION
-DESCRIPTOR.enum_types_by_name['ColumnType'] = _COLUMNTYPE
-_sym_db.RegisterFileDescriptor(DESCRIPTOR)
-
-Address = _reflection.GeneratedProtocolMessageType('Address', (_message.Message,), {
-  'DESCRIPTOR' : _ADDRESS,
-  '__module__' : 'record_pb2'
-  # @@protoc_insertion_point(class_scope:Address)
-  })
-_sym_db.RegisterMessage(Address)
-
-Debtor = _reflection.GeneratedProtocolMessageType('Debtor', (_message.Message,), {
-  'DESCRIPTOR' : _DEBTOR,
-  '__module__' : 'record_pb2'
-  # @@protoc_insertion_point(class_scope:Debtor)
-  })
-_sym_db.RegisterMessage(Debtor)
-
-Creditor = _reflection.GeneratedProtocolMessageType('Creditor', (_message.Message,), {
-  'DESCRIPTOR' : _CREDITOR,
-  '__module__' : 'record_pb2'
-  # @@protoc_insertion_point(class_scope:Creditor)
-  })
-_sym_db.RegisterMessage(Creditor)
-
-FilingComponent = _reflection.GeneratedProtocolMessageType('FilingComponent', (_message.Message,), {
-  'DESCRIPTOR' : _FILINGCOMPONENT,
-  '__module__' : 'record_pb2'
-  # @@protoc_insertion_point(class_scope:FilingComponent)
-  })
-_sym_db.RegisterMessage(FilingComponent)
-
-FilingInfo = _reflection.GeneratedProtocolMessageType('FilingInfo', (_message.Message,), {
-  'DESCRIPTOR' : _FILINGINFO,
-  '__module__' : 'record_pb2'
-  # @@protoc_insertion_point(class_scope:FilingInfo)
-  })
-_sym_db.RegisterMessage(FilingInfo)
-
-Record = _reflection.GeneratedProtocolMessageType('Record', (_message.Message,), {
-  'DESCRIPTOR' : _RECORD,
-  '__module__' : 'record_pb2'
-  # @@protoc_insertion_point(class_scope:Record)
-  })
-_sym_db.RegisterMessage(Record)
-
-RecordCollection = _reflection.GeneratedProtocolMessageType('RecordCollection', (_message.Message,), {
-  'DESCRIPTOR' : _RECORDCOLLECTION,
-  '__module__' : 'record_pb2'
-  # @@protoc_insertion_point(class_scope:RecordCollection)
-  })
-_sym_db.RegisterMessage(RecordCollection)
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0crecord.proto\"\x1c\n\x07\x41\x64\x64ress\x12\x11\n\traw_lines\x18\x01 \x03(\t\"\x87\x01\n\x06\x44\x65\x62tor\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\x0e\n\x06lex_id\x18\x02 \x01(\t\x12\x19\n\x07\x61\x64\x64ress\x18\x03 \x01(\x0b\x32\x08.Address\x12\x16\n\x0eparsed_surname\x18\x04 \x01(\t\x12\x18\n\x10parsed_forenames\x18\x05 \x01(\t\x12\x12\n\ncluster_id\x18\x06 \x01(\x05\"\x18\n\x08\x43reditor\x12\x0c\n\x04name\x18\x01 \x01(\t\"\x7f\n\x0f\x46ilingComponent\x12\x10\n\x08\x63\x61tegory\x18\x01 \x01(\t\x12\x15\n\rfiling_number\x18\x02 \x01(\t\x12\x17\n\x0fraw_filing_date\x18\x03 \x01(\t\x12\x15\n\rfiling_office\x18\x04 \x01(\t\x12\x13\n\x0b\x66iling_date\x18\x05 \x01(\x05\"\xa0\x01\n\nFilingInfo\x12\x17\n\x0fraw_filing_date\x18\x01 \x01(\t\x12\x13\n\x0b\x66iling_date\x18\x06 \x01(\x05\x12\x0e\n\x06\x61mount\x18\x02 \x01(\t\x12\x12\n\namount_usd\x18\x05 \x01(\x05\x12\x1a\n\x12\x63\x65rtificate_number\x18\x03 \x01(\t\x12$\n\ncomponents\x18\x04 \x03(\x0b\x32\x10.FilingComponent\"\x8a\x01\n\x06Record\x12\x12\n\nrecord_num\x18\x01 \x01(\x05\x12\x13\n\x0bsequence_no\x18\x05 \x01(\x05\x12\x18\n\x07\x64\x65\x62tors\x18\x02 \x03(\x0b\x32\x07.Debtor\x12 \n\x0b\x66iling_info\x18\x03 \x01(\x0b\x32\x0b.FilingInfo\x12\x1b\n\x08\x63reditor\x18\x04 \x01(\x0b\x32\t.Creditor\",\n\x10RecordCollection\x12\x18\n\x07records\x18\x01 \x03(\x0b\x32\x07.Record*o\n\nColumnType\x12\x1b\n\x17\x43OLUMN_TYPE_UNSPECIFIED\x10\x00\x12\x11\n\rRECORD_NUMBER\x10\x01\x12\n\n\x06\x44\x45\x42TOR\x10\x02\x12\x0b\n\x07\x41\x44\x44RESS\x10\x03\x12\n\n\x06\x46ILING\x10\x04\x12\x0c\n\x08\x43REDITOR\x10\x05')
 
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, globals())
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'record_pb2', globals())
+if _descriptor._USE_C_DESCRIPTORS == False:
 
+  DESCRIPTOR._options = None
+  _COLUMNTYPE._serialized_start=689
+  _COLUMNTYPE._serialized_end=800
+  _ADDRESS._serialized_start=16
+  _ADDRESS._serialized_end=44
+  _DEBTOR._serialized_start=47
+  _DEBTOR._serialized_end=182
+  _CREDITOR._serialized_start=184
+  _CREDITOR._serialized_end=208
+  _FILINGCOMPONENT._serialized_start=210
+  _FILINGCOMPONENT._serialized_end=337
+  _FILINGINFO._serialized_start=340
+  _FILINGINFO._serialized_end=500
+  _RECORD._serialized_start=503
+  _RECORD._serialized_end=641
+  _RECORDCOLLECTION._serialized_start=643
+  _RECORDCOLLECTION._serialized_end=687
 # @@protoc_insertion_point(module_scope)
@@ -0,0 +1,603 @@
+# resolve_debtors.py
+
+import argparse
+import array
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import re
+import struct
+import sys
+import tempfile
+import record_io
+import run_metrics
+
+# usage: python3 resolve_debtors.py INPUT_FILENAME [INPUT_FILENAME ...]
+#                                   [--input_mode {json,binary,...}]
+#                                   [--output_mode {json,binary,...}]
+#                                   [--output_suffix SUFFIX]
+#                                   [--max_block_size N] [--run_size N]
+#                                   [--stats_filename FILENAME]
+
+# entity resolution of debtors: works out which debtors, across every record
+# of every input file, are the same person or company, and writes the records
+# back out (to INPUT_FILENAME + --output_suffix) with Debtor.cluster_id set.
+#
+# comparing every debtor with every other is quadratic, so debtors are only
+# compared within blocks: groups of debtors sharing a blocking key.
+#
+#   lex_id       the debtor's LexID. debtors sharing one are the same person,
+#                and are linked without comparing them.
+#   name_zip     normalized name (surname and first forename initial, or
+#                company name) and ZIP code.
+#   name_street  normalized name and street line of the address.
+#
+# within a name block, two debtors match if their names agree (same surname
+# and compatible forenames, e.g. "DRACO D" and "DRACO DAMIEN", ignoring
+# suffixes like JR and PHD; or the same company name, ignoring INC, LLC and
+# the like) and they share a ZIP code or street line. debtors with different
+# LexIDs never match, and a cluster never ends up with two different LexIDs.
+#
+# within a block, a debtor joins the first cluster (earliest first) it
+# matches, not every one: "SMITH J" matching both "SMITH JOHN" and "SMITH
+# JAMES" doesn't make those two the same person, so it mustn't bridge them.
+# the later clusters it also matches are counted in the statistics
+# (matches_skipped). it's a guard against one debtor bridging two clusters in
+# one step, not a guarantee: once "SMITH J" has joined "SMITH JOHN", a later
+# comparison (in this block or another) can still join "SMITH JAMES" to them
+# through it.
+#
+# debtors in a block whose normalized features are identical (the same
+# person or company, repeated across records) are linked without comparing
+# them, and only one of each such variant is compared with the others, pair
+# by pair. blocks with more than --max_block_size variants are reported, and
+# skipped apart from linking debtors identical to one of their first
+# --max_block_size variants: that many variants usually means the key is too
+# coarse for the data (e.g. a common name in a populous ZIP code).
+#
+# memory use is 16 bytes per debtor, for the clusters (a union-find parent
+# array, and the LexID of each cluster), plus a bounded amount: the blocking
+# keys are spilled to sorted runs on disk and merged, and at most
+# --max_block_size variants of one block are held in memory at a time. the
+# inputs are read twice: once to collect the blocking keys, once to write
+# them out.
+#
+# the cluster_id of a debtor is one more than the position, over all the
+# inputs in order, of the first debtor of its cluster. resolving the same
+# inputs again gives the same ids, as does resolving them with more inputs
+# appended, unless the new debtors link existing clusters together.
+
+block_kinds = ("lex_id", "name_zip", "name_street")
+
+default_output_suffix = ".resolved"
+default_max_block_size = 1000
+
+# blocking key entries held in memory before a sorted run is spilled to disk.
+default_run_size = 1000000
+
+# number of largest blocks listed in the statistics.
+num_largest_blocks = 10
+
+# upper bounds of the buckets of the block size histogram.
+block_size_buckets = (1, 2, 5, 10, 100, 1000, 10000, 100000)
+
+no_lex_id = -1
+
+# a sorted run entry: key length, debtor number, features length.
+run_entry_header = struct.Struct("<iqi")
+
+name_suffixes = frozenset(["JR", "SR", "II", "III", "IV", "PHD", "MD", "DDS",
+        "DMD", "ESQ", "CPA"])
+company_suffixes = frozenset(["INC", "INCORPORATED", "LLC", "LLP", "LP",
+        "PLLC", "LTD", "LIMITED", "CO", "CORP", "CORPORATION", "COMPANY",
+        "PC", "THE"])
+street_abbreviations = {
+    "STREET": "ST", "AVENUE": "AVE", "BOULEVARD": "BLVD", "DRIVE": "DR",
+    "ROAD": "RD", "LANE": "LN", "COURT": "CT", "PLACE": "PL",
+    "HIGHWAY": "HWY", "PARKWAY": "PKWY", "SUITE": "STE", "APARTMENT": "APT",
+    "NORTH": "N", "SOUTH": "S", "EAST": "E", "WEST": "W",
+}
+
+non_word_pattern = re.compile(r"[\W_]+")
+# "LOS ANGELES, CA 90069-0100": state, then ZIP or ZIP+4, ending the line.
+zip_pattern = re.compile(r"\b[A-Z]{2} +([0-9]{5})(?:-[0-9]{4})?$")
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def tokens(text):
+    return non_word_pattern.sub(" ", text.upper()).split()
+
+
+def lex_id_number(lex_id):
+    # LexIDs are 12-digit numbers, stored as int64s. anything else is hashed
+    # into the same range.
+    if lex_id.isdigit() and len(lex_id) < 19:
+        return int(lex_id)
+    digest = hashlib.blake2b(lex_id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") & 0x7FFFFFFFFFFFFFFF
+
+
+def address_features(raw_lines):
+    # returns (ZIP code, normalized street line); either may be "".
+    zip_code = ""
+    street = ""
+    for line in raw_lines:
+        line = line.strip().upper()
+        if not zip_code:
+            match = zip_pattern.search(line)
+            if match:
+                zip_code = match.group(1)
+                continue
+        if not street and line[:1].isdigit():
+            street = " ".join([street_abbreviations.get(token, token)
+                    for token in tokens(line)])
+    return zip_code, street
+
+
+def debtor_features(debtor):
+    # returns (lex_id, surname, forenames, company, zip_code, street), with
+    # names as normalized token lists. surname and forenames are empty for
+    # companies, and company for people. 'debtor' is a record_model.Debtor or
+    # a Debtor proto.
+    surname = tokens(debtor.parsed_surname or "")
+    if surname:
+        forenames = [token for token in tokens(debtor.parsed_forenames or "")
+                if token not in name_suffixes]
+        company = []
+    else:
+        forenames = []
+        company = tokens(debtor.name or "")
+        company = ([token for token in company
+                if token not in company_suffixes] or company)
+    zip_code, street = address_features(debtor.address.raw_lines)
+    return (debtor.lex_id or "", surname, forenames, company, zip_code,
+            street)
+
+
+def blocking_keys(features):
+    lex_id, surname, forenames, company, zip_code, street = features
+    keys = []
+    if lex_id:
+        keys.append("lex_id:" + lex_id)
+    if surname:
+        name_key = " ".join(surname) + (" " + forenames[0][0]
+                if forenames else "")
+    else:
+        name_key = " ".join(company)
+    if name_key:
+        if zip_code:
+            keys.append("name_zip:" + name_key + "|" + zip_code)
+        if street:
+            keys.append("name_street:" + name_key + "|" + street)
+    return keys
+
+
+def forenames_compatible(forenames, other_forenames):
+    # "DRACO D" is compatible with "DRACO", "D" and "DRACO DAMIEN", but not
+    # with "DRACO R" or "DAMIEN".
+    for name, other_name in zip(forenames, other_forenames):
+        if name == other_name:
+            continue
+        if len(name) == 1 or len(other_name) == 1:
+            if name[0] == other_name[0]:
+                continue
+        return False
+    return True
+
+
+def debtors_match(features, other_features):
+    lex_id, surname, forenames, company, zip_code, street = features
+    (other_lex_id, other_surname, other_forenames, other_company,
+            other_zip_code, other_street) = other_features
+    if lex_id and other_lex_id and lex_id != other_lex_id:
+        return False
+    if not ((zip_code and zip_code == other_zip_code)
+            or (street and street == other_street)):
+        return False
+    if surname:
+        return (surname == other_surname
+                and forenames_compatible(forenames, other_forenames))
+    return not other_surname and company == other_company
+
+
+class _RunWriter:
+    # accumulates blocking key entries, spilling sorted runs to temporary
+    # files once there are too many to hold in memory.
+
+    def __init__(self, run_size, temp_dir):
+        self.run_size = run_size
+        self.temp_dir = temp_dir
+        self.entries = []
+        self.run_files = []
+        self.num_entries = 0
+
+    def add(self, key, debtor_num, encoded_features):
+        self.entries.append((key.encode("utf-8"), debtor_num,
+                encoded_features))
+        self.num_entries += 1
+        if len(self.entries) >= self.run_size:
+            self.spill()
+
+    def spill(self):
+        self.entries.sort()
+        run_file = tempfile.TemporaryFile(dir=self.temp_dir)
+        for encoded, debtor_num, encoded_features in self.entries:
+            run_file.write(run_entry_header.pack(len(encoded), debtor_num,
+                    len(encoded_features)))
+            run_file.write(encoded)
+            run_file.write(encoded_features)
+        run_file.seek(0)
+        self.run_files.append(run_file)
+        self.entries = []
+
+    def iter_sorted(self):
+        # entries come out grouped by key, and in debtor order within a key.
+        self.entries.sort()
+        runs = [iter_run(run_file) for run_file in self.run_files]
+        return heapq.merge(iter(self.entries), *runs)
+
+
+def iter_run(run_file):
+    while True:
+        header = run_file.read(run_entry_header.size)
+        if not header:
+            run_file.close()
+            return
+        key_length, debtor_num, features_length = run_entry_header.unpack(
+                header)
+        yield (run_file.read(key_length), debtor_num,
+                run_file.read(features_length))
+
+
+class Clusters:
+    # union-find over debtor numbers. each cluster is represented by its
+    # lowest debtor number, and remembers the LexID of its members, if any.
+
+    def __init__(self):
+        self.parents = array.array('q')
+        self.lex_ids = array.array('q')
+
+    def add(self, lex_id):
+        self.parents.append(len(self.parents))
+        self.lex_ids.append(lex_id_number(lex_id) if lex_id else no_lex_id)
+
+    def __len__(self):
+        return len(self.parents)
+
+    def find(self, debtor_num):
+        parents = self.parents
+        while parents[debtor_num] != debtor_num:
+            # path halving.
+            parents[debtor_num] = parents[parents[debtor_num]]
+            debtor_num = parents[debtor_num]
+        return debtor_num
+
+    def union(self, debtor_num, other_debtor_num):
+        # returns "merged", "same" if they're already in one cluster, or
+        # "conflict" if the clusters have different LexIDs.
+        root = self.find(debtor_num)
+        other_root = self.find(other_debtor_num)
+        if root == other_root:
+            return "same"
+        lex_id = self.lex_ids[root]
+        other_lex_id = self.lex_ids[other_root]
+        if (lex_id != no_lex_id and other_lex_id != no_lex_id
+                and lex_id != other_lex_id):
+            return "conflict"
+        if other_root < root:
+            root, other_root = other_root, root
+        self.parents[other_root] = root
+        if self.lex_ids[root] == no_lex_id:
+            self.lex_ids[root] = self.lex_ids[other_root]
+        return "merged"
+
+    def cluster_id(self, debtor_num):
+        return self.find(debtor_num) + 1
+
+    def num_clusters(self):
+        parents = self.parents
+        return sum(1 for debtor_num in range(len(parents))
+                if parents[debtor_num] == debtor_num)
+
+
+class BlockStats:
+    # block sizes, by kind of blocking key.
+
+    def __init__(self, max_block_size):
+        self.max_block_size = max_block_size
+        self.size_counts = {kind: {} for kind in block_kinds}  # size -> blocks
+        self.oversized = {kind: 0 for kind in block_kinds}
+        self.largest = []  # heap of (size, variants, key)
+
+    def add(self, kind, key, size, variants, oversized=False):
+        counts = self.size_counts[kind]
+        counts[size] = counts.get(size, 0) + 1
+        if oversized:
+            self.oversized[kind] += 1
+        entry = (size, variants, key)
+        if len(self.largest) < num_largest_blocks:
+            heapq.heappush(self.largest, entry)
+        elif entry > self.largest[0]:
+            heapq.heapreplace(self.largest, entry)
+
+    def kind_summary(self, kind):
+        counts = self.size_counts[kind]
+        sizes = sorted(counts)
+        num_blocks = sum(counts.values())
+        summary = {
+            "blocks": num_blocks,
+            "debtors": sum([size * count for size, count in counts.items()]),
+            "max": sizes[-1] if sizes else 0,
+            "oversized": self.oversized[kind],
+        }
+        for name, q in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99)):
+            summary[name] = 0
+            seen = 0
+            for size in sizes:
+                seen += counts[size]
+                if seen >= q * num_blocks:
+                    summary[name] = size
+                    break
+        buckets = {}
+        lower = 1
+        for upper in block_size_buckets + (None,):
+            label = (str(lower) + "+" if upper is None else str(lower)
+                    if upper == lower else str(lower) + "-" + str(upper))
+            buckets[label] = sum([count for size, count in counts.items()
+                    if size >= lower and (upper is None or size <= upper)])
+            if upper is not None:
+                lower = upper + 1
+        summary["buckets"] = buckets
+        return summary
+
+    def to_dict(self):
+        return {
+            "max_block_size": self.max_block_size,
+            "kinds": {kind: self.kind_summary(kind) for kind in block_kinds},
+            "largest_blocks": [{"key": key, "size": size,
+                    "variants": variants}
+                for size, variants, key in sorted(self.largest,
+                    reverse=True)],
+        }
+
+    def report(self):
+        lines = ["block sizes (debtors per block):"]
+        for kind in block_kinds:
+            summary = self.kind_summary(kind)
+            lines.append("  " + kind + ": " + str(summary["blocks"])
+                    + " blocks, " + str(summary["debtors"]) + " debtors, p50 "
+                    + str(summary["p50"]) + ", p90 " + str(summary["p90"])
+                    + ", p99 " + str(summary["p99"]) + ", max "
+                    + str(summary["max"]) + ", " + str(summary["oversized"])
+                    + " with over " + str(self.max_block_size)
+                    + " variants")
+            lines.append("    " + ", ".join([label + ": " + str(count)
+                    for label, count in summary["buckets"].items() if count]))
+        if self.largest:
+            lines.append("  largest blocks:")
+            for size, variants, key in sorted(self.largest, reverse=True):
+                lines.append("    " + str(size) + " debtors, " + str(variants)
+                        + " variants  " + key)
+        return "\n".join(lines)
+
+
+def open_input(filename, mode):
+    return open(filename, 'rb' if record_io.is_binary_mode(mode) else 'r')
+
+
+def collect_blocking_keys(input_filenames, input_mode, run_writer, clusters,
+        metrics):
+    # pass 1: numbers every debtor, and adds its blocking keys to run_writer.
+    for filename in input_filenames:
+        with open_input(filename, input_mode) as infile:
+            records = record_io.iter_records(infile, input_mode, as_model=True)
+            for record in run_metrics.timed_iter(records, metrics, "read"):
+                metrics.count("records_in")
+                with metrics.phase("block"):
+                    for debtor in record.debtors:
+                        debtor_num = len(clusters)
+                        features = debtor_features(debtor)
+                        clusters.add(features[0])
+                        encoded_features = json.dumps(features,
+                                separators=(",", ":")).encode("utf-8")
+                        for key in blocking_keys(features):
+                            run_writer.add(key, debtor_num, encoded_features)
+                metrics.count("debtors", len(record.debtors))
+                metrics.maybe_report_progress()
+
+
+def resolve_blocks(run_writer, clusters, block_stats, metrics):
+    # pass 2: links the debtors of each block. lex_id keys sort first, so
+    # every LexID's cluster is in place before any names are compared.
+    max_block_size = block_stats.max_block_size
+    for encoded, block in itertools.groupby(run_writer.iter_sorted(),
+            key=lambda entry: entry[0]):
+        key = encoded.decode("utf-8")
+        kind = key[:key.index(":")]
+        size = 0
+        if kind == "lex_id":
+            first_num = None
+            for _, debtor_num, _ in block:
+                size += 1
+                if first_num is None:
+                    first_num = debtor_num
+                else:
+                    metrics.count("links", kind=clusters.union(first_num,
+                            debtor_num))
+            # a LexID is a single variant: nothing in its block is compared.
+            block_stats.add(kind, key, size, 1)
+            metrics.count("blocks", kind=kind)
+            continue
+
+        # debtors that normalize to the same features always match, so only
+        # the first of each variant is compared with the others.
+        variants = {}  # encoded features -> debtor number
+        oversized = False
+        for _, debtor_num, encoded_features in block:
+            size += 1
+            first_num = variants.get(encoded_features)
+            if first_num is not None:
+                metrics.count("links", kind=clusters.union(first_num,
+                        debtor_num))
+            elif len(variants) < max_block_size:
+                variants[encoded_features] = debtor_num
+            else:
+                oversized = True
+        if oversized:
+            metrics.count("oversized_blocks", kind=kind)
+            metrics.count("oversized_block_debtors", size, kind=kind)
+        else:
+            compare_variants(variants, clusters, metrics)
+        block_stats.add(kind, key, size, len(variants), oversized)
+        metrics.count("blocks", kind=kind)
+
+
+def compare_variants(variants, clusters, metrics):
+    # the variants are grouped by the cluster they're in so far, and each
+    # variant without a LexID is compared with each group, earliest cluster
+    # first, joining the first group it matches a member of (a group with
+    # a different LexID can't be joined; the next one is tried). it's still
+    # compared with the groups after that, to count the matches skipped. two
+    # variants with LexIDs are never compared: they were either linked by
+    # their lex_id block, or can't match.
+    groups = {}  # cluster root -> features of its variants
+    without_lex_id = []
+    for encoded_features, debtor_num in variants.items():
+        features = json.loads(encoded_features)
+        if features[0]:
+            groups.setdefault(clusters.find(debtor_num), []).append(features)
+        else:
+            without_lex_id.append((debtor_num, features))
+
+    comparisons = 0
+    matches = 0
+    matches_skipped = 0
+    for debtor_num, features in without_lex_id:
+        group = groups.pop(clusters.find(debtor_num), [])
+        joined = False
+        for other_root in sorted(groups):
+            for other_features in groups[other_root]:
+                comparisons += 1
+                if debtors_match(features, other_features):
+                    break
+            else:
+                continue
+            if joined:
+                matches_skipped += 1
+                continue
+            matches += 1
+            link = clusters.union(debtor_num, other_root)
+            metrics.count("links", kind=link)
+            if link == "merged":
+                group.extend(groups.pop(other_root))
+                joined = True
+        group.append(features)
+        groups[clusters.find(debtor_num)] = group
+    metrics.count("comparisons", comparisons)
+    metrics.count("matches", matches)
+    metrics.count("matches_skipped", matches_skipped)
+
+
+def write_resolved(input_filenames, input_mode, output_mode, output_suffix,
+        clusters, metrics):
+    # pass 3: writes every input again, with each debtor's cluster_id set.
+    debtor_num = 0
+    for filename in input_filenames:
+        with open_input(filename, input_mode) as infile, open(
+                filename + output_suffix,
+                'wb' if record_io.is_binary_mode(output_mode) else 'w'
+                ) as outfile:
+            record_writer = record_io.RecordWriter(outfile, output_mode)
+            records = record_io.iter_records(infile, input_mode, as_model=True)
+            for record in run_metrics.timed_iter(records, metrics, "reread"):
+                for debtor in record.debtors:
+                    debtor.cluster_id = clusters.cluster_id(debtor_num)
+                    debtor_num += 1
+                with metrics.phase("write"):
+                    record_writer.write(record)
+                metrics.count("records_out")
+                metrics.maybe_report_progress()
+            record_writer.close()
+    if debtor_num != len(clusters):
+        raise ValueError("inputs changed while they were being resolved: "
+                + str(len(clusters)) + " debtors read at first, "
+                + str(debtor_num) + " the second time")
+
+
+def resolve_debtors(input_filenames, input_mode, output_mode,
+        output_suffix=default_output_suffix,
+        max_block_size=default_max_block_size, run_size=default_run_size,
+        metrics=None):
+    # returns the BlockStats of the run.
+    if metrics is None:
+        metrics = run_metrics.Metrics("resolve_debtors", progress_interval=0)
+    temp_dir = os.path.dirname(os.path.abspath(input_filenames[0]))
+    run_writer = _RunWriter(run_size, temp_dir)
+    clusters = Clusters()
+    block_stats = BlockStats(max_block_size)
+
+    collect_blocking_keys(input_filenames, input_mode, run_writer, clusters,
+            metrics)
+    # cluster ids are int32s.
+    if len(clusters) >= 2 ** 31 - 1:
+        raise ValueError("too many debtors to resolve: " + str(len(clusters)))
+    metrics.count("blocking_keys", run_writer.num_entries)
+    with metrics.phase("resolve"):
+        resolve_blocks(run_writer, clusters, block_stats, metrics)
+        metrics.count("clusters", clusters.num_clusters())
+    write_resolved(input_filenames, input_mode, output_mode, output_suffix,
+            clusters, metrics)
+    return block_stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="resolve_debtors")
+    parser.add_argument("input_filenames", type=str, nargs="+",
+            help="filenames of input records. debtors are resolved across "
+            + "all of them.")
+    parser.add_argument("--input_mode", type=str,
+            choices=record_io.record_modes, default="json",
+            help="format of input records. default: json")
+    parser.add_argument("--output_mode", type=str,
+            choices=record_io.record_modes, default=None,
+            help="format of output records. default: --input_mode")
+    parser.add_argument("--output_suffix", type=str,
+            default=default_output_suffix,
+            help="each input is written to its filename plus this suffix. "
+            + "default: " + default_output_suffix)
+    parser.add_argument("--max_block_size", type=int,
+            default=default_max_block_size,
+            help="name blocks with more distinct debtors than this aren't "
+            + "compared pair by pair, and are reported. default: "
+            + str(default_max_block_size))
+    parser.add_argument("--run_size", type=int, default=default_run_size,
+            help="blocking keys held in memory before they're spilled to a "
+            + "temporary file. default: " + str(default_run_size))
+    parser.add_argument("--stats_filename", type=str,
+            help="if supplied, write block size statistics to this file, "
+            + "as json.")
+    run_metrics.add_arguments(parser)
+    args = parser.parse_args()
+
+    if not args.output_suffix:
+        parser.error("--output_suffix can't be empty: inputs would be "
+                + "overwritten while they're read.")
+    if args.max_block_size < 2:
+        parser.error("--max_block_size must be at least 2.")
+    if args.run_size < 1:
+        parser.error("--run_size must be positive.")
+
+    metrics = run_metrics.Metrics("resolve_debtors", args.progress_interval)
+    block_stats = resolve_debtors(args.input_filenames, args.input_mode,
+            args.output_mode or args.input_mode, args.output_suffix,
+            args.max_block_size, args.run_size, metrics)
+    eprint(block_stats.report())
+    if args.stats_filename:
+        with open(args.stats_filename, 'w') as outfile:
+            json.dump(block_stats.to_dict(), outfile, indent=2)
+    metrics.finish(args.metrics_filename, args.metrics_format)
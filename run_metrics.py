@@ -0,0 +1,324 @@
+# run_metrics.py
+
+import bisect
+import contextlib
+import json
+import os
+import sys
+import time
+
+# run instrumentation shared by the pipeline tools: counters, cumulative
+# time per phase, and latency histograms.
+#
+#   counters     e.g. records_in, records_out, and records_failed by error
+#                kind. a counter may be split by a 'kind' label.
+#   phases       cumulative seconds spent in each phase of processing, e.g.
+#                column detection, parsing of each column, serialization.
+#   histograms   distributions of per-record latencies, in seconds.
+#
+# while a tool runs, a progress line goes to stderr every few seconds, and a
+# summary at the end. the same data can be written to a file as json, or in
+# the prometheus text format (e.g. for node_exporter's textfile collector).
+#
+# worker processes collect into their own Metrics, and hand a snapshot() back
+# with their results, which the parent merge()s. time per phase is then summed
+# over the workers, so it can add up to more than the elapsed time.
+
+metric_prefix = "sixelnixel_"
+
+default_progress_interval = 10.0
+
+# upper bounds of the latency histogram buckets, in seconds.
+latency_buckets = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+        0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 1.0)
+
+metrics_formats = ("json", "prometheus")
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+class Histogram:
+    def __init__(self, bounds=latency_buckets):
+        self.bounds = bounds
+        # the last bucket is for values above every bound.
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other):
+        for ind, count in enumerate(other.counts):
+            self.counts[ind] += count
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q):
+        # upper bound of the bucket holding the q-th quantile, or None if the
+        # histogram is empty. values above every bound report infinity.
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for ind, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                break
+        return self.bounds[ind] if ind < len(self.bounds) else float("inf")
+
+
+class PhaseTimer:
+    # context manager that adds the time spent in its block to a phase.
+
+    def __init__(self, metrics, phase):
+        self.metrics = metrics
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.add_time(self.phase, time.perf_counter() - self.start)
+        return False
+
+
+def untimed(phase):
+    # stands in for Metrics.phase where there are no metrics to collect.
+    return contextlib.nullcontext()
+
+
+def timed_iter(iterable, metrics, phase):
+    # yields the items of 'iterable', adding the time spent producing each of
+    # them (e.g. reading and decoding input) to a phase.
+    iterator = iter(iterable)
+    end = object()
+    while True:
+        start = time.perf_counter()
+        item = next(iterator, end)
+        metrics.add_time(phase, time.perf_counter() - start)
+        if item is end:
+            return
+        yield item
+
+
+class Metrics:
+    def __init__(self, tool, progress_interval=default_progress_interval):
+        self.tool = tool
+        self.counters = {}  # (name, kind or None) -> count
+        self.phases = {}  # name -> seconds
+        self.histograms = {}  # name -> Histogram
+        self.start_time = time.monotonic()
+        # 0 disables progress lines.
+        self.progress_interval = progress_interval
+        self.next_progress = self.start_time + progress_interval
+
+    def count(self, name, value=1, kind=None):
+        key = (name, kind)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def counter(self, name, kind=None):
+        return self.counters.get((name, kind), 0)
+
+    def add_time(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def phase(self, phase):
+        # e.g. "with metrics.phase('serialization'): ..."
+        return PhaseTimer(self, phase)
+
+    def observe(self, name, value):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(value)
+
+    def snapshot(self):
+        # a picklable copy, e.g. to send back from a worker process.
+        return {
+            "counters": dict(self.counters),
+            "phases": dict(self.phases),
+            "histograms": {name: (histogram.counts, histogram.count,
+                    histogram.sum)
+                for name, histogram in self.histograms.items()},
+        }
+
+    def merge(self, snapshot):
+        for key, value in snapshot["counters"].items():
+            self.counters[key] = self.counters.get(key, 0) + value
+        for phase, seconds in snapshot["phases"].items():
+            self.add_time(phase, seconds)
+        for name, (counts, count, total) in snapshot["histograms"].items():
+            other = Histogram()
+            other.counts, other.count, other.sum = list(counts), count, total
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                self.histograms[name] = other
+            else:
+                histogram.merge(other)
+
+    def elapsed(self):
+        return time.monotonic() - self.start_time
+
+    def maybe_report_progress(self):
+        # prints a progress line if one is due. cheap enough to call once per
+        # record.
+        if not self.progress_interval:
+            return
+        now = time.monotonic()
+        if now < self.next_progress:
+            return
+        self.next_progress = now + self.progress_interval
+        eprint(self.progress_line())
+
+    def progress_line(self):
+        elapsed = self.elapsed()
+        records_in = self.counter("records_in")
+        rate = records_in / elapsed if elapsed else 0.0
+        line = ("[" + self.tool + "] " + "{:.1f}".format(elapsed) + "s: "
+                + str(records_in) + " records in, "
+                + str(self.counter("records_out")) + " out")
+        failed = self.total("records_failed")
+        if failed:
+            line += ", " + str(failed) + " failed"
+        return line + " ({:.0f} records/s)".format(rate)
+
+    def total(self, name):
+        # sum of a counter over all of its kinds.
+        return sum([value for (counter_name, _), value in
+                self.counters.items() if counter_name == name])
+
+    def summary(self):
+        # multi-line, human-readable end-of-run summary.
+        elapsed = self.elapsed()
+        lines = [self.progress_line().replace(
+                "{:.1f}".format(elapsed) + "s:", "done in "
+                + "{:.1f}".format(elapsed) + "s:")]
+        for (name, kind), value in sorted(self.counters.items(),
+                key=lambda item: (item[0][0], item[0][1] or "")):
+            lines.append("  " + name + ("[" + kind + "]" if kind else "")
+                    + ": " + str(value))
+        for phase, seconds in sorted(self.phases.items(),
+                key=lambda item: -item[1]):
+            share = 100.0 * seconds / elapsed if elapsed else 0.0
+            lines.append("  time in " + phase + ": "
+                    + "{:.3f}s ({:.1f}%)".format(seconds, share))
+        for name, histogram in sorted(self.histograms.items()):
+            lines.append("  " + name + ": " + str(histogram.count)
+                    + " samples, mean " + format_seconds(
+                        histogram.sum / histogram.count if histogram.count
+                        else 0.0)
+                    + ", p50 <= " + format_seconds(histogram.quantile(0.5))
+                    + ", p99 <= " + format_seconds(histogram.quantile(0.99)))
+        return "\n".join(lines)
+
+    def to_dict(self):
+        counters = {}
+        for (name, kind), value in self.counters.items():
+            if kind is None:
+                counters[name] = value
+            else:
+                counters.setdefault(name, {})[kind] = value
+        return {
+            "tool": self.tool,
+            "elapsed_seconds": self.elapsed(),
+            "counters": counters,
+            "phase_seconds": self.phases,
+            "histograms": {name: {
+                    "bucket_bounds": list(histogram.bounds),
+                    "bucket_counts": histogram.counts,
+                    "count": histogram.count,
+                    "sum": histogram.sum}
+                for name, histogram in self.histograms.items()},
+        }
+
+    def to_prometheus(self):
+        tool_label = 'tool="' + self.tool + '"'
+        lines = []
+
+        def declare(name, metric_type):
+            lines.append("# TYPE " + metric_prefix + name + " " + metric_type)
+
+        declare("elapsed_seconds", "gauge")
+        lines.append(metric_prefix + "elapsed_seconds{" + tool_label + "} "
+                + repr(self.elapsed()))
+
+        declared = set()
+        for (name, kind), value in sorted(self.counters.items(),
+                key=lambda item: (item[0][0], item[0][1] or "")):
+            if name not in declared:
+                declare(name + "_total", "counter")
+                declared.add(name)
+            labels = tool_label
+            if kind is not None:
+                labels += ',kind="' + kind + '"'
+            lines.append(metric_prefix + name + "_total{" + labels + "} "
+                    + str(value))
+
+        declare("phase_seconds_total", "counter")
+        for phase, seconds in sorted(self.phases.items()):
+            lines.append(metric_prefix + "phase_seconds_total{" + tool_label
+                    + ',phase="' + phase + '"} ' + repr(seconds))
+
+        for name, histogram in sorted(self.histograms.items()):
+            declare(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(
+                    list(histogram.bounds) + ["+Inf"], histogram.counts):
+                cumulative += count
+                lines.append(metric_prefix + name + "_bucket{" + tool_label
+                        + ',le="' + str(bound) + '"} ' + str(cumulative))
+            lines.append(metric_prefix + name + "_sum{" + tool_label + "} "
+                    + repr(histogram.sum))
+            lines.append(metric_prefix + name + "_count{" + tool_label + "} "
+                    + str(histogram.count))
+        return "\n".join(lines) + "\n"
+
+    def write(self, filename, metrics_format="json"):
+        # written to the side and renamed into place, so that a scraper never
+        # reads a partial file.
+        with open(filename + ".tmp", 'w') as outfile:
+            if metrics_format == "prometheus":
+                outfile.write(self.to_prometheus())
+            else:
+                json.dump(self.to_dict(), outfile, indent=2)
+                outfile.write("\n")
+        os.replace(filename + ".tmp", filename)
+
+    def finish(self, filename=None, metrics_format="json"):
+        # prints the summary to stderr, and writes the metrics file, if any.
+        eprint(self.summary())
+        if filename:
+            self.write(filename, metrics_format)
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return "-"
+    if seconds == float("inf"):
+        return "inf"
+    if seconds < 0.001:
+        return "{:.0f}us".format(seconds * 1000000)
+    if seconds < 1.0:
+        return "{:.2f}ms".format(seconds * 1000)
+    return "{:.2f}s".format(seconds)
+
+
+def add_arguments(parser):
+    # the command line flags shared by every tool.
+    parser.add_argument("--metrics_filename", type=str,
+            help="if supplied, write run metrics (counters, time per phase, "
+            + "latency histograms) to this file at the end of the run.")
+    parser.add_argument("--metrics_format", type=str, choices=metrics_formats,
+            default="json",
+            help="format of --metrics_filename: json, or the prometheus "
+            + "text format. default: json")
+    parser.add_argument("--progress_interval", type=float,
+            default=default_progress_interval,
+            help="seconds between progress lines on stderr. 0 disables them. "
+            + "default: " + str(default_progress_interval))
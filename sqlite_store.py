@@ -0,0 +1,303 @@
+# sqlite_store.py
+
+import argparse
+import json
+import sqlite3
+import sys
+import record_io
+import record_model
+import run_metrics
+
+# usage: python3 sqlite_store.py load INPUT_FILENAME DB_FILENAME
+#                                [--input_mode {json,textproto,binary,...}]
+#                                [--batch_size N]
+#        python3 sqlite_store.py info DB_FILENAME
+
+# loads parsed records into a local sqlite database, with record.proto
+# normalized into tables:
+#
+#   creditors      one row per distinct Creditor.name
+#   records        one row per Record, with its FilingInfo scalars, and the
+#                  creditor_id of its creditor (or NULL)
+#   debtors        one row per Debtor, with the record_id of its record and
+#                  its position in it, and its cluster_id if the records
+#                  were resolved with resolve_debtors.py
+#   address_lines  one row per line of a debtor's Address
+#   components     one row per FilingComponent, with the record_id of its
+#                  record and its position in it
+#
+# unset fields are NULL. filing dates are stored parsed (filing_date: days
+# since 1970-01-01) as well as raw.
+#
+# the load is tuned for bulk inserts: rows are buffered and inserted with
+# executemany in large batches, all in a single transaction, with the
+# rollback journal in memory and no fsyncs. the secondary indexes are
+# dropped beforehand and built once everything is in, which is much faster
+# than maintaining them row by row. an interrupted load can leave the
+# database unusable, so load into a fresh file, or keep a copy.
+#
+# loading into an existing database appends to it.
+
+schema = (
+    "CREATE TABLE IF NOT EXISTS creditors ("
+        "creditor_id INTEGER PRIMARY KEY, "
+        "name TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS records ("
+        "record_id INTEGER PRIMARY KEY, "
+        "record_num INTEGER, "
+        "sequence_no INTEGER, "
+        "raw_filing_date TEXT, "
+        "filing_date INTEGER, "
+        "amount TEXT, "
+        "amount_usd INTEGER, "
+        "certificate_number TEXT, "
+        "creditor_id INTEGER REFERENCES creditors)",
+    "CREATE TABLE IF NOT EXISTS debtors ("
+        "debtor_id INTEGER PRIMARY KEY, "
+        "record_id INTEGER NOT NULL REFERENCES records, "
+        "position INTEGER NOT NULL, "
+        "name TEXT, "
+        "lex_id TEXT, "
+        "parsed_surname TEXT, "
+        "parsed_forenames TEXT, "
+        "cluster_id INTEGER)",
+    "CREATE TABLE IF NOT EXISTS address_lines ("
+        "debtor_id INTEGER NOT NULL REFERENCES debtors, "
+        "position INTEGER NOT NULL, "
+        "line TEXT NOT NULL, "
+        "PRIMARY KEY (debtor_id, position)) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS components ("
+        "component_id INTEGER PRIMARY KEY, "
+        "record_id INTEGER NOT NULL REFERENCES records, "
+        "position INTEGER NOT NULL, "
+        "category TEXT, "
+        "filing_number TEXT, "
+        "raw_filing_date TEXT, "
+        "filing_date INTEGER, "
+        "filing_office TEXT)",
+)
+
+# built after the load. (name, definition)
+indexes = (
+    ("creditors_by_name", "UNIQUE INDEX creditors_by_name ON creditors "
+        "(name)"),
+    ("records_by_creditor", "INDEX records_by_creditor ON records "
+        "(creditor_id)"),
+    ("records_by_amount_usd", "INDEX records_by_amount_usd ON records "
+        "(amount_usd)"),
+    ("debtors_by_record", "INDEX debtors_by_record ON debtors (record_id)"),
+    ("debtors_by_lex_id", "INDEX debtors_by_lex_id ON debtors (lex_id)"),
+    ("debtors_by_cluster", "INDEX debtors_by_cluster ON debtors "
+        "(cluster_id)"),
+    ("components_by_record", "INDEX components_by_record ON components "
+        "(record_id)"),
+    ("components_by_filing_number", "INDEX components_by_filing_number ON "
+        "components (filing_number)"),
+)
+
+tables = ("records", "creditors", "debtors", "address_lines", "components")
+
+bulk_load_pragmas = (
+    "PRAGMA journal_mode=MEMORY",
+    "PRAGMA synchronous=OFF",
+    "PRAGMA locking_mode=EXCLUSIVE",
+    "PRAGMA temp_store=MEMORY",
+    # in KiB, when negative: 256MB of page cache, which index builds use.
+    "PRAGMA cache_size=-262144",
+)
+
+# records buffered before their rows are inserted.
+default_batch_size = 50000
+
+
+def next_id(db, table, column):
+    return db.execute("SELECT COALESCE(MAX(" + column + "), 0) + 1 FROM "
+            + table).fetchone()[0]
+
+
+class SqliteStoreWriter:
+    # writes records to a sqlite database, one at a time. nothing is
+    # committed until close().
+
+    def __init__(self, filename, batch_size=default_batch_size):
+        self.filename = filename
+        self.batch_size = batch_size
+        self.db = sqlite3.connect(filename, isolation_level=None)
+        for pragma in bulk_load_pragmas:
+            self.db.execute(pragma)
+        self.db.execute("BEGIN")
+        for statement in schema:
+            self.db.execute(statement)
+        for name, _ in indexes:
+            self.db.execute("DROP INDEX IF EXISTS " + name)
+
+        self.creditor_ids = dict(
+                (name, creditor_id) for creditor_id, name in self.db.execute(
+                    "SELECT creditor_id, name FROM creditors"))
+        self.next_creditor_id = next_id(self.db, "creditors", "creditor_id")
+        self.next_record_id = next_id(self.db, "records", "record_id")
+        self.next_debtor_id = next_id(self.db, "debtors", "debtor_id")
+        self.next_component_id = next_id(self.db, "components",
+                "component_id")
+        self.record_count = 0
+        self.indexes_built = False
+        self.clear_rows()
+
+    def clear_rows(self):
+        self.creditor_rows = []
+        self.record_rows = []
+        self.debtor_rows = []
+        self.address_line_rows = []
+        self.component_rows = []
+
+    def creditor_id(self, name):
+        creditor_id = self.creditor_ids.get(name)
+        if creditor_id is None:
+            creditor_id = self.next_creditor_id
+            self.next_creditor_id += 1
+            self.creditor_ids[name] = creditor_id
+            self.creditor_rows.append((creditor_id, name))
+        return creditor_id
+
+    def write(self, record):
+        # 'record' is a record_model.Record, or a Record proto.
+        if not isinstance(record, record_model.Record):
+            record = record_model.Record.from_proto(record)
+        record_id = self.next_record_id
+        self.next_record_id += 1
+        filing_info = record.filing_info
+        creditor_name = record.creditor.name
+        self.record_rows.append((record_id, record.record_num,
+                record.sequence_no, filing_info.raw_filing_date,
+                filing_info.filing_date, filing_info.amount,
+                filing_info.amount_usd, filing_info.certificate_number,
+                self.creditor_id(creditor_name)
+                    if creditor_name is not None else None))
+
+        debtor_id = self.next_debtor_id
+        for position, debtor in enumerate(record.debtors):
+            self.debtor_rows.append((debtor_id, record_id, position,
+                    debtor.name, debtor.lex_id, debtor.parsed_surname,
+                    debtor.parsed_forenames, debtor.cluster_id))
+            self.address_line_rows.extend(
+                    [(debtor_id, line_position, line) for line_position, line
+                        in enumerate(debtor.address.raw_lines)])
+            debtor_id += 1
+        self.next_debtor_id = debtor_id
+
+        component_id = self.next_component_id
+        for position, component in enumerate(filing_info.components):
+            self.component_rows.append((component_id, record_id, position,
+                    component.category, component.filing_number,
+                    component.raw_filing_date, component.filing_date,
+                    component.filing_office))
+            component_id += 1
+        self.next_component_id = component_id
+
+        self.record_count += 1
+        if len(self.record_rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        db = self.db
+        db.executemany("INSERT INTO creditors VALUES (?, ?)",
+                self.creditor_rows)
+        db.executemany(
+                "INSERT INTO records VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                self.record_rows)
+        db.executemany("INSERT INTO debtors VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                self.debtor_rows)
+        db.executemany("INSERT INTO address_lines VALUES (?, ?, ?)",
+                self.address_line_rows)
+        db.executemany(
+                "INSERT INTO components VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                self.component_rows)
+        self.clear_rows()
+
+    def build_indexes(self):
+        # inserts what's left and builds the indexes. close() does this too,
+        # if it hasn't been done; calling flush() and build_indexes() first
+        # lets the inserts and the index build be timed apart.
+        self.flush()
+        for _, definition in indexes:
+            self.db.execute("CREATE " + definition)
+        self.indexes_built = True
+
+    def close(self):
+        # inserts what's left, builds the indexes and commits.
+        if not self.indexes_built:
+            self.build_indexes()
+        self.db.execute("COMMIT")
+        self.db.close()
+
+
+def table_counts(filename):
+    db = sqlite3.connect(filename)
+    try:
+        return {table: db.execute(
+                    "SELECT COUNT(*) FROM " + table).fetchone()[0]
+                for table in tables}
+    finally:
+        db.close()
+
+
+def load_records(instream, db_filename, input_mode,
+        batch_size=default_batch_size, metrics=None):
+    if metrics is None:
+        metrics = run_metrics.Metrics("sqlite_store", progress_interval=0)
+    store_writer = SqliteStoreWriter(db_filename, batch_size)
+    records = record_io.iter_records(instream, input_mode, as_model=True)
+    for record in run_metrics.timed_iter(records, metrics, "read"):
+        metrics.count("records_in")
+        with metrics.phase("load"):
+            store_writer.write(record)
+        metrics.count("records_out")
+        metrics.maybe_report_progress()
+    # the last, partial batch is inserted as part of the load.
+    with metrics.phase("load"):
+        store_writer.flush()
+    with metrics.phase("index"):
+        store_writer.build_indexes()
+    with metrics.phase("commit"):
+        store_writer.close()
+    return store_writer
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="sqlite_store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    load_parser = subparsers.add_parser("load",
+            help="load the records in a record file into a database, "
+            + "creating it if needed.")
+    load_parser.add_argument("input_filename", type=str,
+            help="filename of input records.")
+    load_parser.add_argument("db_filename", type=str,
+            help="filename of the sqlite database.")
+    load_parser.add_argument("--input_mode", type=str,
+            choices=record_io.record_modes, default="json",
+            help="format of input records. default: json")
+    load_parser.add_argument("--batch_size", type=int,
+            default=default_batch_size,
+            help="number of records whose rows are inserted at a time. "
+            + "default: " + str(default_batch_size))
+    run_metrics.add_arguments(load_parser)
+
+    info_parser = subparsers.add_parser("info",
+            help="print the row counts of a database.")
+    info_parser.add_argument("db_filename", type=str,
+            help="filename of the sqlite database.")
+
+    args = parser.parse_args()
+
+    if args.command == "load":
+        metrics = run_metrics.Metrics("sqlite_store", args.progress_interval)
+        infile = open(args.input_filename,
+                'rb' if record_io.is_binary_mode(args.input_mode) else 'r')
+        load_records(infile, args.db_filename, args.input_mode,
+                args.batch_size, metrics)
+        infile.close()
+        metrics.finish(args.metrics_filename, args.metrics_format)
+    elif args.command == "info":
+        json.dump(table_counts(args.db_filename), sys.stdout, indent=2)
+        print()